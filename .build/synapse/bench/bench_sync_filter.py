@@ -0,0 +1,224 @@
+# Copyright 2025 Alkemio Foundation
+# SPDX-License-Identifier: EUPL-1.2
+
+"""
+Offline benchmark for the AlkemioRoomControl /sync filter.
+
+Drives the patched get_sync_result_builder against the in-process stand-ins
+from ../tests (ModuleApi, SyncHandler, state storage), so no homeserver or
+database is needed. Every combination of joined-room count, hidden ratio and
+scenario is measured:
+
+- cold: empty visibility cache, every room is loaded from storage
+- warm: initial sync with every room cached
+- incremental: incremental sync with no visibility changes since the last one
+- up_front: sync_exclude_hidden_up_front with a pre-warmed visibility index
+- user_cache: warm, answered from the user's cached hidden room set
+
+Every scenario but user_cache runs with user_hidden_cache_size: 0, so it
+measures the filter itself at every room count. user_cache raises
+user_hidden_cache_max_rooms to the room count, so every count hits the
+cache.
+
+Latency is wall-clock time per sync (p50/p99, milliseconds). Allocation is
+the peak traced memory one sync allocates (p50, bytes), measured in a second
+pass under tracemalloc so it does not skew the latency numbers.
+
+Usage:
+    python bench_sync_filter.py [--rooms 10,100,1000,10000]
+        [--hidden-ratios 0,0.5,0.9,0.99]
+        [--scenarios cold,warm,incremental,up_front,user_cache]
+        [--iterations 200] [--storage-latency-ms 0] [--output results.json]
+
+Results are written as one JSON document (stdout by default).
+"""
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+TESTS_DIR = Path(__file__).resolve().parent.parent / "tests"
+if str(TESTS_DIR) not in sys.path:
+    sys.path.insert(0, str(TESTS_DIR))
+
+from twisted.internet import defer  # noqa: E402
+
+import standins  # noqa: E402
+
+USER = "@11111111-1111-1111-1111-111111111111:alkemio.matrix.host"
+SCENARIOS = ("cold", "warm", "incremental", "up_front", "user_cache")
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _run(coroutine):
+    """Run a coroutine whose stand-in dependencies resolve synchronously."""
+    results = []
+    defer.ensureDeferred(coroutine).addBoth(results.append)
+    result = results[0]
+    if isinstance(result, defer.Failure):
+        result.raiseException()
+    return result
+
+
+def _build(rooms: int, hidden_ratio: float, scenario: str, storage_latency: float):
+    config = {
+        "visibility_cache_size": max(rooms, 1) * 2,
+        "visibility_prewarm": scenario == "up_front",
+        "sync_exclude_hidden_up_front": scenario == "up_front",
+        "user_hidden_cache_size": 1 if scenario == "user_cache" else 0,
+        "user_hidden_cache_max_rooms": max(rooms, 1),
+    }
+    hs = standins.StandInHomeServer()
+    hs.state_storage.latency = storage_latency
+    module, api = standins.make_module(config, api=standins.StandInModuleApi(hs))
+
+    room_ids = [f"!room{i:06d}:alkemio.matrix.host" for i in range(rooms)]
+    hidden = round(rooms * hidden_ratio)
+    for i, room_id in enumerate(room_ids):
+        if i < hidden:
+            hs.state_storage.set_visibility(room_id, False)
+        elif i % 2:
+            hs.state_storage.set_visibility(room_id, True)
+        # the remaining visible rooms have no visibility event at all
+    hs.sync_handler.rooms_for_user[USER] = room_ids
+    if scenario == "up_front":
+        api.run_delayed_calls()
+    return module, hs
+
+
+def _make_sync(module, hs, scenario: str) -> Callable[[], object]:
+    """A callable doing one sync of the given scenario, primed as needed."""
+    handler = hs.sync_handler
+    sync_config = standins.sync_config_for(USER)
+
+    def sync(since_token=None):
+        return _run(handler.get_sync_result_builder(sync_config, since_token, False))
+
+    if scenario == "cold":
+        def cold_sync():
+            module._reset_visibility_state()
+            return sync()
+        return cold_sync
+
+    first = sync()
+    if scenario == "incremental":
+        token = first.now_token
+        return lambda: sync(token)
+    return sync
+
+
+def _measure(sync: Callable[[], object], iterations: int) -> Dict[str, float]:
+    for _ in range(min(10, iterations)):
+        sync()
+
+    latencies = []
+    gc.disable()
+    try:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            sync()
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        gc.enable()
+
+    allocations = []
+    tracemalloc.start()
+    try:
+        for _ in range(max(1, iterations // 10)):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            sync()
+            _, peak = tracemalloc.get_traced_memory()
+            allocations.append(peak - current)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": round(_percentile(latencies, 50), 4),
+        "p99_ms": round(_percentile(latencies, 99), 4),
+        "mean_ms": round(statistics.fmean(latencies), 4),
+        "alloc_peak_bytes_p50": int(statistics.median(allocations)),
+    }
+
+
+def run(
+    rooms: List[int],
+    hidden_ratios: List[float],
+    scenarios: List[str],
+    iterations: int,
+    storage_latency_ms: float,
+) -> dict:
+    results = []
+    for room_count in rooms:
+        for hidden_ratio in hidden_ratios:
+            for scenario in scenarios:
+                module, hs = _build(room_count, hidden_ratio, scenario, storage_latency_ms / 1000)
+                sync = _make_sync(module, hs, scenario)
+                measured = _measure(sync, iterations)
+                visible = len(sync().joined_room_ids)
+                results.append({
+                    "rooms": room_count,
+                    "hidden_ratio": hidden_ratio,
+                    "scenario": scenario,
+                    "visible_rooms": visible,
+                    **measured,
+                })
+                print(
+                    f"{scenario:>11} rooms={room_count:<6} hidden={hidden_ratio:<5} "
+                    f"p50={measured['p50_ms']:.3f}ms p99={measured['p99_ms']:.3f}ms "
+                    f"alloc={measured['alloc_peak_bytes_p50']}B",
+                    file=sys.stderr,
+                )
+    return {
+        "benchmark": "alkemio_sync_filter",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "storage_latency_ms": storage_latency_ms,
+        "results": results,
+    }
+
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rooms", type=_csv(int), default=[10, 100, 1000, 10000])
+    parser.add_argument("--hidden-ratios", type=_csv(float), default=[0.0, 0.5, 0.9, 0.99])
+    parser.add_argument("--scenarios", type=_csv(str), default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--storage-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = run(
+        args.rooms, args.hidden_ratios, args.scenarios, args.iterations, args.storage_latency_ms
+    )
+    document = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(document + "\n")
+    else:
+        print(document)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+# Copyright 2025 Alkemio Foundation
+# SPDX-License-Identifier: EUPL-1.2
+
+"""
+Load-test harness for the AlkemioRoomControl room-creation path.
+
+Runs on_create_room (check-room over real HTTP, then state injection) in a
+closed loop against a local stand-in adapter on 127.0.0.1. The adapter's
+response latency, failure rate and allow/deny mix are configurable, and an
+outage window can take it down mid-run. This shows how the module behaves
+under adapter failure: breaker fail-fast, admission rejections and recovery.
+
+Reports sustained creations per second (approved rooms), check throughput,
+latency percentiles overall and per outcome, and a per-second timeline of
+outcomes.
+
+Usage:
+    python load_create_room.py [--duration 10] [--concurrency 20]
+        [--adapter-latency-ms 20] [--adapter-jitter-ms 0] [--failure-rate 0]
+        [--allow-ratio 0.9] [--outage-at S --outage-for S] [--error-backoff-ms 100]
+        [--module-config '{"room_check_max_concurrent": 50}']
+        [--seed 1] [--output results.json]
+
+Results are written as one JSON document (stdout by default).
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+TESTS_DIR = Path(__file__).resolve().parent.parent / "tests"
+if str(TESTS_DIR) not in sys.path:
+    sys.path.insert(0, str(TESTS_DIR))
+
+from synapse.api.errors import SynapseError  # noqa: E402
+from synapse.types import create_requester  # noqa: E402
+from twisted.internet import defer, task  # noqa: E402
+from twisted.web import server  # noqa: E402
+
+import standins  # noqa: E402
+
+SERVER_NAME = "alkemio.matrix.host"
+
+
+def _percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return round(ordered[index], 3)
+
+
+class LoadTestAdapter(standins.StandInAdapter):
+    """
+    StandInAdapter answering with a seeded allow/deny/failure mix.
+
+    failure_rate of the checks fail (a 500, or an error entry in a batch);
+    of the rest, allow_ratio are approved with a fresh alkemio_room_id and
+    the others denied.
+    """
+
+    def __init__(self, reactor, rng: random.Random, latency: float, jitter: float,
+                 failure_rate: float, allow_ratio: float):
+        super().__init__(reactor)
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.allow_ratio = allow_ratio
+        self.answers: Counter = Counter()
+        self.down = False
+
+    async def go_down(self) -> None:
+        """Stop listening, lose responses in flight and drop kept-alive requests."""
+        self.down = True
+        await self.stop()
+
+    def come_up(self) -> None:
+        self.down = False
+        self.listen()
+
+    def _answer(self) -> Tuple[int, dict]:
+        if self.rng.random() < self.failure_rate:
+            self.answers["failure"] += 1
+            return 500, {"errcode": "M_UNKNOWN", "error": "stand-in failure"}
+        if self.rng.random() < self.allow_ratio:
+            self.answers["allow"] += 1
+            return 200, {"allow": True, "alkemio_room_id": str(uuid.uuid4())}
+        self.answers["deny"] += 1
+        return 200, {"allow": False, "reason": "stand-in denial"}
+
+    def render_POST(self, request):
+        checks = json.loads(request.content.read())
+        self.posts += 1
+        if self.down:
+            self.answers["dropped"] += 1
+            request.transport.abortConnection()
+            return server.NOT_DONE_YET
+        if request.path.endswith(b"/batch"):
+            code, body = 200, {"results": [
+                answer if status == 200 else {"error": answer}
+                for status, answer in (self._answer() for _ in checks["checks"])
+            ]}
+        else:
+            code, body = self._answer()
+
+        payload = json.dumps(body).encode()
+        request.setResponseCode(code)
+        request.setHeader(b"Content-Type", b"application/json")
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if not delay:
+            return payload
+
+        def respond():
+            if not request.finished and not request._disconnected:
+                request.write(payload)
+                request.finish()
+
+        self._delayed.append(self.reactor.callLater(delay, respond))
+        self._delayed = [d for d in self._delayed if d.active()]
+        return server.NOT_DONE_YET
+
+
+def _outcome(code: int) -> str:
+    return {200: "approved", 403: "denied", 429: "queue_full", 503: "unavailable"}.get(
+        code, f"http_{code}"
+    )
+
+
+async def _run(reactor, args) -> dict:
+    rng = random.Random(args.seed)
+    adapter = LoadTestAdapter(
+        reactor, rng,
+        latency=args.adapter_latency_ms / 1000,
+        jitter=args.adapter_jitter_ms / 1000,
+        failure_rate=args.failure_rate,
+        allow_ratio=args.allow_ratio,
+    )
+    module, api = standins.make_module(
+        args.module_config, api=standins.StandInModuleApi(standins.StandInHomeServer(reactor=reactor)),
+    )
+    module.adapter_url = adapter.listen()
+    on_create_room = api.third_party_rules_callbacks["on_create_room"]
+
+    started = reactor.seconds()
+    deadline = started + args.duration
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    timeline: Dict[int, Counter] = defaultdict(Counter)
+    counter = 0
+
+    async def create_room() -> str:
+        nonlocal counter
+        counter += 1
+        # Distinct creators so neither coalescing nor the denial cache
+        # collapses the load.
+        creator = f"@load-{counter}:{SERVER_NAME}"
+        content = {"invite": [f"@peer-{counter}:{SERVER_NAME}"], "is_direct": True}
+        begin = reactor.seconds()
+        try:
+            await on_create_room(create_requester(creator), content, False)
+            outcome = "approved"
+        except SynapseError as e:
+            outcome = _outcome(e.code)
+        end = reactor.seconds()
+        latencies[outcome].append((end - begin) * 1000)
+        timeline[int(end - started)][outcome] += 1
+        return outcome
+
+    async def worker() -> None:
+        while reactor.seconds() < deadline:
+            outcome = await create_room()
+            # Back off like a client would, or fail-fast 503s turn the
+            # closed loop into a busy spin.
+            if outcome not in ("approved", "denied") and args.error_backoff_ms:
+                await task.deferLater(reactor, args.error_backoff_ms / 1000, lambda: None)
+
+    async def outage() -> None:
+        await task.deferLater(reactor, args.outage_at, lambda: None)
+        await adapter.go_down()
+        await task.deferLater(reactor, args.outage_for, lambda: None)
+        adapter.come_up()
+
+    outage_d = defer.ensureDeferred(outage()) if args.outage_for else None
+    await defer.gatherResults(
+        [defer.ensureDeferred(worker()) for _ in range(args.concurrency)],
+        consumeErrors=True,
+    )
+    elapsed = reactor.seconds() - started
+    if outage_d is not None:
+        await outage_d
+
+    await adapter.stop()
+    await module.http_client.pool.closeCachedConnections()
+
+    all_latencies = [ms for samples in latencies.values() for ms in samples]
+    outcomes = {name: len(samples) for name, samples in sorted(latencies.items())}
+    return {
+        "benchmark": "alkemio_create_room_load",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key != "output"
+        },
+        "elapsed_s": round(elapsed, 3),
+        "attempts": len(all_latencies),
+        "attempts_per_s": round(len(all_latencies) / elapsed, 2),
+        "creations_per_s": round(outcomes.get("approved", 0) / elapsed, 2),
+        "outcomes": outcomes,
+        "adapter_answers": dict(adapter.answers),
+        "adapter_connections": adapter.connections,
+        "adapter_round_trips": adapter.posts,
+        "room_check_stats": module.room_check_stats(),
+        "latency_ms": {
+            name: {
+                "p50": _percentile(samples, 50),
+                "p90": _percentile(samples, 90),
+                "p99": _percentile(samples, 99),
+                "max": _percentile(samples, 100),
+            }
+            for name, samples in [("all", all_latencies), *sorted(latencies.items())]
+        },
+        "timeline": [
+            {"second": second, **dict(timeline[second])} for second in sorted(timeline)
+        ],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent creators")
+    parser.add_argument("--adapter-latency-ms", type=float, default=20.0)
+    parser.add_argument("--adapter-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of check-room calls answered with a 500")
+    parser.add_argument("--allow-ratio", type=float, default=0.9,
+                        help="fraction of the non-failing calls that are approved")
+    parser.add_argument("--outage-at", type=float, default=0.0,
+                        help="seconds into the run at which the adapter goes down")
+    parser.add_argument("--outage-for", type=float, default=0.0,
+                        help="seconds the adapter stays down (0 disables the outage)")
+    parser.add_argument("--error-backoff-ms", type=float, default=100.0,
+                        help="pause before a creator retries after a 429/503")
+    parser.add_argument("--module-config", type=json.loads, default={},
+                        help="JSON object of AlkemioRoomControl config overrides")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if not 0 <= args.failure_rate <= 1 or not 0 <= args.allow_ratio <= 1:
+        parser.error("--failure-rate and --allow-ratio must be between 0 and 1")
+    if args.duration <= 0 or args.concurrency <= 0:
+        parser.error("--duration and --concurrency must be positive")
+
+    # The module logs every check and adapter error; that would dominate the profile.
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("alkemio_room_control").setLevel(logging.CRITICAL)
+
+    report = {}
+
+    async def run(reactor):
+        report.update(await _run(reactor, args))
+
+    try:
+        task.react(lambda reactor: defer.ensureDeferred(run(reactor)))
+    except SystemExit as e:
+        if e.code:
+            raise
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(document + "\n")
+    else:
+        print(document)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
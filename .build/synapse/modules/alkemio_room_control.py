@@ -23,22 +23,1049 @@ All config values are automatically detected from the AppService with id 'alkemi
 - appservice_sender: AppService's sender_localpart
 - adapter_url: AppService's registered URL
 - hs_token: AppService's hs_token
+
+Bulk visibility updates (AppService or server admin access token):
+    POST /_synapse/client/alkemio/visibility
+    {"rooms": [{"room_id": "!abc:example.org", "visible": false}, ...]}
+Only rooms whose current io.alkemio.visibility differs get a new state event,
+sent by the AppService bot. The response carries a result per room:
+    {"results": [{"room_id": ..., "visible": ..., "result": "updated" | "unchanged" | "error",
+                  "errcode": ..., "error": ...}], "updated": n, "unchanged": n, "failed": n}
+
+Pending rooms (same access), oldest first, paginated with next_batch:
+    GET /_synapse/client/alkemio/pending_rooms?from=<next_batch>&limit=100
+    {"rooms": [{"room_id": ..., "alkemio_room_id": ..., "created_ts": ...}],
+     "next_batch": ..., "total": n}
+A room is pending while its current io.alkemio.pending state has a valid
+alkemio_room_id; the adapter clears the marker by sending it with empty content.
+
+Hidden rooms (io.alkemio.visibility {"visible": false}) are left out of /sync,
+Sliding Sync, /joined_rooms, /notifications, push badge counts, room
+summaries and the space hierarchy for everyone but the AppService bot.
+
+Tracing: with Synapse's opentracing enabled (and sampled per its jaeger
+config), each filtered sync gets an alkemio.sync_filter span tagged with room,
+hidden and cache hit/miss counts, with child spans for visibility reads and
+adapter check-room calls. With tracing off the span helpers are no-ops.
+
+Optional tuning (all keys optional, defaults shown):
+    config:
+      visibility_cache_size: 100000  # rooms kept in the in-memory visibility cache
+      visibility_lookup_batch_size: 500  # rooms per bulk visibility query
+      visibility_lookup_concurrency: 10  # parallel per-room reads when bulk fails
+      sync_state_cache_size: 50000  # (user, device) sync filter states kept for incremental syncs
+      user_hidden_cache_size: 50000  # users whose computed hidden room set is cached (0 disables)
+      user_hidden_cache_max_rooms: 5000  # users joined to more rooms than this are not cached
+      visibility_prewarm: true  # bulk-load all visibility state in the background at startup
+      visibility_prewarm_batch_size: 1000  # rooms per pre-warm page
+      sync_exclude_hidden_up_front: false  # pass hidden rooms to Synapse as excluded rooms
+      visibility_lookup_timeout_ms: 0  # give up on a visibility read after this long (0 disables)
+      visibility_serve_stale: false  # on a failed read, serve the last known value and refresh
+      visibility_update_max_rooms: 1000  # rooms accepted per bulk visibility update request
+      visibility_update_concurrency: 5  # visibility events sent in parallel by a bulk update
+      pending_room_index: true  # track rooms still carrying io.alkemio.pending and list them
+      pending_rooms_load_batch_size: 1000  # rooms per page of the startup pending room load
+      room_check_denial_ttl_ms: 5000  # reuse an adapter denial for identical checks (0 disables)
+      adapter_timeout_ms: 5000  # whole-call timeout for adapter requests
+      adapter_max_connections: 10  # keep-alive connections kept open to the adapter
+      adapter_breaker_failure_threshold: 5  # consecutive adapter failures that open the breaker
+      adapter_breaker_reset_ms: 30000  # how long the breaker fails fast before a trial call
+      room_check_max_concurrent: 20  # adapter checks in flight at once
+      room_check_max_queue: 50  # checks waiting for a slot; beyond this callers get 429
+      room_check_queue_timeout_ms: 2000  # longest wait for a slot before a 503
+      room_check_batch_window_ms: 0  # collect checks this long and send them as one batch (0 disables)
+      room_check_batch_max_size: 20  # send a batch as soon as it holds this many checks
 """
 
+import copy
+import itertools
+import json
 import logging
+import time
 import uuid
-from typing import Optional
-
-from synapse.module_api import ModuleApi
-from synapse.module_api.errors import Codes, SynapseError
-from synapse.http.client import SimpleHttpClient
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Collection,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import attr
+from prometheus_client import Counter, Gauge, Histogram
+from sortedcontainers import SortedList
+from twisted.internet import defer
+from twisted.web.client import Agent, HTTPConnectionPool
+
+from synapse.module_api import LoggingTransaction, ModuleApi
+from synapse.module_api.errors import Codes, ConfigError, SynapseError
+from synapse.api.constants import EventTypes
+from synapse.api.errors import HttpResponseException, LimitExceededError, NotFoundError
+from synapse.http.client import BaseHttpClient
+from synapse.http.server import DirectServeJsonResource
+from synapse.http.servlet import parse_integer, parse_json_object_from_request, parse_string
+from synapse.logging.context import (
+    PreserveLoggingContext,
+    make_deferred_yieldable,
+    run_in_background,
+)
+from synapse.logging.opentracing import set_tag, start_active_span
+from synapse.push import push_tools
+from synapse.rest.client.notifications import NotificationsServlet
+from synapse.rest.client.room import JoinedRoomsRestServlet
+from synapse.storage.database import make_in_list_sql_clause
 from synapse.types import Requester
+from synapse.util import Clock
+from synapse.util.async_helpers import ObservableDeferred, concurrently_execute, timeout_deferred
+from synapse.util.caches.stream_change_cache import StreamChangeCache
+from synapse.util.iterutils import batch_iter
 
 logger = logging.getLogger(__name__)
 
 # Custom state event type for room visibility control
 ALKEMIO_VISIBILITY_EVENT = "io.alkemio.visibility"
 
+# Reconciliation marker injected on approved room creation
+ALKEMIO_PENDING_EVENT = "io.alkemio.pending"
+
+VISIBILITY_UPDATE_PATH = "/_synapse/client/alkemio/visibility"
+PENDING_ROOMS_PATH = "/_synapse/client/alkemio/pending_rooms"
+
+sync_filter_duration = Histogram(
+    "synapse_alkemio_sync_filter_duration_seconds",
+    "Time the io.alkemio.visibility filter adds to building a sync room list",
+    ["mode"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+sync_filter_rooms_checked = Histogram(
+    "synapse_alkemio_sync_filter_rooms_checked",
+    "Rooms whose visibility the filter evaluated per sync",
+    ["mode"],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000),
+)
+sync_filter_hidden_rooms = Counter(
+    "synapse_alkemio_sync_filter_hidden_rooms_total",
+    "Rooms hidden from sync responses",
+    ["mode"],
+)
+user_hidden_cache_lookups = Counter(
+    "synapse_alkemio_user_hidden_cache_lookups_total",
+    "Per-user hidden room set lookups by the sync filter, by result: hit or miss",
+    ["result"],
+)
+visibility_lookup_errors = Counter(
+    "synapse_alkemio_visibility_lookup_errors_total",
+    "Visibility lookups that failed, hiding the room (fail closed)",
+)
+visibility_stale_served = Counter(
+    "synapse_alkemio_visibility_stale_served_total",
+    "Visibility lookups that failed and were answered from the last known value",
+)
+room_check_duration = Histogram(
+    "synapse_alkemio_room_check_duration_seconds",
+    "Latency of adapter check-room calls",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+room_check_outcomes = Counter(
+    "synapse_alkemio_room_check_outcomes_total",
+    "Adapter check-room results by outcome: allow, deny, invalid_id or error",
+    ["outcome"],
+)
+room_check_in_flight = Gauge(
+    "synapse_alkemio_room_check_in_flight",
+    "Adapter check-room calls currently running",
+)
+room_check_queue_depth = Gauge(
+    "synapse_alkemio_room_check_queue_depth",
+    "Check-room calls waiting for an admission slot",
+)
+room_check_queue_wait = Histogram(
+    "synapse_alkemio_room_check_queue_wait_seconds",
+    "Time check-room calls waited for an admission slot",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+room_check_batch_size = Histogram(
+    "synapse_alkemio_room_check_batch_size",
+    "Checks sent per batched check-room request",
+    buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+room_check_rejected = Counter(
+    "synapse_alkemio_room_check_rejected_total",
+    "Check-room calls turned away by admission control",
+    ["reason"],
+)
+
+
+def _parse_alkemio_room_id(resp: dict) -> Optional[str]:
+    """The canonical alkemio_room_id UUID from a check-room response, if valid."""
+    try:
+        return str(uuid.UUID(resp.get("alkemio_room_id", "")))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _is_visible(content: Dict[str, Any]) -> bool:
+    """A room is hidden only when its visibility content says {"visible": false}."""
+    return content.get("visible") is not False
+
+
+@dataclass(frozen=True)
+class AlkemioRoomControlConfig:
+    """Parsed module configuration; every value has a zero-config default."""
+
+    visibility_cache_size: int = 100_000
+    visibility_lookup_batch_size: int = 500
+    visibility_lookup_concurrency: int = 10
+    sync_state_cache_size: int = 50_000
+    user_hidden_cache_size: int = 50_000
+    user_hidden_cache_max_rooms: int = 5000
+    visibility_prewarm: bool = True
+    visibility_prewarm_batch_size: int = 1000
+    sync_exclude_hidden_up_front: bool = False
+    room_check_denial_ttl_ms: int = 5000
+    adapter_timeout_ms: int = 5000
+    adapter_max_connections: int = 10
+    adapter_breaker_failure_threshold: int = 5
+    adapter_breaker_reset_ms: int = 30000
+    room_check_max_concurrent: int = 20
+    room_check_max_queue: int = 50
+    room_check_queue_timeout_ms: int = 2000
+    visibility_lookup_timeout_ms: int = 0
+    visibility_serve_stale: bool = False
+    visibility_update_max_rooms: int = 1000
+    visibility_update_concurrency: int = 5
+    pending_room_index: bool = True
+    pending_rooms_load_batch_size: int = 1000
+    room_check_batch_window_ms: int = 0
+    room_check_batch_max_size: int = 20
+
+
+class RoomVisibilityCache:
+    """
+    Bounded LRU map of room_id -> visible for the io.alkemio.visibility state.
+
+    Entries are loaded on demand by the /sync filter and kept current as
+    visibility events are delivered, so steady-state syncs need no storage
+    calls.
+    A room without a visibility event is cached as visible.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: "OrderedDict[str, bool]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, room_id: str) -> Optional[bool]:
+        """Return the cached visibility, or None if the room is not cached."""
+        visible = self._entries.get(room_id)
+        if visible is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(room_id)
+        self.hits += 1
+        return visible
+
+    def peek(self, room_id: str) -> Optional[bool]:
+        """Like get, but without touching the LRU order or the counters."""
+        return self._entries.get(room_id)
+
+    def items(self) -> List[Tuple[str, bool]]:
+        return list(self._entries.items())
+
+    def set(self, room_id: str, visible: bool) -> None:
+        self._entries[room_id] = visible
+        self._entries.move_to_end(room_id)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, room_id: str) -> None:
+        self._entries.pop(room_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for logging and diagnostics."""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+@dataclass(frozen=True)
+class UserHiddenRooms:
+    """A user's joined rooms split by visibility, as computed by the sync filter."""
+
+    joined_room_ids: FrozenSet[str]
+    visible_room_ids: FrozenSet[str]
+    hidden_room_ids: FrozenSet[str]
+
+
+class UserHiddenRoomCache:
+    """
+    Bounded LRU map of user_id -> UserHiddenRooms.
+
+    An entry only answers for the exact joined room set it was computed from,
+    and is dropped when the user's membership changes or when any of those
+    rooms changes visibility, found through a room -> users index. Users
+    joined to more than max_rooms rooms are not cached, so the cache holds
+    at most max_size * max_rooms room IDs.
+    """
+
+    def __init__(self, max_size: int, max_rooms: int):
+        self._max_size = max_size
+        self._max_rooms = max_rooms
+        self._entries: "OrderedDict[str, UserHiddenRooms]" = OrderedDict()
+        self._users_by_room: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: str, joined_room_ids: FrozenSet[str]) -> Optional[UserHiddenRooms]:
+        """The user's entry if it was computed from joined_room_ids, else None."""
+        entry = self._entries.get(user_id)
+        if entry is None or entry.joined_room_ids != joined_room_ids:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def set(
+        self, user_id: str, joined_room_ids: Collection[str], visible_room_ids: Collection[str]
+    ) -> None:
+        self._discard(user_id)
+        if not self._max_size or len(joined_room_ids) > self._max_rooms:
+            return
+        joined_room_ids = frozenset(joined_room_ids)
+        visible_room_ids = frozenset(visible_room_ids)
+        self._entries[user_id] = UserHiddenRooms(
+            joined_room_ids, visible_room_ids, joined_room_ids - visible_room_ids
+        )
+        for room_id in joined_room_ids:
+            self._users_by_room.setdefault(room_id, set()).add(user_id)
+        if len(self._entries) > self._max_size:
+            evicted_user_id, _ = next(iter(self._entries.items()))
+            self._discard(evicted_user_id)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: str) -> None:
+        if self._discard(user_id):
+            self.invalidations += 1
+
+    def invalidate_room(self, room_id: str) -> None:
+        """Drop the entries of every user joined to room_id."""
+        for user_id in self._users_by_room.pop(room_id, ()):
+            if self._discard(user_id):
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._users_by_room.clear()
+
+    def _discard(self, user_id: str) -> bool:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return False
+        for room_id in entry.joined_room_ids:
+            users = self._users_by_room.get(room_id)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._users_by_room[room_id]
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for logging and diagnostics."""
+        return {
+            "size": len(self._entries),
+            "indexed_rooms": len(self._users_by_room),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class ReplicatedVisibilityInvalidation:
+    """
+    Cross-worker invalidation hook for the visibility cache.
+
+    Synapse replicates invalidations of objects registered through
+    ModuleApi.register_cached_function to every worker over the caches
+    replication stream, then calls invalidate(keys) or invalidate_all() on
+    the registered object there. This implements that protocol for our
+    cache; the replicated name is "<module>.<__name__>".
+    """
+
+    __name__ = "room_visibility"
+
+    def __init__(self, module: "AlkemioRoomControl"):
+        self._module = module
+
+    def invalidate(self, keys: Tuple[str, ...]) -> None:
+        self._module._invalidate_room_visibility(keys[0])
+
+    def invalidate_all(self) -> None:
+        self._module._reset_visibility_state()
+
+
+class PendingRoomIndex:
+    """
+    Rooms whose current state still carries io.alkemio.pending.
+
+    Maps room_id -> (created_ts, alkemio_room_id) and keeps the rooms sorted
+    by (created_ts, room_id), so a page costs O(log n + limit) and listing
+    never touches rooms that were reconciled long ago.
+    """
+
+    def __init__(self):
+        self._rooms: Dict[str, Tuple[int, str]] = {}
+        self._order = SortedList()
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._rooms
+
+    def add(self, room_id: str, alkemio_room_id: str, created_ts: int) -> None:
+        self.remove(room_id)
+        self._rooms[room_id] = (created_ts, alkemio_room_id)
+        self._order.add((created_ts, room_id))
+
+    def remove(self, room_id: str) -> None:
+        entry = self._rooms.pop(room_id, None)
+        if entry is not None:
+            self._order.remove((entry[0], room_id))
+
+    def clear(self) -> None:
+        self._rooms.clear()
+        self._order.clear()
+
+    def page(
+        self, after: Optional[Tuple[int, str]], limit: int
+    ) -> List[Tuple[int, str, str]]:
+        """Up to limit (created_ts, room_id, alkemio_room_id), oldest first, after `after`."""
+        keys = (
+            self._order.irange(minimum=after, inclusive=(False, True))
+            if after is not None
+            else iter(self._order)
+        )
+        return [
+            (created_ts, room_id, self._rooms[room_id][1])
+            for created_ts, room_id in itertools.islice(keys, limit)
+        ]
+
+
+class ReplicatedPendingRoomInvalidation:
+    """
+    Cross-worker hook for the pending room index, like
+    ReplicatedVisibilityInvalidation: a room invalidated here is re-read
+    from current state before the next listing.
+    """
+
+    __name__ = "pending_rooms"
+
+    def __init__(self, module: "AlkemioRoomControl"):
+        self._module = module
+
+    def invalidate(self, keys: Tuple[str, ...]) -> None:
+        self._module._invalidate_pending_room(keys[0])
+
+    def invalidate_all(self) -> None:
+        self._module._reset_pending_rooms()
+
+
+@dataclass(frozen=True)
+class SyncFilterState:
+    """
+    What the /sync filter decided for one (user, device) on its last sync.
+
+    The post-filter keeps only the visible rooms: almost every Alkemio room
+    is hidden, so this stays small. unresolved holds rooms whose lookup
+    failed, hidden or served from their last known value; they are
+    re-checked on the next sync. The up-front
+    exclusion keeps the rooms it excluded instead, in hidden_room_ids, and
+    sets excluded_up_front; neither path reuses the other's state.
+    """
+
+    room_stream_token: Any
+    visibility_stream_pos: int
+    visible_room_ids: FrozenSet[str]
+    unresolved_room_ids: FrozenSet[str]
+    hidden_room_ids: FrozenSet[str] = frozenset()
+    excluded_up_front: bool = False
+
+
+class RoomVisibilityEngine:
+    """
+    Decides which rooms a user must not see, for every client API the module filters.
+
+    /sync, Sliding Sync, /joined_rooms, /notifications, push badge counts,
+    room summaries and the space hierarchy all ask this engine. It answers
+    from the module's single visibility index (cache, hidden set and stream
+    of changes) and the per-user hidden set cache, so a room is hidden
+    everywhere as soon as it is hidden anywhere. Only the AppService bot sees hidden rooms.
+    """
+
+    def __init__(self, module: "AlkemioRoomControl", bot_mxid: str):
+        self._module = module
+        self._bot_mxid = bot_mxid
+
+    def is_exempt(self, user_id: Optional[str]) -> bool:
+        return user_id == self._bot_mxid
+
+    async def hidden_joined_rooms(
+        self, user_id: str, joined_room_ids: FrozenSet[str]
+    ) -> FrozenSet[str]:
+        """
+        The hidden rooms among all of a user's joined rooms; failed reads count as hidden.
+
+        Answered from the user's cached hidden set when it was computed from
+        the same joined rooms, and cached otherwise.
+        """
+        if self.is_exempt(user_id) or not joined_room_ids:
+            return frozenset()
+        module = self._module
+        cached = module._user_hidden_rooms.get(user_id, joined_room_ids)
+        set_tag("alkemio.hidden_set_cached", cached is not None)
+        if cached is not None:
+            user_hidden_cache_lookups.labels("hit").inc()
+            return cached.hidden_room_ids
+        user_hidden_cache_lookups.labels("miss").inc()
+        stream_pos = module._visibility_stream_pos
+        if module._visibility_index_complete:
+            hidden_room_ids = frozenset(await module._hidden_rooms_among(joined_room_ids))
+            # Stale rooms whose read failed are still stale.
+            resolved = module._stale_room_ids.isdisjoint(joined_room_ids)
+        else:
+            visible_room_ids, unresolved_room_ids = await module._evaluate_rooms(joined_room_ids)
+            hidden_room_ids = joined_room_ids - visible_room_ids
+            resolved = not unresolved_room_ids
+        if resolved:
+            module._cache_user_hidden_rooms(
+                user_id, joined_room_ids, joined_room_ids - hidden_room_ids, stream_pos
+            )
+        return hidden_room_ids
+
+    async def hidden_rooms_among(self, user_id: str, room_ids: Collection[str]) -> Set[str]:
+        """The hidden rooms among any rooms, joined or not; failed reads count as hidden."""
+        if self.is_exempt(user_id) or not room_ids:
+            return set()
+        return await self._module._hidden_rooms_among(room_ids)
+
+    async def is_hidden(self, user_id: Optional[str], room_id: str) -> bool:
+        if self.is_exempt(user_id):
+            return False
+        return bool(await self._module._hidden_rooms_among((room_id,)))
+
+
+class SlidingSyncVisibilityStore:
+    """
+    Wraps the datastore used by Sliding Sync's room-list computation.
+
+    SlidingSyncRoomLists builds every list from the user's room membership
+    map. Dropping hidden rooms from that map as it is read means they never
+    reach list filters, sorting, windowing or the per-room data fetches that
+    follow. Subscribed rooms missing from the map are fetched in a batch, so
+    that read drops hidden rooms too. Newly-left rooms are dropped from the
+    newly-left map instead (see _patch_sliding_sync_room_lists): a missing
+    get_sliding_sync_room_for_user result means a state reset to Synapse,
+    which adds the room back from that map. Everything else is delegated to
+    the real store.
+    """
+
+    def __init__(self, store: Any, engine: RoomVisibilityEngine):
+        self._store = store
+        self._engine = engine
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._store, name)
+
+    async def _without_hidden(self, user_id: str, rooms: Mapping[str, Any]) -> Mapping[str, Any]:
+        if self._engine.is_exempt(user_id) or not rooms:
+            return rooms
+        with sync_filter_duration.labels("sliding_sync").time(), start_active_span(
+            "alkemio.sync_filter", tags={"alkemio.mode": "sliding_sync"}
+        ):
+            hidden_room_ids = await self._engine.hidden_rooms_among(user_id, rooms)
+            set_tag("alkemio.rooms_joined", len(rooms))
+            set_tag("alkemio.rooms_hidden", len(hidden_room_ids))
+        sync_filter_rooms_checked.labels("sliding_sync").observe(len(rooms))
+        if not hidden_room_ids:
+            return rooms
+        sync_filter_hidden_rooms.labels("sliding_sync").inc(len(hidden_room_ids))
+        # The store result is cached and must not be mutated.
+        return {room_id: room for room_id, room in rooms.items() if room_id not in hidden_room_ids}
+
+    async def get_sliding_sync_rooms_for_user_from_membership_snapshots(
+        self, user_id: str
+    ) -> Mapping[str, Any]:
+        rooms = await self._store.get_sliding_sync_rooms_for_user_from_membership_snapshots(user_id)
+        return await self._without_hidden(user_id, rooms)
+
+    async def get_sliding_sync_self_leave_rooms_after_to_token(
+        self, user_id: str, to_token: Any
+    ) -> Mapping[str, Any]:
+        rooms = await self._store.get_sliding_sync_self_leave_rooms_after_to_token(user_id, to_token)
+        return await self._without_hidden(user_id, rooms)
+
+    async def get_sliding_sync_room_for_user_batch(
+        self, user_id: str, room_ids: Collection[str]
+    ) -> Mapping[str, Any]:
+        rooms = await self._store.get_sliding_sync_room_for_user_batch(user_id, room_ids)
+        return await self._without_hidden(user_id, rooms)
+
+    async def get_rooms_for_local_user_where_membership_is(
+        self, user_id: str, *args: Any, **kwargs: Any
+    ) -> List[Any]:
+        # Used by the fallback path while the sliding sync tables are populated.
+        rooms = await self._store.get_rooms_for_local_user_where_membership_is(
+            user_id, *args, **kwargs
+        )
+        visible = await self._without_hidden(user_id, {room.room_id: room for room in rooms})
+        return rooms if len(visible) == len(rooms) else list(visible.values())
+
+
+class ClientApiVisibilityStore:
+    """
+    Wraps the datastore read by /joined_rooms, /notifications and push badge
+    counts, like SlidingSyncVisibilityStore does for Sliding Sync.
+
+    A user's hidden rooms are dropped as these reads happen, so /joined_rooms
+    never lists them, /notifications never serializes their events and
+    badge counts never include them. Everything else is delegated to the
+    real store.
+    """
+
+    def __init__(self, store: Any, engine: RoomVisibilityEngine):
+        self._store = store
+        self._engine = engine
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._store, name)
+
+    async def get_rooms_for_user(self, user_id: str) -> FrozenSet[str]:
+        joined_room_ids = await self._store.get_rooms_for_user(user_id)
+        hidden_room_ids = await self._engine.hidden_joined_rooms(user_id, joined_room_ids)
+        if not hidden_room_ids:
+            return joined_room_ids
+        return joined_room_ids - hidden_room_ids
+
+    async def get_push_actions_for_user(
+        self,
+        user_id: str,
+        before: Optional[int] = None,
+        limit: int = 50,
+        only_highlight: bool = False,
+    ) -> List[Any]:
+        """
+        Push actions outside hidden rooms, newest first.
+
+        Pages past hidden rooms' actions so a full page stays full and the
+        servlet's next_token (the last action returned) stays correct.
+        """
+        actions: List[Any] = []
+        while True:
+            page = await self._store.get_push_actions_for_user(
+                user_id, before, limit, only_highlight=only_highlight
+            )
+            hidden_room_ids = await self._engine.hidden_rooms_among(
+                user_id, {action.room_id for action in page}
+            )
+            actions.extend(action for action in page if action.room_id not in hidden_room_ids)
+            if len(page) < limit or len(actions) >= limit:
+                return actions[:limit]
+            before = page[-1].stream_ordering
+
+
+# Real datastore -> ClientApiVisibilityStore for each homeserver in this
+# process running the module; read by the hooks _install_client_api_hooks sets.
+_client_api_stores: "weakref.WeakKeyDictionary[Any, ClientApiVisibilityStore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _install_client_api_hooks() -> None:
+    """
+    Route /joined_rooms, /notifications and push badge counts through
+    _client_api_stores. Idempotent.
+
+    The servlets are built when the listeners start, after modules load,
+    and are not reachable from the HomeServer, so their __init__ is wrapped;
+    HTTP pushers look the datastore up on every badge count, so
+    push_tools.get_badge_count is. Homeservers not running the module are
+    left alone.
+    """
+    for servlet_class in (JoinedRoomsRestServlet, NotificationsServlet):
+        original_init = servlet_class.__init__
+        if getattr(original_init, "alkemio_patched", False):
+            continue
+
+        def patched_init(servlet, hs, original_init=original_init):
+            original_init(servlet, hs)
+            servlet.store = _client_api_stores.get(servlet.store, servlet.store)
+
+        patched_init.alkemio_patched = True
+        servlet_class.__init__ = patched_init
+
+    original_get_badge_count = push_tools.get_badge_count
+    if getattr(original_get_badge_count, "alkemio_patched", False):
+        return
+
+    async def patched_get_badge_count(store, user_id: str, group_by_room: bool) -> int:
+        return await original_get_badge_count(
+            _client_api_stores.get(store, store), user_id, group_by_room
+        )
+
+    patched_get_badge_count.alkemio_patched = True
+    push_tools.get_badge_count = patched_get_badge_count
+
+
+class AlkemioAdminResource(DirectServeJsonResource):
+    """Base for module endpoints only the AppService and server admins may call."""
+
+    def __init__(self, module: "AlkemioRoomControl"):
+        super().__init__()
+        self._module = module
+
+    async def _authenticate(self, request: Any) -> Requester:
+        api = self._module.api
+        requester = await api.get_user_by_req(request)
+        app_service = requester.app_service
+        if not (
+            (app_service is not None and app_service.id == self._module.APPSERVICE_ID)
+            or await api.is_user_admin(requester.user.to_string())
+        ):
+            raise SynapseError(403, "Only the Alkemio AppService may call this endpoint", Codes.FORBIDDEN)
+        return requester
+
+
+class VisibilityUpdateResource(AlkemioAdminResource):
+    """
+    POST endpoint applying a batch of io.alkemio.visibility values.
+
+    Lets the Alkemio server reconcile room visibility in one request instead
+    of reading and writing state room by room.
+    """
+
+    async def _async_render_POST(self, request: Any) -> Tuple[int, dict]:
+        module = self._module
+        await self._authenticate(request)
+
+        body = parse_json_object_from_request(request)
+        rooms = body.get("rooms")
+        if not isinstance(rooms, list):
+            raise SynapseError(400, "'rooms' must be a list", Codes.BAD_JSON)
+        max_rooms = module.config.visibility_update_max_rooms
+        if len(rooms) > max_rooms:
+            raise SynapseError(413, f"At most {max_rooms} rooms per request", Codes.TOO_LARGE)
+
+        updates: Dict[str, bool] = {}
+        for index, room in enumerate(rooms):
+            if (
+                not isinstance(room, dict)
+                or not isinstance(room.get("room_id"), str)
+                or not room["room_id"].startswith("!")
+                or not isinstance(room.get("visible"), bool)
+            ):
+                raise SynapseError(
+                    400,
+                    f"rooms[{index}] needs a room_id and a boolean visible",
+                    Codes.INVALID_PARAM,
+                )
+            if room["room_id"] in updates:
+                raise SynapseError(
+                    400, f"Duplicate room_id {room['room_id']}", Codes.INVALID_PARAM
+                )
+            updates[room["room_id"]] = room["visible"]
+
+        results = await module.update_room_visibility(updates)
+        counts = {"updated": 0, "unchanged": 0, "error": 0}
+        for result in results:
+            counts[result["result"]] += 1
+        return 200, {
+            "results": results,
+            "updated": counts["updated"],
+            "unchanged": counts["unchanged"],
+            "failed": counts["error"],
+        }
+
+
+class PendingRoomsResource(AlkemioAdminResource):
+    """
+    GET endpoint paging through rooms still carrying io.alkemio.pending,
+    oldest first, for reconciliation and stuck-room detection.
+    """
+
+    MAX_LIMIT = 1000
+
+    async def _async_render_GET(self, request: Any) -> Tuple[int, dict]:
+        await self._authenticate(request)
+        limit = parse_integer(request, "limit", default=100)
+        if not 1 <= limit <= self.MAX_LIMIT:
+            raise SynapseError(400, f"limit must be between 1 and {self.MAX_LIMIT}", Codes.INVALID_PARAM)
+        after = None
+        from_token = parse_string(request, "from")
+        if from_token is not None:
+            created_ts, _, room_id = from_token.partition("_")
+            if not created_ts.isdigit() or not room_id:
+                raise SynapseError(400, "Invalid from token", Codes.INVALID_PARAM)
+            after = (int(created_ts), room_id)
+
+        page, total = await self._module.list_pending_rooms(after, limit)
+        body: Dict[str, Any] = {
+            "rooms": [
+                {"room_id": room_id, "alkemio_room_id": alkemio_room_id, "created_ts": created_ts}
+                for created_ts, room_id, alkemio_room_id in page
+            ],
+            "total": total,
+        }
+        if len(page) == limit:
+            created_ts, room_id, _ = page[-1]
+            body["next_batch"] = f"{created_ts}_{room_id}"
+        return 200, body
+
+
+class AdapterHttpClient(BaseHttpClient):
+    """
+    HTTP client reserved for adapter calls.
+
+    Keeps its own keep-alive connection pool, so adapter calls neither open
+    a connection per request nor compete with Synapse's other outbound
+    traffic, and bounds every call (connect, headers and body) by timeout_ms.
+    """
+
+    def __init__(self, hs: Any, max_connections: int, timeout_ms: int):
+        self._timeout = timeout_ms / 1000
+        # treq's timeout aborts the connection if the headers are late;
+        # post_json_get_json bounds the whole call, body included.
+        super().__init__(hs, treq_args={"timeout": self._timeout})
+
+        pool = HTTPConnectionPool(self.reactor)
+        pool.maxPersistentPerHost = max_connections
+        pool.cachedConnectionTimeout = 2 * 60
+        self.agent = Agent(
+            self.reactor,
+            contextFactory=hs.get_http_client_context_factory(),
+            connectTimeout=self._timeout,
+            pool=pool,
+        )
+        self.pool = pool
+
+    async def post_json_get_json(self, uri: str, post_json: Any, headers: Optional[dict] = None) -> Any:
+        """
+        Raises:
+            twisted.internet.defer.TimeoutError if the call takes longer than timeout_ms.
+        """
+        d = run_in_background(super().post_json_get_json, uri, post_json, headers)
+        return await make_deferred_yieldable(timeout_deferred(d, self._timeout, self.reactor))
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while a dependency is down.
+
+    After failure_threshold consecutive failures the breaker opens and
+    allow_request() refuses calls for reset_ms. Then one trial call is let
+    through (half-open): success closes the breaker, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, clock: Clock, failure_threshold: int, reset_ms: int):
+        self._clock = clock
+        self._failure_threshold = failure_threshold
+        self._reset_ms = reset_ms
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self._clock.time_msec() - self._opened_at >= self._reset_ms:
+            self.state = self.HALF_OPEN
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self._consecutive_failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self._consecutive_failures >= self._failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self._opened_at = self._clock.time_msec()
+
+
+class AdmissionRejected(Exception):
+    """Raised by AdmissionGate.acquire; reason is "queue_full" or "wait_timeout"."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionGate:
+    """
+    Bounded concurrency with a short FIFO wait queue.
+
+    At most max_concurrent holders at once; up to max_queue callers wait for
+    a slot, each for at most max_wait_ms. Callers beyond that are refused
+    immediately rather than queued.
+    """
+
+    def __init__(self, clock: Clock, max_concurrent: int, max_queue: int, max_wait_ms: int):
+        self._clock = clock
+        self._max_concurrent = max_concurrent
+        self._max_queue = max_queue
+        self._max_wait = max_wait_ms / 1000
+        self.in_flight = 0
+        # waiter -> its timeout, in arrival order
+        self._waiters: "OrderedDict[defer.Deferred, Any]" = OrderedDict()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        """
+        Take a slot, waiting in the queue if needed. Pair with release().
+
+        Raises:
+            AdmissionRejected if the queue is full or the wait times out.
+        """
+        if self.in_flight < self._max_concurrent and not self._waiters:
+            self.in_flight += 1
+            room_check_in_flight.inc()
+            return
+        if len(self._waiters) >= self._max_queue:
+            raise AdmissionRejected("queue_full")
+
+        waiter: defer.Deferred = defer.Deferred()
+        self._waiters[waiter] = self._clock.call_later(self._max_wait, self._expire, waiter)
+        room_check_queue_depth.inc()
+        started = self._clock.time()
+        try:
+            # release() hands its slot straight to us.
+            await make_deferred_yieldable(waiter)
+        except defer.CancelledError:
+            timeout = self._waiters.pop(waiter, None)
+            if timeout is not None:
+                timeout.cancel()
+                room_check_queue_depth.dec()
+            raise
+        finally:
+            room_check_queue_wait.observe(self._clock.time() - started)
+
+    def release(self) -> None:
+        if self._waiters:
+            waiter, timeout = self._waiters.popitem(last=False)
+            timeout.cancel()
+            room_check_queue_depth.dec()
+            with PreserveLoggingContext():
+                waiter.callback(None)
+            return
+        self.in_flight -= 1
+        room_check_in_flight.dec()
+
+    def _expire(self, waiter: defer.Deferred) -> None:
+        if self._waiters.pop(waiter, None) is not None:
+            room_check_queue_depth.dec()
+            with PreserveLoggingContext():
+                waiter.errback(AdmissionRejected("wait_timeout"))
+
+
+class RoomCheckBatcher:
+    """
+    Micro-batches check-room calls.
+
+    Payloads submitted within window_ms of the first one, or until max_size
+    are waiting, go to send_batch as one list. send_batch returns one entry
+    per payload, either the response or an exception for that caller alone;
+    if it raises, every caller in the batch gets that error.
+    """
+
+    def __init__(
+        self,
+        clock: Clock,
+        window_ms: int,
+        max_size: int,
+        send_batch: Callable[[List[dict]], Awaitable[List[Union[dict, Exception]]]],
+    ):
+        self._clock = clock
+        self._window = window_ms / 1000
+        self._max_size = max_size
+        self._send_batch = send_batch
+        self._pending: List[Tuple[dict, defer.Deferred]] = []
+        self._timer: Any = None
+        self.batches = 0
+
+    async def submit(self, payload: dict) -> dict:
+        waiter: defer.Deferred = defer.Deferred()
+        self._pending.append((payload, waiter))
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self._clock.call_later(self._window, self._flush)
+        return await make_deferred_yieldable(waiter)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            if self._timer.active():
+                self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        self.batches += 1
+        run_in_background(self._run_batch, batch)
+
+    async def _run_batch(self, batch: List[Tuple[dict, defer.Deferred]]) -> None:
+        try:
+            results: List[Any] = await self._send_batch([payload for payload, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, waiter), result in zip(batch, results):
+            if waiter.called:
+                # The caller went away (cancelled) while the batch was out.
+                continue
+            with PreserveLoggingContext():
+                if isinstance(result, Exception):
+                    waiter.errback(result)
+                else:
+                    waiter.callback(result)
+
 
 class AlkemioRoomControl:
     """
@@ -52,9 +1079,159 @@ class AlkemioRoomControl:
     # Hardcoded AppService ID - must match registration.yaml
     APPSERVICE_ID = "alkemio-matrix-adapter"
 
-    def __init__(self, config: dict, api: ModuleApi):
+    # A failed pending room load is retried after this delay, doubled per
+    # consecutive failure up to the maximum.
+    PENDING_ROOMS_LOAD_RETRY_MS = 1000
+    PENDING_ROOMS_LOAD_MAX_RETRY_MS = 60_000
+
+    @staticmethod
+    def parse_config(config: Optional[dict]) -> AlkemioRoomControlConfig:
+        """Validate the optional module config; unknown keys are rejected."""
+        config = config or {}
+        unknown = set(config) - set(AlkemioRoomControlConfig.__dataclass_fields__)
+        if unknown:
+            raise ConfigError(
+                f"Unknown AlkemioRoomControl config keys: {', '.join(sorted(unknown))}"
+            )
+
+        values = {}
+        for key in (
+            "visibility_cache_size",
+            "visibility_lookup_batch_size",
+            "visibility_lookup_concurrency",
+            "sync_state_cache_size",
+            "user_hidden_cache_max_rooms",
+            "visibility_prewarm_batch_size",
+            "pending_rooms_load_batch_size",
+            "adapter_timeout_ms",
+            "adapter_max_connections",
+            "adapter_breaker_failure_threshold",
+            "adapter_breaker_reset_ms",
+            "room_check_max_concurrent",
+            "room_check_max_queue",
+            "room_check_queue_timeout_ms",
+            "visibility_update_max_rooms",
+            "visibility_update_concurrency",
+            "room_check_batch_max_size",
+        ):
+            value = config.get(key, getattr(AlkemioRoomControlConfig, key))
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ConfigError(f"{key} must be a positive integer")
+            values[key] = value
+
+        for key in (
+            "room_check_denial_ttl_ms",
+            "visibility_lookup_timeout_ms",
+            "user_hidden_cache_size",
+            "room_check_batch_window_ms",
+        ):
+            value = config.get(key, getattr(AlkemioRoomControlConfig, key))
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise ConfigError(f"{key} must be a non-negative integer")
+            values[key] = value
+
+        for key in (
+            "visibility_prewarm",
+            "sync_exclude_hidden_up_front",
+            "visibility_serve_stale",
+            "pending_room_index",
+        ):
+            value = config.get(key, getattr(AlkemioRoomControlConfig, key))
+            if not isinstance(value, bool):
+                raise ConfigError(f"{key} must be a boolean")
+            values[key] = value
+
+        return AlkemioRoomControlConfig(**values)
+
+    def __init__(self, config: AlkemioRoomControlConfig, api: ModuleApi):
         self.api = api
+        self.config = config
         self._http_client = None  # Lazy initialization
+        self._clock = api._hs.get_clock()
+        self._reactor = api._hs.get_reactor()
+        self._adapter_breaker = CircuitBreaker(
+            self._clock,
+            config.adapter_breaker_failure_threshold,
+            config.adapter_breaker_reset_ms,
+        )
+        self._room_check_gate = AdmissionGate(
+            self._clock,
+            config.room_check_max_concurrent,
+            config.room_check_max_queue,
+            config.room_check_queue_timeout_ms,
+        )
+
+        # With a batch window, admitted checks are sent to the adapter's batch
+        # endpoint in groups instead of one request each.
+        self._room_check_batcher: Optional[RoomCheckBatcher] = None
+        if config.room_check_batch_window_ms:
+            self._room_check_batcher = RoomCheckBatcher(
+                self._clock,
+                config.room_check_batch_window_ms,
+                config.room_check_batch_max_size,
+                self._check_room_batch,
+            )
+
+        # Identical concurrent check-room calls share one adapter request, and
+        # denials are reused for room_check_denial_ttl_ms. Keys are
+        # (creator, frozenset(members), is_direct).
+        self._room_checks_in_flight: Dict[tuple, ObservableDeferred] = {}
+        # key -> (expiry in ms, denial response), in expiry order
+        self._room_check_denials: "OrderedDict[tuple, Tuple[int, dict]]" = OrderedDict()
+        self._room_check_counters = {
+            "requests": 0,
+            "adapter_calls": 0,
+            "coalesced": 0,
+            "cached_denials": 0,
+        }
+
+        # room_id -> visible, shared by every /sync on this worker
+        self._visibility_cache = RoomVisibilityCache(config.visibility_cache_size)
+        # Every room known to be hidden. Unlike the LRU this is never evicted,
+        # so once the pre-warm completes it is the authoritative hidden set.
+        self._hidden_room_ids: Set[str] = set()
+        self._state_storage = api._hs.get_storage_controllers().state
+        self._store = api._hs.get_datastores().main
+
+        # Module-local stream of visibility changes: each cache update bumps the
+        # position and records the room, so incremental syncs only re-check
+        # rooms that changed since the state they were computed from.
+        self._visibility_stream_pos = 0
+        self._visibility_changes = StreamChangeCache(
+            "AlkemioRoomVisibilityChanges", self._visibility_stream_pos
+        )
+        # (user_id, device_id) -> SyncFilterState, LRU-bounded
+        self._sync_states: "OrderedDict[Tuple[str, Optional[str]], SyncFilterState]" = OrderedDict()
+        # user_id -> the user's hidden room set, shared by all their devices.
+        # Visibility changes drop it through _record_visibility_change and
+        # membership events as they are delivered; a changed room list the
+        # worker has not seen yet simply misses.
+        self._user_hidden_rooms = UserHiddenRoomCache(
+            config.user_hidden_cache_size, config.user_hidden_cache_max_rooms
+        )
+
+        # Every worker keeps its own cache; the worker that persists a
+        # visibility event broadcasts an invalidation to the others.
+        self._instance_name = api._hs.get_instance_name()
+        self._visibility_invalidation = ReplicatedVisibilityInvalidation(self)
+        self.api.register_cached_function(self._visibility_invalidation)
+
+        # Set once the startup pre-warm has loaded every room's visibility:
+        # from then on a cache miss is answered from _hidden_room_ids, except
+        # for rooms invalidated since (stale) which are read directly.
+        # A reset bumps the generation so an in-flight pre-warm stops.
+        self._visibility_index_complete = False
+        self._visibility_generation = 0
+        self._stale_room_ids: Set[str] = set()
+
+        # With visibility_serve_stale, what we knew about rooms whose entry was
+        # dropped: values of invalidated rooms, the cache as of the last reset,
+        # and the hidden set as of that reset if the index was complete then.
+        # Only consulted when a read fails; failed rooms are then re-read in
+        # the background (_refreshing_room_ids).
+        self._last_known_visibility = RoomVisibilityCache(config.visibility_cache_size)
+        self._last_known_hidden_room_ids: Optional[Set[str]] = None
+        self._refreshing_room_ids: Set[str] = set()
 
         # Auto-detect homeserver domain from Synapse's server_name
         self.homeserver_domain = api.server_name
@@ -68,89 +1245,134 @@ class AlkemioRoomControl:
         self.hs_token = detected.get("hs_token")
 
         # Register third-party rules callback for room creation control
-        # This allows us to raise SynapseError with custom messages
+        # This allows us to raise SynapseError with custom messages.
+        # No on_new_event callback: once one is registered Synapse fetches
+        # every persisted event and its room's full current state on every
+        # worker before notifying clients. _patch_notifier watches delivered
+        # events instead.
         self.api.register_third_party_rules_callbacks(
             on_create_room=self.on_create_room,
         )
 
+        self.api.register_web_resource(VISIBILITY_UPDATE_PATH, VisibilityUpdateResource(self))
+
+        # Rooms still waiting for adapter reconciliation. Loaded from current
+        # state in the background at startup, then kept up to date as
+        # io.alkemio.pending events are delivered and by replicated invalidations from other
+        # workers; invalidated rooms are re-read before the next listing.
+        # Rooms changed while loading are skipped by the loader.
+        self._pending_rooms = PendingRoomIndex()
+        self._pending_rooms_loaded = False
+        self._pending_rooms_generation = 0
+        self._pending_rooms_touched: Set[str] = set()
+        self._dirty_pending_room_ids: Set[str] = set()
+        self._pending_invalidation = ReplicatedPendingRoomInvalidation(self)
+        if config.pending_room_index:
+            self.api.register_cached_function(self._pending_invalidation)
+            self.api.register_web_resource(PENDING_ROOMS_PATH, PendingRoomsResource(self))
+            self._schedule_pending_rooms_load()
+
+        # Every client API filter asks the same engine.
+        self.visibility_engine = RoomVisibilityEngine(
+            self, f"@{self.appservice_sender}:{self.homeserver_domain}"
+        )
+
+        # Follow visibility, pending and membership changes as events are delivered
+        self._patch_notifier()
+
         # Monkey-patch SyncHandler to filter rooms based on io.alkemio.visibility
         self._patch_sync_handler()
+        self._patch_sliding_sync_room_lists()
+        self._patch_client_api()
+
+        if config.visibility_prewarm:
+            self._schedule_visibility_prewarm()
 
         logger.info(
-            "AlkemioRoomControl initialized - AppService: @%s:%s, Adapter: %s, Token: %s, SyncFilter: enabled",
+            "AlkemioRoomControl initialized - AppService: @%s:%s, Adapter: %s, Token: %s, SyncFilter: enabled, VisibilityCache: %d rooms",
             self.appservice_sender,
             self.homeserver_domain,
             self.adapter_url,
             "configured" if self.hs_token else "NOT FOUND",
+            config.visibility_cache_size,
         )
 
+    def _patch_notifier(self) -> None:
+        """
+        Wrap Notifier.notify_new_room_events to follow the module's state events.
+
+        Every worker delivers each persisted event through it, the persisting
+        worker directly and the others from the replication stream. Its
+        entries carry type, state key and membership but no event body, so
+        an ordinary event costs a few comparisons and no storage reads.
+        Visibility and pending events are applied before clients are woken,
+        so a sync they trigger already sees the change.
+
+        Tested with Synapse v1.132.0.
+        """
+        try:
+            notifier = self.api._hs.get_notifier()
+            original_notify_new_room_events = notifier.notify_new_room_events
+
+            async def patched_notify_new_room_events(event_entries, max_room_stream_token):
+                for entry, _ in event_entries:
+                    try:
+                        await self._on_new_room_event(entry)
+                    except Exception:
+                        logger.exception(
+                            "Failed to apply %s event in room %s", entry.type, entry.room_id
+                        )
+                return await original_notify_new_room_events(event_entries, max_room_stream_token)
+
+            notifier.notify_new_room_events = patched_notify_new_room_events
+            logger.info("Notifier patched for io.alkemio.visibility and io.alkemio.pending")
+
+        except Exception as e:
+            logger.error("Failed to patch Notifier: %s", str(e))
+            raise RuntimeError(f"AlkemioRoomControl: Notifier patch failed: {e}") from e
+
     def _patch_sync_handler(self) -> None:
         """
         Monkey-patch SyncHandler.get_sync_result_builder to filter rooms
         based on the io.alkemio.visibility state event.
 
         Rooms with {"visible": false} are excluded from /sync responses
-        for all users except the AppService bot.
+        for all users except the AppService bot. With
+        sync_exclude_hidden_up_front and a complete visibility index the
+        hidden rooms are handed to Synapse as excluded rooms before it builds
+        the room list; otherwise the built room list is filtered afterwards.
 
         Tested with Synapse v1.132.0.
         """
         try:
             sync_handler = self.api._hs.get_sync_handler()
             original_get_sync_result_builder = sync_handler.get_sync_result_builder
-            state_storage = self.api._hs.get_storage_controllers().state
-            bot_mxid = f"@{self.appservice_sender}:{self.homeserver_domain}"
 
             async def patched_get_sync_result_builder(sync_config, since_token=None, full_state=False):
-                result_builder = await original_get_sync_result_builder(
-                    sync_config, since_token, full_state
-                )
-
                 user_id = sync_config.user.to_string()
 
                 # Don't filter for the bot — it needs to see everything
-                if user_id == bot_mxid:
+                if self.visibility_engine.is_exempt(user_id):
                     logger.debug("Sync filter: skipping bot user %s", user_id)
-                    return result_builder
-
-                logger.debug(
-                    "Sync filter: checking %d rooms for user %s",
-                    len(result_builder.joined_room_ids), user_id,
-                )
-
-                # Find rooms to hide based on io.alkemio.visibility state
-                hidden_room_ids = set()
-                for room_id in result_builder.joined_room_ids:
-                    try:
-                        visibility_event = await state_storage.get_current_state_event(
-                            room_id, ALKEMIO_VISIBILITY_EVENT, ""
-                        )
-                        if visibility_event:
-                            visible = visibility_event.content.get("visible")
-                            logger.debug(
-                                "Sync filter: room %s visibility=%s",
-                                room_id, visible,
-                            )
-                            if visible is False:
-                                hidden_room_ids.add(room_id)
-                    except Exception as e:
-                        logger.warning("Sync filter: error checking room %s, hiding it: %s", room_id, e)
-                        hidden_room_ids.add(room_id)
-
-                if hidden_room_ids:
-                    # Rebuild with hidden rooms excluded
-                    result_builder.joined_room_ids = frozenset(
-                        rid for rid in result_builder.joined_room_ids
-                        if rid not in hidden_room_ids
-                    )
-                    result_builder.excluded_room_ids = frozenset(
-                        set(result_builder.excluded_room_ids) | hidden_room_ids
-                    )
-                    logger.debug(
-                        "Filtered %d hidden rooms from /sync for %s",
-                        len(hidden_room_ids), user_id,
+                    return await original_get_sync_result_builder(
+                        sync_config, since_token, full_state
                     )
 
+                if self.config.sync_exclude_hidden_up_front and self._visibility_index_complete:
+                    return await self._build_with_hidden_excluded(
+                        sync_handler, original_get_sync_result_builder,
+                        sync_config, since_token, full_state,
+                    )
 
+                result_builder = await original_get_sync_result_builder(
+                    sync_config, since_token, full_state
+                )
+                with sync_filter_duration.labels("post_filter").time(), start_active_span(
+                    "alkemio.sync_filter", tags={"alkemio.mode": "post_filter"}
+                ):
+                    await self._filter_sync_result(
+                        sync_config, since_token, full_state, result_builder
+                    )
                 return result_builder
 
             sync_handler.get_sync_result_builder = patched_get_sync_result_builder
@@ -160,6 +1382,1008 @@ class AlkemioRoomControl:
             logger.error("Failed to patch SyncHandler: %s", str(e))
             raise RuntimeError(f"AlkemioRoomControl: SyncHandler patch failed: {e}") from e
 
+    def _patch_sliding_sync_room_lists(self) -> None:
+        """
+        Apply the same io.alkemio.visibility filter to Sliding Sync
+        (MSC3575/MSC4186) by wrapping the store its room lists read from,
+        and by dropping hidden rooms from the newly-left map both membership
+        paths (sliding sync tables and fallback) add back from.
+
+        Tested with Synapse v1.132.0.
+        """
+        try:
+            room_lists = self.api._hs.get_sliding_sync_handler().room_lists
+            store = SlidingSyncVisibilityStore(room_lists.store, self.visibility_engine)
+            room_lists.store = store
+
+            def without_hidden_newly_left(original):
+                async def patched(user_id, *args, **kwargs):
+                    newly_joined_room_ids, newly_left_room_map = await original(
+                        user_id, *args, **kwargs
+                    )
+                    return newly_joined_room_ids, await store._without_hidden(
+                        user_id, newly_left_room_map
+                    )
+
+                return patched
+
+            room_lists._get_newly_joined_and_left_rooms = without_hidden_newly_left(
+                room_lists._get_newly_joined_and_left_rooms
+            )
+            room_lists._get_newly_joined_and_left_rooms_fallback = without_hidden_newly_left(
+                room_lists._get_newly_joined_and_left_rooms_fallback
+            )
+            logger.info("Sliding Sync room lists patched for io.alkemio.visibility filtering")
+
+        except Exception as e:
+            logger.error("Failed to patch Sliding Sync room lists: %s", str(e))
+            raise RuntimeError(f"AlkemioRoomControl: Sliding Sync patch failed: {e}") from e
+
+    def _patch_client_api(self) -> None:
+        """
+        Apply the io.alkemio.visibility filter to the rest of the client API:
+        /joined_rooms, /notifications and push badge counts read the user's
+        rooms through a ClientApiVisibilityStore, and the MSC3266 room
+        summary and /hierarchy of a hidden room are answered with a 404
+        before any work. /hierarchy drops hidden children from each summary
+        before their m.space.child events are queued, so hidden rooms are
+        neither listed nor summarised. Federation hierarchy requests are
+        left alone.
+
+        Tested with Synapse v1.132.0.
+        """
+        try:
+            _client_api_stores[self._store] = ClientApiVisibilityStore(
+                self._store, self.visibility_engine
+            )
+            _install_client_api_hooks()
+
+            room_summary_handler = self.api._hs.get_room_summary_handler()
+            original_get_room_summary = room_summary_handler.get_room_summary
+
+            async def patched_get_room_summary(requester, room_id, *args, **kwargs):
+                if await self.visibility_engine.is_hidden(requester, room_id):
+                    raise NotFoundError("Room not found or is not accessible")
+                return await original_get_room_summary(requester, room_id, *args, **kwargs)
+
+            room_summary_handler.get_room_summary = patched_get_room_summary
+
+            original_get_room_hierarchy = room_summary_handler.get_room_hierarchy
+
+            async def patched_get_room_hierarchy(requester, requested_room_id, *args, **kwargs):
+                if await self.visibility_engine.is_hidden(
+                    requester.user.to_string(), requested_room_id
+                ):
+                    raise NotFoundError("Room not found or is not accessible")
+                return await original_get_room_hierarchy(
+                    requester, requested_room_id, *args, **kwargs
+                )
+
+            room_summary_handler.get_room_hierarchy = patched_get_room_hierarchy
+
+            original_summarize_local_room = room_summary_handler._summarize_local_room
+
+            async def patched_summarize_local_room(requester, origin, room_id, *args, **kwargs):
+                room_entry = await original_summarize_local_room(
+                    requester, origin, room_id, *args, **kwargs
+                )
+                # requester is None for federation requests.
+                if requester is None or room_entry is None or not room_entry.children_state_events:
+                    return room_entry
+                hidden_room_ids = await self.visibility_engine.hidden_rooms_among(
+                    requester, {ev["state_key"] for ev in room_entry.children_state_events}
+                )
+                if not hidden_room_ids:
+                    return room_entry
+                return attr.evolve(room_entry, children_state_events=[
+                    ev for ev in room_entry.children_state_events
+                    if ev["state_key"] not in hidden_room_ids
+                ])
+
+            room_summary_handler._summarize_local_room = patched_summarize_local_room
+            logger.info("Client API patched for io.alkemio.visibility filtering")
+
+        except Exception as e:
+            logger.error("Failed to patch the client API: %s", str(e))
+            raise RuntimeError(f"AlkemioRoomControl: client API patch failed: {e}") from e
+
+    async def _filter_sync_result(self, sync_config, since_token, full_state: bool, result_builder) -> None:
+        """
+        Drop hidden rooms from a SyncResultBuilder in place.
+
+        If the user's hidden room set is cached for exactly these joined
+        rooms, it is used as is. Otherwise initial and full_state syncs
+        evaluate every joined room, and incremental syncs that continue from
+        this device's previous sync reuse its result and only re-check rooms
+        whose visibility changed since, rooms joined since since_token, and
+        rooms whose last lookup failed. Rooms that became visible are forced
+        in as newly joined so the client gets their full state.
+        """
+        user_id = sync_config.user.to_string()
+        state_key = (user_id, sync_config.device_id)
+        joined_room_ids = result_builder.joined_room_ids
+
+        # Read the position before any lookup: changes racing with this sync
+        # land after it and are re-checked next time.
+        stream_pos = self._visibility_stream_pos
+        previous = self._sync_states.get(state_key)
+        continues_previous = (
+            previous is not None
+            and not previous.excluded_up_front
+            and since_token is not None
+            and not full_state
+        )
+
+        set_tag("alkemio.rooms_joined", len(joined_room_ids))
+        cached = self._user_hidden_rooms.get(user_id, joined_room_ids)
+        set_tag("alkemio.hidden_set_cached", cached is not None)
+        if cached is None:
+            user_hidden_cache_lookups.labels("miss").inc()
+            visible_room_ids, unresolved_room_ids = await self._evaluate_joined_rooms(
+                previous if continues_previous else None, since_token, result_builder
+            )
+            if not unresolved_room_ids:
+                self._cache_user_hidden_rooms(
+                    user_id, joined_room_ids, visible_room_ids, stream_pos
+                )
+        else:
+            user_hidden_cache_lookups.labels("hit").inc()
+            set_tag("alkemio.rooms_checked", 0)
+            sync_filter_rooms_checked.labels("post_filter").observe(0)
+            visible_room_ids = cached.visible_room_ids
+            unresolved_room_ids = set()
+            if continues_previous and since_token.room_key == previous.room_stream_token:
+                # Another device may have refreshed the entry since this one synced.
+                unhidden_room_ids = (
+                    visible_room_ids
+                    - previous.visible_room_ids
+                    - self._newly_joined_room_ids(result_builder)
+                )
+                if unhidden_room_ids:
+                    result_builder.forced_newly_joined_room_ids = (
+                        result_builder.forced_newly_joined_room_ids | unhidden_room_ids
+                    )
+
+        self._store_sync_state(state_key, SyncFilterState(
+            room_stream_token=result_builder.now_token.room_key,
+            visibility_stream_pos=stream_pos,
+            visible_room_ids=visible_room_ids,
+            unresolved_room_ids=frozenset(unresolved_room_ids),
+        ))
+
+        set_tag("alkemio.rooms_hidden", len(joined_room_ids) - len(visible_room_ids))
+        set_tag("alkemio.rooms_unresolved", len(unresolved_room_ids))
+        if len(visible_room_ids) < len(joined_room_ids):
+            hidden_room_ids = joined_room_ids - visible_room_ids
+            sync_filter_hidden_rooms.labels("post_filter").inc(len(hidden_room_ids))
+            # Rebuild with hidden rooms excluded
+            result_builder.joined_room_ids = visible_room_ids
+            result_builder.excluded_room_ids = result_builder.excluded_room_ids | hidden_room_ids
+
+    async def _evaluate_joined_rooms(
+        self, previous: Optional[SyncFilterState], since_token, result_builder
+    ) -> Tuple[FrozenSet[str], Set[str]]:
+        """
+        The visible joined rooms of a sync the hidden set cache could not answer.
+
+        With previous, the state of the sync this one continues, only the
+        rooms _rooms_to_recheck picks are evaluated and rooms that became
+        visible are forced in as newly joined.
+
+        Returns:
+            (visible room IDs, room IDs whose lookup failed)
+        """
+        joined_room_ids = result_builder.joined_room_ids
+        recheck = None
+        if previous is not None:
+            recheck = self._rooms_to_recheck(previous, since_token, result_builder)
+        set_tag("alkemio.incremental", recheck is not None)
+
+        if recheck is None:
+            set_tag("alkemio.rooms_checked", len(joined_room_ids))
+            sync_filter_rooms_checked.labels("post_filter").observe(len(joined_room_ids))
+            visible_room_ids, unresolved_room_ids = await self._evaluate_rooms(joined_room_ids)
+            return frozenset(visible_room_ids), unresolved_room_ids
+
+        recheck_room_ids, newly_joined_room_ids = recheck
+        set_tag("alkemio.rooms_checked", len(recheck_room_ids))
+        sync_filter_rooms_checked.labels("post_filter").observe(len(recheck_room_ids))
+        visible_room_ids, unresolved_room_ids = await self._evaluate_rooms(recheck_room_ids)
+        unhidden_room_ids = visible_room_ids - previous.visible_room_ids - newly_joined_room_ids
+        visible_room_ids |= (previous.visible_room_ids & joined_room_ids) - recheck_room_ids
+        if unhidden_room_ids:
+            result_builder.forced_newly_joined_room_ids = (
+                result_builder.forced_newly_joined_room_ids | unhidden_room_ids
+            )
+        return frozenset(visible_room_ids), unresolved_room_ids
+
+    def _cache_user_hidden_rooms(
+        self,
+        user_id: str,
+        joined_room_ids: FrozenSet[str],
+        visible_room_ids: FrozenSet[str],
+        stream_pos: int,
+    ) -> None:
+        """Cache a user's split computed from visibility as of stream_pos, unless it raced."""
+        if stream_pos != self._visibility_stream_pos:
+            changed = self._visibility_changes.get_all_entities_changed(stream_pos)
+            if not changed.hit or not joined_room_ids.isdisjoint(changed.entities):
+                return
+        self._user_hidden_rooms.set(user_id, joined_room_ids, visible_room_ids)
+
+    async def _build_with_hidden_excluded(
+        self, sync_handler, original_get_sync_result_builder,
+        sync_config, since_token, full_state: bool,
+    ):
+        """
+        Build a SyncResultBuilder with the user's hidden rooms excluded up front.
+
+        The user's hidden rooms are added to rooms_to_exclude_globally on a
+        shallow copy of the SyncHandler, so Synapse leaves them out of
+        joined_room_ids and membership_change_events itself and concurrent
+        syncs (and the bot) keep the configured exclusions.
+        """
+        user_id = sync_config.user.to_string()
+        state_key = (user_id, sync_config.device_id)
+        stream_pos = self._visibility_stream_pos
+        with sync_filter_duration.labels("up_front").time(), start_active_span(
+            "alkemio.sync_filter", tags={"alkemio.mode": "up_front"}
+        ):
+            # Cached by Synapse; get_sync_result_builder reads the same list.
+            joined_room_ids = await self._store.get_rooms_for_user(user_id)
+            hidden_room_ids = await self.visibility_engine.hidden_joined_rooms(
+                user_id, joined_room_ids
+            )
+            set_tag("alkemio.rooms_joined", len(joined_room_ids))
+            set_tag("alkemio.rooms_hidden", len(hidden_room_ids))
+        sync_filter_rooms_checked.labels("up_front").observe(len(joined_room_ids))
+        if hidden_room_ids:
+            sync_filter_hidden_rooms.labels("up_front").inc(len(hidden_room_ids))
+
+        handler = sync_handler
+        if hidden_room_ids:
+            handler = copy.copy(sync_handler)
+            handler.rooms_to_exclude_globally = [
+                *sync_handler.rooms_to_exclude_globally, *hidden_room_ids
+            ]
+        result_builder = await original_get_sync_result_builder.__func__(
+            handler, sync_config, since_token, full_state
+        )
+
+        if not result_builder.joined_room_ids <= joined_room_ids:
+            # Joined a room between the two reads of the room list.
+            await self._filter_sync_result(sync_config, since_token, full_state, result_builder)
+            return result_builder
+
+        previous = self._sync_states.get(state_key)
+        if (
+            previous is not None
+            and previous.excluded_up_front
+            and since_token is not None
+            and not full_state
+            and since_token.room_key == previous.room_stream_token
+        ):
+            unhidden_room_ids = (
+                previous.hidden_room_ids - hidden_room_ids
+            ) & result_builder.joined_room_ids
+            if unhidden_room_ids:
+                result_builder.forced_newly_joined_room_ids = (
+                    result_builder.forced_newly_joined_room_ids | unhidden_room_ids
+                )
+
+        self._store_sync_state(state_key, SyncFilterState(
+            room_stream_token=result_builder.now_token.room_key,
+            visibility_stream_pos=stream_pos,
+            visible_room_ids=frozenset(),
+            unresolved_room_ids=frozenset(),
+            hidden_room_ids=frozenset(hidden_room_ids),
+            excluded_up_front=True,
+        ))
+        return result_builder
+
+    async def _hidden_rooms_among(self, room_ids: Collection[str]) -> Set[str]:
+        """
+        The hidden rooms among room_ids; rooms whose read fails count as hidden.
+
+        With a complete visibility index this is a set intersection plus
+        direct reads of stale rooms; before that, every room is evaluated.
+        """
+        if not self._visibility_index_complete:
+            visible_room_ids, _ = await self._evaluate_rooms(room_ids)
+            return {room_id for room_id in room_ids if room_id not in visible_room_ids}
+
+        hidden_room_ids = self._hidden_room_ids.intersection(room_ids)
+        stale_room_ids = self._stale_room_ids.intersection(room_ids)
+        if stale_room_ids:
+            visible_room_ids, _ = await self._evaluate_rooms(stale_room_ids)
+            hidden_room_ids |= stale_room_ids - visible_room_ids
+        return hidden_room_ids
+
+    def _rooms_to_recheck(
+        self, previous: SyncFilterState, since_token, result_builder
+    ) -> Optional[Tuple[Set[str], Set[str]]]:
+        """
+        Rooms an incremental sync must re-evaluate, or None if the previous
+        state cannot be reused and every joined room must be checked.
+
+        When the change stream no longer reaches back to the previous sync
+        (more rooms changed since than it keeps), every joined room is
+        re-checked, but against the still valid previous state, so rooms
+        that became visible are still forced in.
+
+        Returns:
+            (rooms to re-check, the subset of them joined since since_token)
+        """
+        # The previous state only tells us about membership up to its own
+        # token; a client resuming from an older token needs a full pass.
+        if since_token.room_key != previous.room_stream_token:
+            return None
+
+        joined_room_ids = result_builder.joined_room_ids
+        newly_joined_room_ids = self._newly_joined_room_ids(result_builder)
+
+        changed = self._visibility_changes.get_all_entities_changed(
+            previous.visibility_stream_pos
+        )
+        set_tag("alkemio.visibility_changes_known", changed.hit)
+        if not changed.hit:
+            return set(joined_room_ids), newly_joined_room_ids
+
+        recheck_room_ids = set(changed.entities)
+        recheck_room_ids.update(previous.unresolved_room_ids)
+        recheck_room_ids &= joined_room_ids
+        recheck_room_ids |= newly_joined_room_ids
+        return recheck_room_ids, newly_joined_room_ids
+
+    @staticmethod
+    def _newly_joined_room_ids(result_builder) -> Set[str]:
+        """Joined rooms the sync already reports as joined since since_token."""
+        newly_joined_room_ids = {
+            event.room_id
+            for event in result_builder.membership_change_events
+            if event.membership == "join"
+        }
+        newly_joined_room_ids.update(result_builder.forced_newly_joined_room_ids)
+        newly_joined_room_ids &= result_builder.joined_room_ids
+        return newly_joined_room_ids
+
+    def _store_sync_state(self, state_key: Tuple[str, Optional[str]], state: SyncFilterState) -> None:
+        self._sync_states[state_key] = state
+        self._sync_states.move_to_end(state_key)
+        if len(self._sync_states) > self.config.sync_state_cache_size:
+            self._sync_states.popitem(last=False)
+
+    async def _evaluate_rooms(self, room_ids: Collection[str]) -> Tuple[Set[str], Set[str]]:
+        """
+        Resolve io.alkemio.visibility for the given rooms.
+
+        Cached rooms cost a dict lookup; all misses are loaded in one batched
+        read. Rooms whose lookup failed count as hidden (fail closed), unless
+        visibility_serve_stale is set and their last known value is
+        available: that is served while a background read refreshes it.
+
+        Returns:
+            (visible room IDs, room IDs whose lookup failed)
+        """
+        visibility_cache = self._visibility_cache
+        visible_room_ids: Set[str] = set()
+        missing_room_ids = []
+        for room_id in room_ids:
+            visible = visibility_cache.get(room_id)
+            if visible is None:
+                missing_room_ids.append(room_id)
+            elif visible:
+                visible_room_ids.add(room_id)
+        cache_misses = len(missing_room_ids)
+
+        if missing_room_ids and self._visibility_index_complete:
+            # A complete index knows every hidden room; the rest are visible.
+            stale_room_ids = self._stale_room_ids
+            hidden_room_ids = self._hidden_room_ids
+            visible_room_ids.update(
+                r for r in missing_room_ids
+                if r not in stale_room_ids and r not in hidden_room_ids
+            )
+            missing_room_ids = [r for r in missing_room_ids if r in stale_room_ids]
+
+        set_tag("alkemio.cache_hits", len(room_ids) - cache_misses)
+        set_tag("alkemio.cache_misses", cache_misses)
+        set_tag("alkemio.storage_reads", len(missing_room_ids))
+        unresolved_room_ids: Set[str] = set()
+        if missing_room_ids:
+            loaded = await self._load_room_visibility(missing_room_ids)
+            for room_id in missing_room_ids:
+                visible = loaded.get(room_id)
+                if visible is None:
+                    unresolved_room_ids.add(room_id)
+                elif visible:
+                    visible_room_ids.add(room_id)
+            if unresolved_room_ids:
+                failed_closed = len(unresolved_room_ids)
+                if self.config.visibility_serve_stale:
+                    served = 0
+                    for room_id in unresolved_room_ids:
+                        visible = self._last_known_visibility_of(room_id)
+                        if visible is not None:
+                            served += 1
+                            if visible:
+                                visible_room_ids.add(room_id)
+                    failed_closed -= served
+                    visibility_stale_served.inc(served)
+                    self._schedule_visibility_refresh(unresolved_room_ids)
+                visibility_lookup_errors.inc(failed_closed)
+
+        return visible_room_ids, unresolved_room_ids
+
+    def _last_known_visibility_of(self, room_id: str) -> Optional[bool]:
+        visible = self._last_known_visibility.peek(room_id)
+        if visible is None and self._last_known_hidden_room_ids is not None:
+            visible = room_id not in self._last_known_hidden_room_ids
+        return visible
+
+    def _schedule_visibility_refresh(self, room_ids: Collection[str]) -> None:
+        room_ids = [r for r in room_ids if r not in self._refreshing_room_ids]
+        if not room_ids:
+            return
+        self._refreshing_room_ids.update(room_ids)
+        self.api.delayed_background_call(
+            0, self._refresh_room_visibility, room_ids,
+            desc="alkemio_refresh_room_visibility",
+        )
+
+    async def _refresh_room_visibility(self, room_ids: List[str]) -> None:
+        """Background task: re-read rooms whose lookup failed during a sync."""
+        try:
+            loaded = await self._load_room_visibility(room_ids)
+        finally:
+            self._refreshing_room_ids.difference_update(room_ids)
+        logger.info(
+            "Sync filter: background refresh read %d of %d rooms", len(loaded), len(room_ids)
+        )
+
+    def _record_visibility_change(self, room_id: str) -> None:
+        self._visibility_stream_pos += 1
+        self._visibility_changes.entity_has_changed(room_id, self._visibility_stream_pos)
+        self._user_hidden_rooms.invalidate_room(room_id)
+
+    def _set_room_visibility(self, room_id: str, visible: bool) -> None:
+        self._visibility_cache.set(room_id, visible)
+        self._last_known_visibility.invalidate(room_id)
+        if visible:
+            self._hidden_room_ids.discard(room_id)
+        else:
+            self._hidden_room_ids.add(room_id)
+        self._stale_room_ids.discard(room_id)
+
+    def _invalidate_room_visibility(self, room_id: str) -> None:
+        """Drop a room's cached visibility; the next sync reloads it."""
+        if self.config.visibility_serve_stale:
+            visible = self._visibility_cache.peek(room_id)
+            if visible is None and room_id in self._hidden_room_ids:
+                visible = False
+            elif (
+                visible is None
+                and self._visibility_index_complete
+                and room_id not in self._stale_room_ids
+            ):
+                visible = True
+            if visible is not None:
+                self._last_known_visibility.set(room_id, visible)
+        self._record_visibility_change(room_id)
+        self._visibility_cache.invalidate(room_id)
+        self._hidden_room_ids.discard(room_id)
+        self._stale_room_ids.add(room_id)
+
+    def _reset_visibility_state(self) -> None:
+        """Forget everything derived from visibility state on this worker."""
+        self._visibility_stream_pos += 1
+        self._visibility_changes = StreamChangeCache(
+            "AlkemioRoomVisibilityChanges", self._visibility_stream_pos
+        )
+        if self.config.visibility_serve_stale:
+            for room_id, visible in self._visibility_cache.items():
+                self._last_known_visibility.set(room_id, visible)
+            if self._visibility_index_complete:
+                self._last_known_hidden_room_ids = self._hidden_room_ids
+                self._hidden_room_ids = set()
+        self._visibility_cache.clear()
+        self._hidden_room_ids.clear()
+        self._sync_states.clear()
+        self._user_hidden_rooms.clear()
+        self._visibility_generation += 1
+        self._visibility_index_complete = False
+        self._stale_room_ids.clear()
+        logger.info("Visibility cache: cleared by replicated invalidation")
+        if self.config.visibility_prewarm:
+            self._schedule_visibility_prewarm()
+
+    def _schedule_visibility_prewarm(self) -> None:
+        self.api.delayed_background_call(
+            0, self._prewarm_visibility_cache, desc="alkemio_prewarm_room_visibility"
+        )
+
+    async def _prewarm_visibility_cache(self) -> None:
+        """
+        Background task: page through all current io.alkemio.visibility state
+        and load it into the cache and the hidden set, then mark the index
+        complete.
+
+        Until it finishes the /sync filter reads uncached rooms directly. If a
+        reset happens meanwhile, the index is left incomplete.
+        """
+        generation = self._visibility_generation
+        batch_size = self.config.visibility_prewarm_batch_size
+        started = time.monotonic()
+        last_room_id = ""
+        rooms = pages = 0
+        logger.info("Visibility pre-warm: started")
+        try:
+            while True:
+                stream_pos = self._visibility_stream_pos
+                page = await self.api.run_db_interaction(
+                    "alkemio_prewarm_room_visibility",
+                    self._get_room_visibility_page_txn,
+                    last_room_id,
+                    batch_size,
+                )
+                if generation != self._visibility_generation:
+                    logger.info("Visibility pre-warm: superseded after %d rooms", rooms)
+                    return
+                self._cache_loaded_visibility(dict(page), stream_pos)
+                rooms += len(page)
+                pages += 1
+                if pages % 10 == 0:
+                    logger.info(
+                        "Visibility pre-warm: %d rooms loaded in %.1fs",
+                        rooms, time.monotonic() - started,
+                    )
+                if len(page) < batch_size:
+                    break
+                last_room_id = page[-1][0]
+        except Exception as e:
+            logger.error(
+                "Visibility pre-warm: failed after %d rooms, using direct reads: %s", rooms, e
+            )
+            return
+
+        self._visibility_index_complete = True
+        self._last_known_hidden_room_ids = None
+        logger.info(
+            "Visibility pre-warm: completed, %d rooms (%d hidden) in %d pages in %.1fs",
+            rooms, len(self._hidden_room_ids), pages, time.monotonic() - started,
+        )
+
+    @staticmethod
+    def _get_room_visibility_page_txn(
+        txn: LoggingTransaction, after_room_id: str, limit: int
+    ) -> List[Tuple[str, bool]]:
+        txn.execute(
+            """
+            SELECT c.room_id, j.json FROM current_state_events AS c
+            INNER JOIN event_json AS j USING (event_id)
+            WHERE c.type = ? AND c.state_key = '' AND c.room_id > ?
+            ORDER BY c.room_id
+            LIMIT ?
+            """,
+            (ALKEMIO_VISIBILITY_EVENT, after_room_id, limit),
+        )
+        return [
+            (room_id, _is_visible(json.loads(event_json).get("content", {})))
+            for room_id, event_json in txn.fetchall()
+        ]
+
+    async def _load_room_visibility(self, room_ids: Collection[str]) -> Dict[str, bool]:
+        """
+        Load io.alkemio.visibility for rooms missing from the cache and cache them.
+
+        Uses one database interaction for the whole set (chunked queries over
+        current_state_events). If bulk access fails, falls back to per-room
+        state reads with bounded concurrency; if it times out, storage is
+        slow rather than unavailable, so nothing else is tried.
+
+        Returns:
+            room_id -> visible for every room that could be read. Rooms whose
+            lookup failed are absent and are not cached.
+        """
+        stream_pos = self._visibility_stream_pos
+        with start_active_span(
+            "alkemio.load_room_visibility", tags={"alkemio.rooms": len(room_ids)}
+        ):
+            try:
+                loaded = await self._bounded_lookup(
+                    self.api.run_db_interaction,
+                    "alkemio_get_room_visibility",
+                    self._get_room_visibility_txn,
+                    room_ids,
+                    self.config.visibility_lookup_batch_size,
+                )
+            except defer.TimeoutError:
+                logger.warning(
+                    "Sync filter: bulk visibility lookup for %d rooms timed out after %dms",
+                    len(room_ids), self.config.visibility_lookup_timeout_ms,
+                )
+                set_tag("alkemio.timed_out", True)
+                loaded = {}
+            except Exception as e:
+                logger.warning(
+                    "Sync filter: bulk visibility lookup failed for %d rooms, reading per room: %s",
+                    len(room_ids), e,
+                )
+                set_tag("alkemio.per_room_fallback", True)
+                loaded = await self._load_room_visibility_per_room(room_ids)
+            set_tag("alkemio.rooms_read", len(loaded))
+
+        self._cache_loaded_visibility(loaded, stream_pos)
+        return loaded
+
+    def _cache_loaded_visibility(self, loaded: Dict[str, bool], stream_pos: int) -> None:
+        """
+        Cache values read from storage at stream_pos.
+
+        Rooms whose visibility changed while we were waiting on storage are
+        skipped and marked stale: the event (or invalidation) is newer than
+        what we read, so a complete index must not assume them visible.
+        """
+        raced: Collection[str] = ()
+        if stream_pos != self._visibility_stream_pos:
+            changed = self._visibility_changes.get_all_entities_changed(stream_pos)
+            raced = set(changed.entities) if changed.hit else loaded.keys()
+        for room_id, visible in loaded.items():
+            if room_id in raced:
+                self._stale_room_ids.add(room_id)
+            else:
+                self._set_room_visibility(room_id, visible)
+
+    @staticmethod
+    def _get_room_visibility_txn(
+        txn: LoggingTransaction, room_ids: Collection[str], batch_size: int
+    ) -> Dict[str, bool]:
+        # Rooms without a visibility event in current state are visible.
+        results = dict.fromkeys(room_ids, True)
+        for batch in batch_iter(room_ids, batch_size):
+            clause, args = make_in_list_sql_clause(txn.database_engine, "c.room_id", batch)
+            txn.execute(
+                f"""
+                SELECT c.room_id, j.json FROM current_state_events AS c
+                INNER JOIN event_json AS j USING (event_id)
+                WHERE c.type = ? AND c.state_key = '' AND {clause}
+                """,
+                [ALKEMIO_VISIBILITY_EVENT, *args],
+            )
+            for room_id, event_json in txn.fetchall():
+                results[room_id] = _is_visible(json.loads(event_json).get("content", {}))
+        return results
+
+    async def _load_room_visibility_per_room(self, room_ids: Collection[str]) -> Dict[str, bool]:
+        loaded: Dict[str, bool] = {}
+
+        async def load(room_id: str) -> None:
+            try:
+                event = await self._bounded_lookup(
+                    self._state_storage.get_current_state_event,
+                    room_id, ALKEMIO_VISIBILITY_EVENT, "",
+                )
+            except defer.TimeoutError:
+                logger.warning("Sync filter: visibility read for room %s timed out", room_id)
+                return
+            except Exception as e:
+                logger.warning("Sync filter: error checking room %s: %s", room_id, e)
+                return
+            loaded[room_id] = event is None or _is_visible(event.content)
+
+        await concurrently_execute(load, room_ids, self.config.visibility_lookup_concurrency)
+        return loaded
+
+    async def update_room_visibility(self, updates: Dict[str, bool]) -> List[dict]:
+        """
+        Apply room_id -> visible, sending io.alkemio.visibility only where it differs.
+
+        Current values are read in one database interaction (a room without a
+        visibility event counts as visible) and cached on the way. Each
+        event sent updates the visibility index straight away rather than
+        waiting for it to be delivered.
+
+        Returns:
+            One result per room, in the order of updates.
+        """
+        room_ids = list(updates)
+        stream_pos = self._visibility_stream_pos
+        current = await self.api.run_db_interaction(
+            "alkemio_get_room_visibility",
+            self._get_room_visibility_txn,
+            room_ids,
+            self.config.visibility_lookup_batch_size,
+        )
+        self._cache_loaded_visibility(current, stream_pos)
+
+        bot_mxid = f"@{self.appservice_sender}:{self.homeserver_domain}"
+        results = {
+            room_id: {"room_id": room_id, "visible": visible, "result": "unchanged"}
+            for room_id, visible in updates.items()
+        }
+
+        async def send(room_id: str) -> None:
+            visible = updates[room_id]
+            try:
+                await self.api.create_and_send_event_into_room({
+                    "type": ALKEMIO_VISIBILITY_EVENT,
+                    "room_id": room_id,
+                    "sender": bot_mxid,
+                    "state_key": "",
+                    "content": {"visible": visible},
+                })
+            except SynapseError as e:
+                results[room_id].update(result="error", errcode=e.errcode, error=e.msg)
+                return
+            except Exception as e:
+                logger.warning("Visibility update: failed to send event to room %s: %s", room_id, e)
+                results[room_id].update(result="error", errcode=Codes.UNKNOWN, error="Internal error")
+                return
+            self._record_visibility_change(room_id)
+            self._set_room_visibility(room_id, visible)
+            results[room_id]["result"] = "updated"
+
+        changed = [room_id for room_id in room_ids if current[room_id] != updates[room_id]]
+        await concurrently_execute(send, changed, self.config.visibility_update_concurrency)
+        logger.info(
+            "Visibility update: %d rooms requested, %d differed, %d failed",
+            len(room_ids), len(changed),
+            sum(1 for result in results.values() if result["result"] == "error"),
+        )
+        return [results[room_id] for room_id in room_ids]
+
+    async def _bounded_lookup(self, f, *args: Any) -> Any:
+        """
+        Await f(*args), bounded by visibility_lookup_timeout_ms if set.
+
+        Raises:
+            twisted.internet.defer.TimeoutError if the read takes too long.
+        """
+        timeout_ms = self.config.visibility_lookup_timeout_ms
+        if not timeout_ms:
+            return await f(*args)
+        d = run_in_background(f, *args)
+        return await make_deferred_yieldable(timeout_deferred(d, timeout_ms / 1000, self._reactor))
+
+    async def _on_new_room_event(self, entry: Any) -> None:
+        """
+        Apply one delivered event (a Notifier pending entry) to the module's indexes.
+
+        A membership event drops the member's cached hidden room set. For an
+        io.alkemio.visibility or io.alkemio.pending event the value is read
+        from the room's current state rather than the event itself, so
+        out-of-order or rejected events cannot overwrite a newer value.
+
+        The worker that persisted the event also broadcasts an invalidation
+        over Synapse's replication stream, so workers whose state had not
+        caught up when the event reached them drop their entry and reload it
+        on the next sync.
+        """
+        if entry.type == EventTypes.Member:
+            self._user_hidden_rooms.invalidate_user(entry.state_key)
+            return
+        if entry.state_key != "":
+            return
+        if entry.type == ALKEMIO_PENDING_EVENT:
+            await self._on_pending_event(entry)
+            return
+        if entry.type != ALKEMIO_VISIBILITY_EVENT:
+            return
+
+        if entry.event_pos.instance_name == self._instance_name:
+            try:
+                await self.api.invalidate_cache(self._visibility_invalidation, (entry.room_id,))
+            except Exception as e:
+                logger.warning(
+                    "Visibility cache: failed to broadcast invalidation for room %s: %s",
+                    entry.room_id, e,
+                )
+
+        try:
+            current = await self._bounded_lookup(
+                self._state_storage.get_current_state_event,
+                entry.room_id, ALKEMIO_VISIBILITY_EVENT, "",
+            )
+        except Exception as e:
+            logger.warning(
+                "Visibility cache: failed to read visibility of room %s: %s", entry.room_id, e
+            )
+            current = None
+        if current is None:
+            self._invalidate_room_visibility(entry.room_id)
+            return
+
+        self._record_visibility_change(entry.room_id)
+        visible = _is_visible(current.content)
+        self._set_room_visibility(entry.room_id, visible)
+        logger.info(
+            "Visibility cache: room %s visible=%s (cache %s)",
+            entry.room_id,
+            visible,
+            self._visibility_cache.stats(),
+        )
+
+    async def _on_pending_event(self, entry: Any) -> None:
+        """Keep the pending room index in step with io.alkemio.pending, like visibility."""
+        if not self.config.pending_room_index:
+            return
+        if entry.event_pos.instance_name == self._instance_name:
+            try:
+                await self.api.invalidate_cache(self._pending_invalidation, (entry.room_id,))
+            except Exception as e:
+                logger.warning(
+                    "Pending rooms: failed to broadcast invalidation for room %s: %s",
+                    entry.room_id, e,
+                )
+
+        try:
+            current = await self._bounded_lookup(
+                self._state_storage.get_current_state_event,
+                entry.room_id, ALKEMIO_PENDING_EVENT, "",
+            )
+        except Exception as e:
+            logger.warning("Pending rooms: failed to read room %s: %s", entry.room_id, e)
+            current = None
+        if current is None:
+            # Not in current state (yet); re-read before the next listing.
+            self._invalidate_pending_room(entry.room_id)
+            return
+        self._set_pending_room(
+            entry.room_id, _parse_alkemio_room_id(current.content), current.origin_server_ts
+        )
+
+    def _set_pending_room(
+        self, room_id: str, alkemio_room_id: Optional[str], created_ts: int
+    ) -> None:
+        if not self._pending_rooms_loaded:
+            self._pending_rooms_touched.add(room_id)
+        self._dirty_pending_room_ids.discard(room_id)
+        if alkemio_room_id is None:
+            self._pending_rooms.remove(room_id)
+        else:
+            self._pending_rooms.add(room_id, alkemio_room_id, created_ts)
+
+    def _invalidate_pending_room(self, room_id: str) -> None:
+        if not self._pending_rooms_loaded:
+            self._pending_rooms_touched.add(room_id)
+        self._dirty_pending_room_ids.add(room_id)
+
+    def _reset_pending_rooms(self) -> None:
+        self._pending_rooms.clear()
+        self._pending_rooms_loaded = False
+        self._pending_rooms_generation += 1
+        self._pending_rooms_touched.clear()
+        self._dirty_pending_room_ids.clear()
+        logger.info("Pending rooms: cleared by replicated invalidation")
+        self._schedule_pending_rooms_load()
+
+    def _schedule_pending_rooms_load(self, delay_ms: int = 0) -> None:
+        self.api.delayed_background_call(
+            delay_ms,
+            self._load_pending_rooms,
+            self._pending_rooms_generation,
+            delay_ms,
+            desc="alkemio_load_pending_rooms",
+        )
+
+    async def _load_pending_rooms(self, generation: int, delay_ms: int) -> None:
+        """
+        Background task: page through current io.alkemio.pending state once
+        and build the pending room index. Listing is refused until it is done.
+
+        A failed load is retried with backoff (delay_ms is the delay before
+        this attempt, 0 for the first) until it succeeds or a reset starts a
+        new generation.
+        """
+        if generation != self._pending_rooms_generation:
+            return
+        batch_size = self.config.pending_rooms_load_batch_size
+        started = time.monotonic()
+        last_room_id = ""
+        try:
+            while True:
+                page = await self.api.run_db_interaction(
+                    "alkemio_load_pending_rooms",
+                    self._get_pending_rooms_page_txn,
+                    last_room_id,
+                    batch_size,
+                )
+                if generation != self._pending_rooms_generation:
+                    return
+                for room_id, alkemio_room_id, created_ts in page:
+                    if alkemio_room_id is not None and room_id not in self._pending_rooms_touched:
+                        self._pending_rooms.add(room_id, alkemio_room_id, created_ts)
+                if len(page) < batch_size:
+                    break
+                last_room_id = page[-1][0]
+        except Exception as e:
+            retry_ms = min(
+                max(delay_ms * 2, self.PENDING_ROOMS_LOAD_RETRY_MS),
+                self.PENDING_ROOMS_LOAD_MAX_RETRY_MS,
+            )
+            logger.error(
+                "Pending rooms: loading failed, listing unavailable, retrying in %dms: %s",
+                retry_ms, e,
+            )
+            if generation == self._pending_rooms_generation:
+                self._schedule_pending_rooms_load(retry_ms)
+            return
+
+        self._pending_rooms_loaded = True
+        self._pending_rooms_touched.clear()
+        logger.info(
+            "Pending rooms: loaded %d in %.1fs", len(self._pending_rooms), time.monotonic() - started
+        )
+
+    async def list_pending_rooms(
+        self, after: Optional[Tuple[int, str]], limit: int
+    ) -> Tuple[List[Tuple[int, str, str]], int]:
+        """
+        A page of the pending room index (see PendingRoomIndex.page) and its size.
+
+        Raises:
+            SynapseError(503) while the index is still loading.
+        """
+        if not self._pending_rooms_loaded:
+            raise SynapseError(503, "Pending room index is still loading", Codes.UNKNOWN)
+        if self._dirty_pending_room_ids:
+            dirty_room_ids = list(self._dirty_pending_room_ids)
+            current = await self.api.run_db_interaction(
+                "alkemio_get_pending_rooms",
+                self._get_pending_rooms_txn,
+                dirty_room_ids,
+                self.config.visibility_lookup_batch_size,
+            )
+            for room_id in dirty_room_ids:
+                # Skip rooms that changed again while we were reading.
+                if room_id in self._dirty_pending_room_ids:
+                    alkemio_room_id, created_ts = current.get(room_id, (None, 0))
+                    self._set_pending_room(room_id, alkemio_room_id, created_ts)
+        return self._pending_rooms.page(after, limit), len(self._pending_rooms)
+
+    @staticmethod
+    def _parse_pending_event_json(event_json: str) -> Tuple[Optional[str], int]:
+        event = json.loads(event_json)
+        return _parse_alkemio_room_id(event.get("content", {})), event.get("origin_server_ts", 0)
+
+    @classmethod
+    def _get_pending_rooms_page_txn(
+        cls, txn: LoggingTransaction, after_room_id: str, limit: int
+    ) -> List[Tuple[str, Optional[str], int]]:
+        txn.execute(
+            """
+            SELECT c.room_id, j.json FROM current_state_events AS c
+            INNER JOIN event_json AS j USING (event_id)
+            WHERE c.type = ? AND c.state_key = '' AND c.room_id > ?
+            ORDER BY c.room_id
+            LIMIT ?
+            """,
+            (ALKEMIO_PENDING_EVENT, after_room_id, limit),
+        )
+        return [
+            (room_id, *cls._parse_pending_event_json(event_json))
+            for room_id, event_json in txn.fetchall()
+        ]
+
+    @classmethod
+    def _get_pending_rooms_txn(
+        cls, txn: LoggingTransaction, room_ids: Collection[str], batch_size: int
+    ) -> Dict[str, Tuple[Optional[str], int]]:
+        results = {}
+        for batch in batch_iter(room_ids, batch_size):
+            clause, args = make_in_list_sql_clause(txn.database_engine, "c.room_id", batch)
+            txn.execute(
+                f"""
+                SELECT c.room_id, j.json FROM current_state_events AS c
+                INNER JOIN event_json AS j USING (event_id)
+                WHERE c.type = ? AND c.state_key = '' AND {clause}
+                """,
+                [ALKEMIO_PENDING_EVENT, *args],
+            )
+            for room_id, event_json in txn.fetchall():
+                results[room_id] = cls._parse_pending_event_json(event_json)
+        return results
+
     def _detect_appservice_config(self) -> dict:
         """
         Auto-detect configuration from the 'alkemio-matrix-adapter' AppService.
@@ -232,10 +2456,14 @@ class AlkemioRoomControl:
             return False
 
     @property
-    def http_client(self) -> SimpleHttpClient:
-        """Lazy initialization of HTTP client."""
+    def http_client(self) -> AdapterHttpClient:
+        """Lazy initialization of the adapter HTTP client."""
         if self._http_client is None:
-            self._http_client = SimpleHttpClient(self.api._hs)
+            self._http_client = AdapterHttpClient(
+                self.api._hs,
+                max_connections=self.config.adapter_max_connections,
+                timeout_ms=self.config.adapter_timeout_ms,
+            )
         return self._http_client
 
     async def _check_room(
@@ -251,8 +2479,18 @@ class AlkemioRoomControl:
             Response dict with {allow, alkemio_room_id, reason}
 
         Raises:
-            SynapseError on timeout, connection failure, or server error.
+            SynapseError on timeout, connection failure, or server error, and
+            without calling the adapter while the circuit breaker is open.
         """
+        breaker = self._adapter_breaker
+        if not breaker.allow_request():
+            logger.debug("Room check: adapter circuit breaker open, failing fast")
+            raise SynapseError(
+                503,
+                "Service temporarily unavailable",
+                Codes.UNKNOWN,
+            )
+
         check_url = f"{self.adapter_url}/_matrix/app/alkemio/check-room"
         payload = {
             "creator": creator,
@@ -263,20 +2501,215 @@ class AlkemioRoomControl:
         if self.hs_token:
             headers[b"Authorization"] = [f"Bearer {self.hs_token}".encode()]
 
+        started = time.perf_counter()
+        with start_active_span("alkemio.check_room", tags={
+            "alkemio.members": len(members), "alkemio.is_direct": bool(is_direct),
+        }):
+            try:
+                resp = await self.http_client.post_json_get_json(
+                    check_url,
+                    payload,
+                    headers=headers,
+                )
+                breaker.record_success()
+                room_check_duration.observe(time.perf_counter() - started)
+                set_tag("alkemio.outcome", self._record_room_check_outcome(resp))
+                return resp
+            except Exception as e:
+                room_check_duration.observe(time.perf_counter() - started)
+                room_check_outcomes.labels("error").inc()
+                set_tag("alkemio.outcome", "error")
+                raise self._room_check_failed(e) from e
+
+    async def _check_room_batch(self, payloads: List[dict]) -> List[Union[dict, Exception]]:
+        """
+        Send several checks to the adapter's batch endpoint in one request.
+
+        The adapter answers {"results": [...]} in request order; an entry
+        with an "error" key fails only its own caller. Breaker, timeout and
+        error handling are those of _check_room, applied to the request.
+        """
+        breaker = self._adapter_breaker
+        if not breaker.allow_request():
+            logger.debug("Room check: adapter circuit breaker open, failing fast")
+            raise SynapseError(503, "Service temporarily unavailable", Codes.UNKNOWN)
+
+        check_url = f"{self.adapter_url}/_matrix/app/alkemio/check-room/batch"
+        headers = {}
+        if self.hs_token:
+            headers[b"Authorization"] = [f"Bearer {self.hs_token}".encode()]
+
+        room_check_batch_size.observe(len(payloads))
+        started = time.perf_counter()
+        with start_active_span(
+            "alkemio.check_room_batch", tags={"alkemio.batch_size": len(payloads)}
+        ):
+            try:
+                resp = await self.http_client.post_json_get_json(
+                    check_url, {"checks": payloads}, headers=headers
+                )
+                results = resp.get("results") if isinstance(resp, dict) else None
+                if not isinstance(results, list) or len(results) != len(payloads):
+                    raise ValueError(f"malformed batch response for {len(payloads)} checks")
+                breaker.record_success()
+            except Exception as e:
+                room_check_duration.observe(time.perf_counter() - started)
+                room_check_outcomes.labels("error").inc(len(payloads))
+                set_tag("alkemio.outcome", "error")
+                raise self._room_check_failed(e) from e
+        room_check_duration.observe(time.perf_counter() - started)
+
+        answers: List[Union[dict, Exception]] = []
+        for result in results:
+            if isinstance(result, dict) and "error" not in result:
+                self._record_room_check_outcome(result)
+                answers.append(result)
+            else:
+                room_check_outcomes.labels("error").inc()
+                logger.error("Room check failed in batch: %s", result)
+                answers.append(SynapseError(503, "Service temporarily unavailable", Codes.UNKNOWN))
+        return answers
+
+    def _record_room_check_outcome(self, resp: dict) -> str:
+        if not resp.get("allow", False):
+            outcome = "deny"
+        elif _parse_alkemio_room_id(resp) is None:
+            outcome = "invalid_id"
+        else:
+            outcome = "allow"
+        room_check_outcomes.labels(outcome).inc()
+        return outcome
+
+    def _room_check_failed(self, e: Exception) -> SynapseError:
+        """Count a failed adapter call against the breaker; the error to raise."""
+        breaker = self._adapter_breaker
+        if isinstance(e, HttpResponseException) and e.code < 500:
+            # The adapter answered; only outages count against the breaker.
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+            if breaker.state == CircuitBreaker.OPEN:
+                logger.warning(
+                    "Room check: adapter circuit breaker open for %dms after: %s",
+                    self.config.adapter_breaker_reset_ms, e,
+                )
+        logger.error("Room check failed: %s", str(e))
+        return SynapseError(
+            503,
+            "Service temporarily unavailable",
+            Codes.UNKNOWN,
+        )
+
+    async def _check_room_once(
+        self,
+        creator: str,
+        members: list,
+        is_direct: bool,
+    ) -> dict:
+        """
+        _check_room with identical concurrent checks coalesced and recent
+        denials answered locally.
+
+        Callers that join an in-flight check share its denial (or error). An
+        approval reserves an Alkemio room for the request that made the
+        call only, so a caller that joined it asks the adapter again and
+        lets the adapter deduplicate.
+        """
+        key = (creator, frozenset(members), bool(is_direct))
+        counters = self._room_check_counters
+        counters["requests"] += 1
+
+        denial = self._get_cached_room_check_denial(key)
+        if denial is not None:
+            counters["cached_denials"] += 1
+            return denial
+
+        while True:
+            in_flight = self._room_checks_in_flight.get(key)
+            if in_flight is None:
+                break
+            counters["coalesced"] += 1
+            resp = await make_deferred_yieldable(in_flight.observe())
+            if not resp.get("allow", False):
+                return resp
+
+        counters["adapter_calls"] += 1
+        d = run_in_background(self._admitted_check_room, creator, members, is_direct)
+
+        def finished(result):
+            self._room_checks_in_flight.pop(key, None)
+            if isinstance(result, dict) and not result.get("allow", False):
+                self._cache_room_check_denial(key, result)
+            return result
+
+        d.addBoth(finished)
+        in_flight = ObservableDeferred(d, consumeErrors=True)
+        if not d.called:
+            # Only register checks still running; finished() has already run otherwise.
+            self._room_checks_in_flight[key] = in_flight
+        return await make_deferred_yieldable(in_flight.observe())
+
+    async def _admitted_check_room(self, creator: str, members: list, is_direct: bool) -> dict:
+        """
+        _check_room behind the admission gate.
+
+        Raises:
+            LimitExceededError: 429 when the wait queue is full, 503 when no
+                slot freed up within room_check_queue_timeout_ms; both carry
+                retry_after_ms.
+        """
+        gate = self._room_check_gate
         try:
-            resp = await self.http_client.post_json_get_json(
-                check_url,
-                payload,
-                headers=headers,
+            await gate.acquire()
+        except AdmissionRejected as e:
+            room_check_rejected.labels(e.reason).inc()
+            logger.warning(
+                "Room check: admission refused (%s), %d in flight, %d queued",
+                e.reason, gate.in_flight, gate.queue_depth,
             )
-            return resp
-        except Exception as e:
-            logger.error("Room check failed: %s", str(e))
-            raise SynapseError(
-                503,
-                "Service temporarily unavailable",
-                Codes.UNKNOWN,
+            raise LimitExceededError(
+                "alkemio_room_check",
+                code=429 if e.reason == "queue_full" else 503,
+                retry_after_ms=self.config.room_check_queue_timeout_ms,
             ) from e
+        try:
+            if self._room_check_batcher is not None:
+                return await self._room_check_batcher.submit(
+                    {"creator": creator, "members": members, "is_direct": is_direct}
+                )
+            return await self._check_room(creator, members, is_direct)
+        finally:
+            gate.release()
+
+    def _get_cached_room_check_denial(self, key: tuple) -> Optional[dict]:
+        denials = self._room_check_denials
+        if not denials:
+            return None
+        now = self._clock.time_msec()
+        while denials:
+            expires, _ = next(iter(denials.values()))
+            if expires > now:
+                break
+            denials.popitem(last=False)
+        entry = denials.get(key)
+        return entry[1] if entry is not None else None
+
+    def _cache_room_check_denial(self, key: tuple, resp: dict) -> None:
+        ttl = self.config.room_check_denial_ttl_ms
+        if not ttl:
+            return
+        self._room_check_denials.pop(key, None)
+        self._room_check_denials[key] = (self._clock.time_msec() + ttl, resp)
+
+    def room_check_stats(self) -> Dict[str, int]:
+        batcher = self._room_check_batcher
+        return {
+            **self._room_check_counters,
+            "adapter_batches": batcher.batches if batcher is not None else 0,
+            "denials_cached": len(self._room_check_denials),
+            "breaker_rejected": self._adapter_breaker.rejected,
+            "breaker_opened": self._adapter_breaker.opened,
+        }
 
     async def on_create_room(
         self,
@@ -328,6 +2761,13 @@ class AlkemioRoomControl:
         invite_list = request_content.get("invite", [])
         is_direct = request_content.get("is_direct", False)
 
+        # This callback runs before Synapse validates the body, and the
+        # invitees become part of the coalescing key.
+        if not isinstance(invite_list, list) or not all(
+            isinstance(invitee, str) for invitee in invite_list
+        ):
+            raise SynapseError(400, "'invite' must be a list of user IDs", Codes.BAD_JSON)
+
         if not invite_list:
             logger.info("Room creation blocked (no invitees): %s", user_id)
             raise SynapseError(
@@ -344,23 +2784,24 @@ class AlkemioRoomControl:
         )
 
         # Call adapter check endpoint
-        resp = await self._check_room(user_id, invite_list, is_direct)
+        resp = await self._check_room_once(user_id, invite_list, is_direct)
 
         if not resp.get("allow", False):
             reason = resp.get("reason", "Room creation not permitted")
-            logger.info("Room check rejected: %s — %s", user_id, reason)
+            logger.info(
+                "Room check rejected: %s — %s (checks %s)",
+                user_id, reason, self.room_check_stats(),
+            )
             raise SynapseError(403, reason, Codes.FORBIDDEN)
 
-        alkemio_room_id = resp.get("alkemio_room_id", "")
-        try:
-            alkemio_room_id = str(uuid.UUID(alkemio_room_id))
-        except (TypeError, ValueError, AttributeError) as e:
+        alkemio_room_id = _parse_alkemio_room_id(resp)
+        if alkemio_room_id is None:
             logger.error("Room check approved without valid alkemio_room_id: %s", resp)
             raise SynapseError(
                 503,
                 "Service temporarily unavailable",
                 Codes.UNKNOWN,
-            ) from e
+            )
         logger.info(
             "Room check approved: %s, alkemio_room_id=%s",
             user_id,
@@ -385,7 +2826,7 @@ class AlkemioRoomControl:
             "content": {"visible": True},
         })
         request_content["initial_state"].append({
-            "type": "io.alkemio.pending",
+            "type": ALKEMIO_PENDING_EVENT,
             "state_key": "",
             "content": {"alkemio_room_id": alkemio_room_id},
         })
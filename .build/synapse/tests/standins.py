@@ -0,0 +1,712 @@
+# Copyright 2025 Alkemio Foundation
+# SPDX-License-Identifier: EUPL-1.2
+
+"""
+In-process stand-ins for the parts of Synapse that AlkemioRoomControl touches.
+
+They model only the surface the module uses (ModuleApi, the SyncHandler,
+the state storage controller and the AppService store) so the module can be
+driven without a homeserver or database.
+"""
+
+import contextlib
+import io
+import json
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+MODULES_DIR = Path(__file__).resolve().parent.parent / "modules"
+if str(MODULES_DIR) not in sys.path:
+    sys.path.insert(0, str(MODULES_DIR))
+
+from twisted.internet import defer, task  # noqa: E402
+from twisted.web import resource, server  # noqa: E402
+
+from synapse.api.errors import AuthError, Codes, SynapseError  # noqa: E402
+from synapse.crypto.context_factory import RegularPolicyForHTTPS  # noqa: E402
+from synapse.handlers.room_summary import _RoomEntry  # noqa: E402
+from synapse.types import UserID  # noqa: E402
+from synapse.util import Clock  # noqa: E402
+
+import alkemio_room_control  # noqa: E402
+
+SERVER_NAME = "alkemio.matrix.host"
+BOT_LOCALPART = "00000000-0000-0000-0000-000000000000"
+BOT_MXID = f"@{BOT_LOCALPART}:{SERVER_NAME}"
+
+
+class StandInEvent:
+    def __init__(
+        self, room_id: str, event_type: str, content: dict,
+        state_key: Optional[str] = "", instance_name: str = "master",
+        origin_server_ts: int = 0,
+    ):
+        self.room_id = room_id
+        self.origin_server_ts = origin_server_ts
+        self.type = event_type
+        self.content = content
+        self._state_key = state_key
+        self.internal_metadata = SimpleNamespace(instance_name=instance_name)
+
+    def get_state_key(self) -> Optional[str]:
+        return self._state_key
+
+
+class StandInTransaction:
+    """The slice of LoggingTransaction used by module queries, over sqlite3."""
+
+    database_engine = SimpleNamespace(supports_using_any_list=False)
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, sql: str, args=()) -> None:
+        self._cursor.execute(sql, list(args))
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor.fetchall())
+
+
+class StandInTracer:
+    """
+    Records spans opened with start_active_span and the tags set on them.
+
+    install() swaps it in for the module's opentracing helpers; set_tag tags
+    the innermost open span, like Synapse's helpers do with a real tracer.
+    """
+
+    def __init__(self):
+        self.spans: List[dict] = []
+        self._active: List[dict] = []
+
+    def install(self, test_case) -> None:
+        for name in ("start_active_span", "set_tag"):
+            test_case.addCleanup(setattr, alkemio_room_control, name, getattr(alkemio_room_control, name))
+            setattr(alkemio_room_control, name, getattr(self, name))
+
+    @contextlib.contextmanager
+    def start_active_span(self, operation_name: str, tags: Optional[dict] = None, **kwargs):
+        span = {
+            "name": operation_name,
+            "parent": self._active[-1]["name"] if self._active else None,
+            "tags": dict(tags or {}),
+        }
+        self.spans.append(span)
+        self._active.append(span)
+        try:
+            yield span
+        finally:
+            self._active.remove(span)
+
+    def set_tag(self, key: str, value) -> None:
+        if self._active:
+            self._active[-1]["tags"][key] = value
+
+    def named(self, name: str) -> List[dict]:
+        return [span for span in self.spans if span["name"] == name]
+
+
+class StandInStateStorage:
+    """
+    Current io.alkemio.visibility and io.alkemio.pending room state.
+
+    The same state is mirrored into an in-memory sqlite database shaped like
+    Synapse's current_state_events/event_json tables for bulk queries.
+    latency (seconds) is added to every database interaction and state read;
+    stalled makes them hang until cancelled.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.stalled = False
+        self.current_state: Dict[Tuple[str, str], StandInEvent] = {}
+        self.failing_rooms = set()
+        self.bulk_available = True
+        self.lookups = 0
+        self.db_interactions = 0
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(
+            """
+            CREATE TABLE current_state_events (
+                event_id TEXT, room_id TEXT, type TEXT, state_key TEXT
+            );
+            CREATE TABLE event_json (event_id TEXT PRIMARY KEY, json TEXT);
+            """
+        )
+        self._event_seq = 0
+
+    def set_visibility(self, room_id: str, visible: Optional[bool]) -> None:
+        content = None if visible is None else {"visible": visible}
+        self._set_state(room_id, alkemio_room_control.ALKEMIO_VISIBILITY_EVENT, content)
+
+    def set_pending(self, room_id: str, content: Optional[dict], origin_server_ts: int = 0) -> None:
+        """Set (or with None, drop) the io.alkemio.pending state."""
+        self._set_state(
+            room_id, alkemio_room_control.ALKEMIO_PENDING_EVENT, content, origin_server_ts
+        )
+
+    def _set_state(
+        self, room_id: str, event_type: str, content: Optional[dict], origin_server_ts: int = 0
+    ) -> None:
+        self.db.execute(
+            "DELETE FROM current_state_events WHERE room_id = ? AND type = ?",
+            (room_id, event_type),
+        )
+        if content is None:
+            self.current_state.pop((room_id, event_type), None)
+            return
+        self.current_state[(room_id, event_type)] = StandInEvent(
+            room_id, event_type, content, origin_server_ts=origin_server_ts
+        )
+        self._event_seq += 1
+        event_id = f"$state{self._event_seq}"
+        event_json = {"type": event_type, "content": content, "origin_server_ts": origin_server_ts}
+        self.db.execute("INSERT INTO event_json VALUES (?, ?)", (event_id, json.dumps(event_json)))
+        self.db.execute(
+            "INSERT INTO current_state_events VALUES (?, ?, ?, '')",
+            (event_id, room_id, event_type),
+        )
+
+    def run_interaction(self, func, *args):
+        self.db_interactions += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.bulk_available:
+            raise RuntimeError("database unavailable")
+        return func(StandInTransaction(self.db.cursor()), *args)
+
+    async def get_current_state_event(self, room_id: str, event_type: str, state_key: str):
+        self.lookups += 1
+        if self.stalled:
+            await defer.Deferred()
+        if self.latency:
+            time.sleep(self.latency)
+        if room_id in self.failing_rooms:
+            raise RuntimeError(f"storage failure for {room_id}")
+        return self.current_state.get((room_id, event_type))
+
+
+@dataclass(frozen=True)
+class StandInStreamToken:
+    room_key: int
+
+
+class StandInSyncResultBuilder:
+    def __init__(
+        self, sync_config, since_token, full_state, now_token,
+        joined_room_ids, excluded_room_ids, membership_change_events,
+    ):
+        self.sync_config = sync_config
+        self.since_token = since_token
+        self.full_state = full_state
+        self.now_token = now_token
+        self.joined_room_ids = joined_room_ids
+        self.excluded_room_ids = excluded_room_ids
+        self.forced_newly_joined_room_ids = frozenset()
+        self.membership_change_events = membership_change_events
+
+
+class StandInSyncHandler:
+    """
+    Builds result builders from a user_id -> joined rooms map.
+
+    join() advances the room stream and records a membership event so
+    incremental syncs see the same membership_change_events Synapse reports.
+    """
+
+    def __init__(self):
+        self.rooms_for_user: Dict[str, List[str]] = {}
+        self.rooms_to_exclude_globally: List[str] = []
+        self.room_stream = 1
+        self._memberships: List[tuple] = []
+
+    def join(self, user_id: str, room_id: str) -> None:
+        self.room_stream += 1
+        self.rooms_for_user.setdefault(user_id, []).append(room_id)
+        self._memberships.append((self.room_stream, user_id, room_id))
+
+    async def get_sync_result_builder(self, sync_config, since_token=None, full_state=False):
+        user_id = sync_config.user.to_string()
+        excluded = set(self.rooms_to_exclude_globally)
+        joined = frozenset(
+            room_id for room_id in self.rooms_for_user.get(user_id, ())
+            if room_id not in excluded
+        )
+        membership_change_events = []
+        if since_token is not None:
+            membership_change_events = [
+                SimpleNamespace(room_id=room_id, membership="join")
+                for stream, member, room_id in self._memberships
+                if member == user_id and stream > since_token.room_key
+                and room_id not in excluded
+            ]
+        return StandInSyncResultBuilder(
+            sync_config, since_token, full_state,
+            StandInStreamToken(self.room_stream),
+            joined, frozenset(excluded), membership_change_events,
+        )
+
+
+class StandInSlidingSyncRoomLists:
+    """
+    The room-list half of Sliding Sync: read the membership map from the
+    store, sort it by recency and cut the requested window.
+
+    Like Synapse's SlidingSyncRoomLists, an incremental request (from_token
+    set) adds back newly-left rooms, from _get_newly_joined_and_left_rooms
+    or, with use_fallback, _get_newly_joined_and_left_rooms_fallback. Each
+    one missing from the map is read with get_sliding_sync_room_for_user; a
+    None there is a state reset, and the room is added back from the
+    newly-left map. Subscribed rooms missing from the map are fetched with
+    get_sliding_sync_room_for_user_batch. newly_left lists each user's
+    newly-left rooms, fetched_rooms records every room whose per-room data
+    would be loaded.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.use_fallback = False
+        self.newly_left: Dict[str, List[str]] = {}
+        self.fetched_rooms: List[str] = []
+
+    async def _get_newly_joined_and_left_rooms(self, user_id: str, to_token, from_token):
+        if not from_token:
+            return set(), {}
+        # Left after every room in the snapshot map, so first in the list.
+        return set(), {
+            room_id: SimpleNamespace(room_id=room_id, membership="leave", stream=1000)
+            for room_id in self.newly_left.get(user_id, ())
+        }
+
+    _get_newly_joined_and_left_rooms_fallback = _get_newly_joined_and_left_rooms
+
+    async def compute_interested_rooms(
+        self, user_id: str, window: int, subscriptions=(), from_token=None
+    ):
+        rooms = await self.store.get_sliding_sync_rooms_for_user_from_membership_snapshots(user_id)
+        left = await self.store.get_sliding_sync_self_leave_rooms_after_to_token(user_id, None)
+        rooms = {**rooms, **left}
+        get_newly_left = (
+            self._get_newly_joined_and_left_rooms_fallback
+            if self.use_fallback
+            else self._get_newly_joined_and_left_rooms
+        )
+        _, newly_left_room_map = await get_newly_left(user_id, to_token=None, from_token=from_token)
+        for room_id in newly_left_room_map.keys() - rooms.keys():
+            room = await self.store.get_sliding_sync_room_for_user(user_id, room_id)
+            rooms[room_id] = newly_left_room_map[room_id] if room is None else room
+        ordered = sorted(rooms.values(), key=lambda room: room.stream, reverse=True)
+        listed = [room.room_id for room in ordered[:window]]
+        rooms.update(await self.store.get_sliding_sync_room_for_user_batch(
+            user_id, set(subscriptions) - rooms.keys()
+        ))
+        subscribed = [room_id for room_id in subscriptions if room_id in rooms]
+        self.fetched_rooms.extend(listed + subscribed)
+        return listed, subscribed
+
+
+class StandInAdapterClient:
+    """
+    Adapter HTTP client: each check-room POST is recorded and answered by
+    firing its Deferred from the test with respond() or fail().
+    """
+
+    def __init__(self):
+        self.calls: List[dict] = []
+        self._pending: List[defer.Deferred] = []
+
+    def post_json_get_json(self, uri: str, post_json: dict, headers=None) -> defer.Deferred:
+        self.calls.append(post_json)
+        d: defer.Deferred = defer.Deferred()
+        self._pending.append(d)
+        return d
+
+    def respond(self, response: dict) -> None:
+        self._pending.pop(0).callback(response)
+
+    def fail(self, error: Exception) -> None:
+        self._pending.pop(0).errback(error)
+
+
+class StandInAdapter(resource.Resource):
+    """
+    A local adapter serving /_matrix/app/alkemio/check-room (and its /batch
+    variant) over real HTTP.
+
+    delay makes it slow, listen()/stop() bring it up and down. connections
+    counts TCP connections accepted, to observe keep-alive reuse; posts
+    counts round trips, requests the checks they carried. A batched check
+    whose creator is in failing_creators gets an error entry.
+    """
+
+    isLeaf = True
+
+    def __init__(self, reactor, response: Optional[dict] = None):
+        super().__init__()
+        self.reactor = reactor
+        self.response = response or {"allow": False, "reason": "stand-in"}
+        self.delay = 0.0
+        self.requests: List[dict] = []
+        self.posts = 0
+        self.failing_creators = set()
+        self.connections = 0
+        self._port = None
+        self._port_number = 0
+        self._delayed: list = []
+
+    def render_POST(self, request):
+        self.posts += 1
+        payload = json.loads(request.content.read())
+        if request.path.endswith(b"/batch"):
+            self.requests.extend(payload["checks"])
+            body = json.dumps({"results": [
+                {"error": {"errcode": "M_UNKNOWN", "error": "stand-in failure"}}
+                if check["creator"] in self.failing_creators else self.response
+                for check in payload["checks"]
+            ]}).encode()
+        else:
+            self.requests.append(payload)
+            body = json.dumps(self.response).encode()
+        request.setHeader(b"Content-Type", b"application/json")
+        if not self.delay:
+            return body
+
+        def respond():
+            if not request.finished and not request._disconnected:
+                request.write(body)
+                request.finish()
+
+        self._delayed.append(self.reactor.callLater(self.delay, respond))
+        return server.NOT_DONE_YET
+
+    def listen(self) -> str:
+        site = server.Site(self)
+        build_protocol = site.buildProtocol
+
+        def counting_build_protocol(addr):
+            self.connections += 1
+            return build_protocol(addr)
+
+        site.buildProtocol = counting_build_protocol
+        self._port = self.reactor.listenTCP(self._port_number, site, interface="127.0.0.1")
+        self._port_number = self._port.getHost().port
+        return f"http://127.0.0.1:{self._port_number}"
+
+    def stop(self) -> defer.Deferred:
+        for delayed in self._delayed:
+            if delayed.active():
+                delayed.cancel()
+        port, self._port = self._port, None
+        return defer.maybeDeferred(port.stopListening) if port else defer.succeed(None)
+
+
+class StandInNotifier:
+    """
+    The slice of Synapse's Notifier that delivers persisted room events.
+
+    on_new_room_events() builds the pending entries Synapse builds (type,
+    state key, membership and position, no event body) and hands them to
+    notify_new_room_events, which records the event IDs it was given.
+    """
+
+    def __init__(self):
+        self.notified: List[str] = []
+        self._event_seq = 0
+
+    async def on_new_room_events(self, *events: StandInEvent) -> None:
+        entries = []
+        for event in events:
+            self._event_seq += 1
+            entry = SimpleNamespace(
+                event_pos=SimpleNamespace(instance_name=event.internal_metadata.instance_name),
+                extra_users=[],
+                room_id=event.room_id,
+                type=event.type,
+                state_key=event.get_state_key(),
+                membership=event.content.get("membership"),
+            )
+            entries.append((entry, f"$event{self._event_seq}"))
+        await self.notify_new_room_events(entries, None)
+
+    async def notify_new_room_events(self, event_entries, max_room_stream_token) -> None:
+        self.notified.extend(event_id for _, event_id in event_entries)
+
+
+class StandInMainStore(SimpleNamespace):
+    """The main datastore: a namespace of the reads the module and the patched servlets use."""
+
+    # Hashed by identity like Synapse's DataStore (SimpleNamespace compares by value).
+    __hash__ = object.__hash__
+
+
+class StandInRoomSummaryHandler:
+    """
+    Room summaries and the space hierarchy over a space -> child rooms map.
+
+    get_room_hierarchy walks the tree depth first like Synapse's, calling
+    _summarize_local_room for each room it reaches and queueing the rooms
+    listed in the summary's m.space.child events. summarised records every
+    room summarised either way.
+    """
+
+    def __init__(self):
+        self.summarised: List[str] = []
+        self.children: Dict[str, List[str]] = {}
+
+    async def get_room_summary(self, requester, room_id: str, remote_room_hosts=None):
+        self.summarised.append(room_id)
+        return {"room_id": room_id}
+
+    async def get_room_hierarchy(self, requester, requested_room_id: str, suggested_only=False,
+                                 max_depth=None, limit=None, from_token=None):
+        rooms = []
+        queue = [requested_room_id]
+        while queue:
+            room_entry = await self._summarize_local_room(
+                requester.user.to_string(), None, queue.pop(), suggested_only
+            )
+            if room_entry is None:
+                continue
+            rooms.append(room_entry.as_json(for_client=True))
+            queue.extend(ev["state_key"] for ev in reversed(room_entry.children_state_events))
+        return {"rooms": rooms}
+
+    async def _summarize_local_room(self, requester, origin, room_id: str, suggested_only: bool,
+                                    include_children: bool = True):
+        self.summarised.append(room_id)
+        children = [
+            {"type": "m.space.child", "state_key": child, "content": {"via": [SERVER_NAME]}}
+            for child in self.children.get(room_id, ())
+        ]
+        return _RoomEntry(room_id, {"room_id": room_id}, children)
+
+
+class StandInHomeServer:
+    def __init__(self, instance_name: str = "master", reactor=None):
+        self.instance_name = instance_name
+        self.reactor = reactor or task.Clock()
+        self.clock = Clock(self.reactor)
+        self.version_string = "Synapse/stand-in"
+        self.config = SimpleNamespace(server=SimpleNamespace(user_agent_suffix=None))
+        self.sync_handler = StandInSyncHandler()
+        self.state_storage = StandInStateStorage()
+        self.notifier = StandInNotifier()
+        appservice = SimpleNamespace(
+            id=alkemio_room_control.AlkemioRoomControl.APPSERVICE_ID,
+            sender=BOT_MXID,
+            url="http://adapter.invalid",
+            hs_token="hs-token",
+        )
+        # (stream_ordering, user_id, room_id) push actions and room_id -> unread count
+        self.push_actions: List[tuple] = []
+        self.unread_counts: Dict[str, int] = {}
+        self.push_action_reads = 0
+        self.main_store = StandInMainStore(
+            get_app_services=lambda: [appservice],
+            get_rooms_for_user=self._get_rooms_for_user,
+            get_push_actions_for_user=self._get_push_actions_for_user,
+            get_invited_rooms_for_local_user=self._no_invites,
+            get_unread_counts_by_room_for_user=self._get_unread_counts,
+            get_sliding_sync_rooms_for_user_from_membership_snapshots=(
+                self._get_sliding_sync_rooms_for_user
+            ),
+            get_sliding_sync_self_leave_rooms_after_to_token=self._no_self_leave_rooms,
+            get_sliding_sync_room_for_user=self._get_sliding_sync_room_for_user,
+            get_sliding_sync_room_for_user_batch=self._get_sliding_sync_room_for_user_batch,
+        )
+        self.sliding_sync_handler = SimpleNamespace(
+            room_lists=StandInSlidingSyncRoomLists(self.main_store)
+        )
+        self.room_summary_handler = StandInRoomSummaryHandler()
+        self.auth = SimpleNamespace(get_user_by_req=self._get_user_by_req)
+
+    async def _get_rooms_for_user(self, user_id: str):
+        return frozenset(self.sync_handler.rooms_for_user.get(user_id, ()))
+
+    async def _get_sliding_sync_rooms_for_user(self, user_id: str):
+        return {
+            room_id: SimpleNamespace(room_id=room_id, membership="join", stream=stream)
+            for stream, room_id in enumerate(self.sync_handler.rooms_for_user.get(user_id, ()))
+        }
+
+    async def _no_self_leave_rooms(self, user_id: str, to_token):
+        return {}
+
+    async def _get_sliding_sync_room_for_user(self, user_id: str, room_id: str):
+        rooms = await self._get_sliding_sync_room_for_user_batch(user_id, [room_id])
+        return rooms.get(room_id)
+
+    async def _get_sliding_sync_room_for_user_batch(self, user_id: str, room_ids):
+        # Any membership the user has, whether or not the snapshot map lists it.
+        rooms = await self._get_sliding_sync_rooms_for_user(user_id)
+        return {room_id: rooms[room_id] for room_id in room_ids if room_id in rooms}
+
+    async def _get_push_actions_for_user(
+        self, user_id: str, before=None, limit: int = 50, only_highlight: bool = False
+    ):
+        self.push_action_reads += 1
+        actions = sorted(
+            (
+                SimpleNamespace(stream_ordering=stream, room_id=room_id)
+                for stream, member, room_id in self.push_actions
+                if member == user_id and (before is None or stream < before)
+            ),
+            key=lambda action: action.stream_ordering,
+            reverse=True,
+        )
+        return actions[:limit]
+
+    async def _no_invites(self, user_id: str):
+        return []
+
+    async def _get_unread_counts(self, user_id: str):
+        return dict(self.unread_counts)
+
+    async def _get_user_by_req(self, request, allow_guest=False):
+        return request.requester
+
+    def get_clock(self) -> Clock:
+        return self.clock
+
+    def get_reactor(self):
+        return self.reactor
+
+    def get_http_client_context_factory(self):
+        return RegularPolicyForHTTPS()
+
+    def get_instance_name(self) -> str:
+        return self.instance_name
+
+    def get_notifier(self):
+        return self.notifier
+
+    def get_sync_handler(self):
+        return self.sync_handler
+
+    def get_sliding_sync_handler(self):
+        return self.sliding_sync_handler
+
+    def get_room_summary_handler(self):
+        return self.room_summary_handler
+
+    def get_auth(self):
+        return self.auth
+
+    def get_event_client_serializer(self):
+        return None
+
+    def get_storage_controllers(self):
+        return SimpleNamespace(state=self.state_storage)
+
+    def get_datastores(self):
+        return SimpleNamespace(main=self.main_store)
+
+
+class StandInModuleApi:
+    """
+    ModuleApi stand-in.
+
+    replication, if set, is called with (cache_name, keys) for every
+    cross-worker invalidation, standing in for Synapse's caches stream.
+    """
+
+    def __init__(self, hs: Optional[StandInHomeServer] = None, replication=None):
+        self._hs = hs or StandInHomeServer()
+        self.server_name = SERVER_NAME
+        self.replication = replication
+        self.third_party_rules_callbacks: Dict[str, object] = {}
+        self.cached_functions: Dict[str, object] = {}
+        self.delayed_calls: List[tuple] = []
+        self.web_resources: Dict[str, resource.Resource] = {}
+        self.admins = set()
+        # Events sent through create_and_send_event_into_room; sending into
+        # a room in unsendable_rooms fails as if the sender had left it.
+        self.sent_events: List[dict] = []
+        self.unsendable_rooms = set()
+
+    def register_third_party_rules_callbacks(self, **callbacks) -> None:
+        self.third_party_rules_callbacks.update(
+            {name: cb for name, cb in callbacks.items() if cb is not None}
+        )
+
+    def register_web_resource(self, path: str, web_resource: resource.Resource) -> None:
+        self.web_resources[path] = web_resource
+
+    async def get_user_by_req(self, req):
+        """The requester attached to a StandInRequest; a missing one is a 401."""
+        if req.requester is None:
+            raise AuthError(401, "Missing access token", Codes.MISSING_TOKEN)
+        return req.requester
+
+    async def is_user_admin(self, user_id: str) -> bool:
+        return user_id in self.admins
+
+    async def create_and_send_event_into_room(self, event_dict: dict):
+        room_id = event_dict["room_id"]
+        if room_id in self.unsendable_rooms:
+            raise SynapseError(403, "User not in room", Codes.FORBIDDEN)
+        self.sent_events.append(event_dict)
+        self._hs.state_storage.set_visibility(room_id, event_dict["content"]["visible"])
+        return StandInEvent(room_id, event_dict["type"], event_dict["content"])
+
+    def delayed_background_call(self, msec: float, f, *args, desc: Optional[str] = None):
+        """Recorded, not run: tests start background work with run_delayed_calls()."""
+        self.delayed_calls.append((msec, f, args))
+
+    def run_delayed_calls(self) -> None:
+        calls, self.delayed_calls = self.delayed_calls, []
+        for _, f, args in calls:
+            defer.ensureDeferred(f(*args))
+
+    def register_cached_function(self, cached_func) -> None:
+        self.cached_functions[f"{cached_func.__module__}.{cached_func.__name__}"] = cached_func
+
+    async def invalidate_cache(self, cached_func, keys) -> None:
+        cached_func.invalidate(keys)
+        if self.replication is not None:
+            self.replication(f"{cached_func.__module__}.{cached_func.__name__}", keys)
+
+    def receive_invalidation(self, cache_name: str, keys) -> None:
+        """Apply an invalidation row from another worker, as Synapse does."""
+        cached_func = self.cached_functions.get(cache_name)
+        if cached_func is None:
+            return
+        if keys is None:
+            cached_func.invalidate_all()
+        else:
+            cached_func.invalidate(tuple(keys))
+
+    def run_db_interaction(self, desc: str, func, *args):
+        if self._hs.state_storage.stalled:
+            return defer.Deferred()
+        return defer.maybeDeferred(self._hs.state_storage.run_interaction, func, *args)
+
+
+class StandInRequest:
+    """A request to a module web resource: query args, a JSON body and who sent it."""
+
+    def __init__(self, body=None, requester=None, args: Optional[Dict[str, str]] = None):
+        self.content = io.BytesIO(json.dumps(body).encode())
+        self.requester = requester
+        self.args = {
+            name.encode(): [value.encode()] for name, value in (args or {}).items()
+        }
+
+
+def make_module(config: Optional[dict] = None, api: Optional[StandInModuleApi] = None):
+    """Build an AlkemioRoomControl wired to stand-ins; returns (module, api)."""
+    api = api or StandInModuleApi()
+    parsed = alkemio_room_control.AlkemioRoomControl.parse_config(config or {})
+    return alkemio_room_control.AlkemioRoomControl(parsed, api), api
+
+
+def sync_config_for(user_id: str, device_id: Optional[str] = "DEVICE"):
+    return SimpleNamespace(user=UserID.from_string(user_id), device_id=device_id)
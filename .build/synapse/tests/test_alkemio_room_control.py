@@ -0,0 +1,1287 @@
+import multiprocessing
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SkipTest, SynchronousTestCase, TestCase
+from prometheus_client import REGISTRY
+
+TESTS_DIR = Path(__file__).resolve().parent
+if str(TESTS_DIR) not in sys.path:
+    sys.path.insert(0, str(TESTS_DIR))
+
+import standins
+from alkemio_room_control import (
+    ALKEMIO_PENDING_EVENT,
+    ALKEMIO_VISIBILITY_EVENT,
+    PENDING_ROOMS_PATH,
+    VISIBILITY_UPDATE_PATH,
+    AlkemioRoomControl,
+    RoomVisibilityCache,
+    UserHiddenRoomCache,
+)
+from synapse.module_api.errors import ConfigError, SynapseError
+from synapse.push import push_tools
+from synapse.rest.client.notifications import NotificationsServlet
+from synapse.rest.client.room import JoinedRoomsRestServlet
+from synapse.types import create_requester
+
+USER = "@11111111-1111-1111-1111-111111111111:alkemio.matrix.host"
+ALKEMIO_ROOM_ID = "5f0c1b7e-2a55-4c36-9a4e-0d6a3f7f3c11"
+
+
+class RoomVisibilityCacheTestCase(SynchronousTestCase):
+
+    def test_counts_hits_and_misses(self):
+        cache = RoomVisibilityCache(max_size=10)
+        self.assertIsNone(cache.get("!a"))
+        cache.set("!a", False)
+        self.assertIs(cache.get("!a"), False)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = RoomVisibilityCache(max_size=2)
+        cache.set("!a", True)
+        cache.set("!b", True)
+        cache.get("!a")
+        cache.set("!c", True)
+        self.assertIsNone(cache.get("!b"))
+        self.assertIs(cache.get("!a"), True)
+        self.assertEqual(cache.evictions, 1)
+
+
+class SyncFilterTestCase(SynchronousTestCase):
+
+    config = None
+
+    def setUp(self):
+        self.module, self.api = standins.make_module(self.config)
+        self.hs = self.api._hs
+        self.storage = self.hs.state_storage
+        self.hs.sync_handler.rooms_for_user[USER] = ["!visible", "!hidden", "!unset"]
+        self.storage.set_visibility("!visible", True)
+        self.storage.set_visibility("!hidden", False)
+
+    def sync(self, user_id=USER, since_token=None, full_state=False):
+        return self.successResultOf(defer.ensureDeferred(
+            self.hs.sync_handler.get_sync_result_builder(
+                standins.sync_config_for(user_id), since_token, full_state
+            )
+        ))
+
+    def new_event(self, room_id, visible):
+        self.storage.set_visibility(room_id, visible)
+        event = standins.StandInEvent(room_id, ALKEMIO_VISIBILITY_EVENT, {"visible": visible})
+        self.successResultOf(defer.ensureDeferred(self.hs.notifier.on_new_room_events(event)))
+
+    def test_hidden_rooms_are_excluded(self):
+        result = self.sync()
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+        self.assertIn("!hidden", result.excluded_room_ids)
+
+    def test_bot_sees_every_room(self):
+        self.hs.sync_handler.rooms_for_user[standins.BOT_MXID] = ["!hidden"]
+        result = self.sync(user_id=standins.BOT_MXID)
+        self.assertEqual(result.joined_room_ids, frozenset({"!hidden"}))
+
+    def test_steady_state_sync_needs_no_storage_calls(self):
+        self.sync()
+        lookups = self.storage.lookups
+        self.sync()
+        self.assertEqual(self.storage.lookups, lookups)
+
+    def test_visibility_event_updates_cache(self):
+        self.sync()
+        self.new_event("!visible", False)
+        lookups = self.storage.lookups
+        result = self.sync()
+        self.assertEqual(self.storage.lookups, lookups)
+        self.assertNotIn("!visible", result.joined_room_ids)
+
+    def test_misses_are_loaded_in_one_database_interaction(self):
+        self.hs.sync_handler.rooms_for_user[USER] = [f"!room{i}" for i in range(1200)]
+        self.storage.set_visibility("!room7", False)
+        result = self.sync()
+        self.assertEqual(self.storage.db_interactions, 1)
+        self.assertEqual(self.storage.lookups, 0)
+        self.assertEqual(len(result.joined_room_ids), 1199)
+        self.assertNotIn("!room7", result.joined_room_ids)
+
+    def test_falls_back_to_per_room_reads_without_bulk_access(self):
+        self.storage.bulk_available = False
+        result = self.sync()
+        self.assertEqual(self.storage.lookups, 3)
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+
+    def test_lookup_error_hides_room_and_is_not_cached(self):
+        self.storage.bulk_available = False
+        self.storage.failing_rooms.add("!unset")
+        self.assertNotIn("!unset", self.sync().joined_room_ids)
+        self.storage.failing_rooms.clear()
+        self.assertIn("!unset", self.sync().joined_room_ids)
+
+
+class IncrementalSyncFilterTestCase(SyncFilterTestCase):
+
+    # These exercise the per-room re-check that runs when the hidden set cache misses.
+    config = {"user_hidden_cache_size": 0}
+
+    def cache_reads(self):
+        stats = self.module._visibility_cache.stats()
+        return stats["hits"] + stats["misses"]
+
+    def test_unchanged_incremental_sync_checks_no_rooms(self):
+        first = self.sync()
+        reads = self.cache_reads()
+        result = self.sync(since_token=first.now_token)
+        self.assertEqual(self.cache_reads(), reads)
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+        self.assertIn("!hidden", result.excluded_room_ids)
+
+    def test_only_changed_rooms_are_rechecked(self):
+        first = self.sync()
+        self.new_event("!hidden", True)
+        reads = self.cache_reads()
+        result = self.sync(since_token=first.now_token)
+        self.assertEqual(self.cache_reads(), reads + 1)
+        self.assertIn("!hidden", result.joined_room_ids)
+        self.assertEqual(result.forced_newly_joined_room_ids, frozenset({"!hidden"}))
+
+    def test_newly_joined_rooms_are_checked(self):
+        first = self.sync()
+        self.storage.set_visibility("!new-hidden", False)
+        self.hs.sync_handler.join(USER, "!new-hidden")
+        self.hs.sync_handler.join(USER, "!new-visible")
+        result = self.sync(since_token=first.now_token)
+        self.assertNotIn("!new-hidden", result.joined_room_ids)
+        self.assertIn("!new-visible", result.joined_room_ids)
+        self.assertEqual(result.forced_newly_joined_room_ids, frozenset())
+
+    def test_overflowed_change_stream_still_forces_unhidden_rooms_in(self):
+        first = self.sync()
+        self.new_event("!hidden", True)
+        # More changes than the stream change cache keeps.
+        for i in range(10_001):
+            self.module._record_visibility_change(f"!elsewhere{i}")
+        reads = self.cache_reads()
+        result = self.sync(since_token=first.now_token)
+        self.assertEqual(self.cache_reads(), reads + 3)
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!hidden", "!unset"}))
+        self.assertEqual(result.forced_newly_joined_room_ids, frozenset({"!hidden"}))
+
+    def test_full_state_and_stale_tokens_recheck_everything(self):
+        first = self.sync()
+        self.sync(since_token=first.now_token)
+        reads = self.cache_reads()
+        self.sync(since_token=first.now_token, full_state=True)
+        self.assertEqual(self.cache_reads(), reads + 3)
+        self.hs.sync_handler.join(USER, "!other")
+        self.sync(since_token=standins.StandInStreamToken(0))
+        self.assertEqual(self.cache_reads(), reads + 7)
+
+
+class TracingTestCase(SyncFilterTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tracer = standins.StandInTracer()
+        self.tracer.install(self)
+
+    def test_post_filter_sync_span(self):
+        self.sync()
+        [span] = self.tracer.named("alkemio.sync_filter")
+        self.assertEqual(span["parent"], None)
+        self.assertEqual(span["tags"], {
+            "alkemio.mode": "post_filter",
+            "alkemio.rooms_joined": 3,
+            "alkemio.hidden_set_cached": False,
+            "alkemio.incremental": False,
+            "alkemio.rooms_checked": 3,
+            "alkemio.cache_hits": 0,
+            "alkemio.cache_misses": 3,
+            "alkemio.storage_reads": 3,
+            "alkemio.rooms_hidden": 1,
+            "alkemio.rooms_unresolved": 0,
+        })
+        [load] = self.tracer.named("alkemio.load_room_visibility")
+        self.assertEqual(load["parent"], "alkemio.sync_filter")
+        self.assertEqual(load["tags"], {"alkemio.rooms": 3, "alkemio.rooms_read": 3})
+
+    def test_cached_sync_span_reads_nothing(self):
+        self.sync()
+        result = self.sync()
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+        span = self.tracer.named("alkemio.sync_filter")[-1]
+        self.assertEqual(span["tags"]["alkemio.hidden_set_cached"], True)
+        self.assertEqual(span["tags"]["alkemio.rooms_checked"], 0)
+        self.assertEqual(span["tags"]["alkemio.rooms_hidden"], 1)
+        self.assertEqual(len(self.tracer.named("alkemio.load_room_visibility")), 1)
+
+    def test_bot_sync_opens_no_span(self):
+        self.hs.sync_handler.rooms_for_user[standins.BOT_MXID] = ["!hidden"]
+        result = self.sync(user_id=standins.BOT_MXID)
+        self.assertEqual(result.joined_room_ids, frozenset({"!hidden"}))
+        self.assertEqual(self.tracer.spans, [])
+
+    def test_up_front_sync_span(self):
+        self.module, self.api = standins.make_module({"sync_exclude_hidden_up_front": True})
+        self.hs = self.api._hs
+        self.hs.sync_handler.rooms_for_user[USER] = ["!visible", "!hidden", "!unset"]
+        self.hs.state_storage.set_visibility("!hidden", False)
+        self.api.run_delayed_calls()
+        result = self.sync()
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+        [span] = self.tracer.named("alkemio.sync_filter")
+        self.assertEqual(span["tags"], {
+            "alkemio.mode": "up_front",
+            "alkemio.hidden_set_cached": False,
+            "alkemio.rooms_joined": 3,
+            "alkemio.rooms_hidden": 1,
+        })
+
+    def test_check_room_span(self):
+        module, api = standins.make_module()
+        adapter = standins.StandInAdapterClient()
+        module._http_client = adapter
+        d = defer.ensureDeferred(api.third_party_rules_callbacks["on_create_room"](
+            create_requester(USER), {"invite": ["@bob:alkemio.matrix.host"], "is_direct": True}, False,
+        ))
+        adapter.respond({"allow": False, "reason": "No consent"})
+        self.assertEqual(self.failureResultOf(d, SynapseError).value.code, 403)
+        [span] = self.tracer.named("alkemio.check_room")
+        self.assertEqual(span["tags"], {
+            "alkemio.members": 1, "alkemio.is_direct": True, "alkemio.outcome": "deny",
+        })
+
+
+class EventDeliveryTestCase(SyncFilterTestCase):
+
+    def deliver(self, *events):
+        self.successResultOf(defer.ensureDeferred(self.hs.notifier.on_new_room_events(*events)))
+
+    def test_no_on_new_event_callback_is_registered(self):
+        self.assertNotIn("on_new_event", self.api.third_party_rules_callbacks)
+
+    def test_ordinary_events_need_no_storage_reads(self):
+        self.sync()
+        lookups, interactions = self.storage.lookups, self.storage.db_interactions
+        self.deliver(*(
+            standins.StandInEvent("!visible", "m.room.message", {"body": "hi"}, state_key=None)
+            for _ in range(100)
+        ), standins.StandInEvent("!visible", "m.room.topic", {"topic": "t"}))
+        self.assertEqual(
+            (self.storage.lookups, self.storage.db_interactions), (lookups, interactions)
+        )
+        self.assertEqual(len(self.hs.notifier.notified), 101)
+
+    def test_failed_read_still_notifies_and_rereads_later(self):
+        self.sync()
+        self.storage.set_visibility("!visible", False)
+        self.storage.failing_rooms.add("!visible")
+        self.deliver(standins.StandInEvent("!visible", ALKEMIO_VISIBILITY_EVENT, {"visible": False}))
+        self.assertEqual(len(self.hs.notifier.notified), 1)
+        self.storage.failing_rooms.clear()
+        self.assertNotIn("!visible", self.sync().joined_room_ids)
+
+
+class UserHiddenRoomCacheTestCase(SyncFilterTestCase):
+
+    def cache_reads(self):
+        stats = self.module._visibility_cache.stats()
+        return stats["hits"] + stats["misses"]
+
+    def member_event(self, user_id, room_id):
+        event = standins.StandInEvent(
+            room_id, "m.room.member", {"membership": "join"}, state_key=user_id
+        )
+        self.successResultOf(defer.ensureDeferred(self.hs.notifier.on_new_room_events(event)))
+
+    def test_cached_set_needs_no_per_room_work(self):
+        self.sync()
+        reads = self.cache_reads()
+        result = self.sync(full_state=True)
+        self.assertEqual(self.cache_reads(), reads)
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+        self.assertEqual(result.excluded_room_ids, frozenset({"!hidden"}))
+
+    def test_visibility_change_in_a_joined_room_invalidates(self):
+        self.sync()
+        self.hs.sync_handler.rooms_for_user["@other:x"] = ["!elsewhere"]
+        self.sync(user_id="@other:x")
+        self.new_event("!unset", False)
+        self.assertEqual(len(self.module._user_hidden_rooms), 1)
+        self.assertNotIn("!unset", self.sync().joined_room_ids)
+
+    def test_membership_change_invalidates(self):
+        self.sync()
+        self.member_event(USER, "!visible")
+        self.assertEqual(len(self.module._user_hidden_rooms), 0)
+        # Joins this worker never saw an event for change the key instead.
+        self.sync()
+        self.storage.set_visibility("!new", False)
+        self.hs.sync_handler.join(USER, "!new")
+        self.assertNotIn("!new", self.sync().joined_room_ids)
+
+    def test_room_unhidden_via_another_device_is_forced_in(self):
+        first = self.sync()
+        self.new_event("!hidden", True)
+        self.successResultOf(defer.ensureDeferred(
+            self.hs.sync_handler.get_sync_result_builder(
+                standins.sync_config_for(USER, "OTHER"), None, False
+            )
+        ))
+        reads = self.cache_reads()
+        result = self.sync(since_token=first.now_token)
+        self.assertEqual(self.cache_reads(), reads)
+        self.assertEqual(result.forced_newly_joined_room_ids, frozenset({"!hidden"}))
+
+    def test_failed_lookups_are_not_cached(self):
+        self.storage.bulk_available = False
+        self.storage.failing_rooms.add("!unset")
+        self.sync()
+        self.assertEqual(len(self.module._user_hidden_rooms), 0)
+
+    def test_bounded_by_users_and_rooms(self):
+        cache = UserHiddenRoomCache(max_size=2, max_rooms=2)
+        cache.set("@a", {"!1", "!2"}, {"!1"})
+        cache.set("@b", {"!2"}, ())
+        cache.set("@big", {"!1", "!2", "!3"}, ())
+        self.assertEqual(len(cache), 2)
+        cache.set("@c", {"!3"}, {"!3"})
+        self.assertIsNone(cache.get("@a", frozenset({"!1", "!2"})))
+        self.assertEqual(cache.get("@b", frozenset({"!2"})).hidden_room_ids, frozenset({"!2"}))
+        cache.invalidate_room("!2")
+        self.assertEqual(cache.stats()["indexed_rooms"], 1)
+
+
+class ClientApiFilterTestCase(SyncFilterTestCase):
+
+    def hierarchy(self, user_id, room_id):
+        return defer.ensureDeferred(self.hs.room_summary_handler.get_room_hierarchy(
+            create_requester(user_id), room_id
+        ))
+
+    def test_joined_rooms_omits_hidden_rooms(self):
+        servlet = JoinedRoomsRestServlet(self.hs)
+        code, body = self.successResultOf(defer.ensureDeferred(
+            servlet.on_GET(standins.StandInRequest(requester=create_requester(USER)))
+        ))
+        self.assertEqual(code, 200)
+        self.assertEqual(sorted(body["joined_rooms"]), ["!unset", "!visible"])
+
+        self.hs.sync_handler.rooms_for_user[standins.BOT_MXID] = ["!hidden"]
+        _, body = self.successResultOf(defer.ensureDeferred(
+            servlet.on_GET(standins.StandInRequest(requester=create_requester(standins.BOT_MXID)))
+        ))
+        self.assertEqual(body["joined_rooms"], ["!hidden"])
+
+    def test_sync_and_joined_rooms_share_the_hidden_set(self):
+        self.sync()
+        reads = self.module._visibility_cache.stats()["misses"]
+        store = JoinedRoomsRestServlet(self.hs).store
+        self.assertEqual(
+            self.successResultOf(defer.ensureDeferred(store.get_rooms_for_user(USER))),
+            frozenset({"!visible", "!unset"}),
+        )
+        self.assertEqual(self.module._visibility_cache.stats()["misses"], reads)
+
+    def test_notifications_page_past_hidden_rooms(self):
+        self.hs.push_actions = [(i, USER, "!hidden") for i in range(10, 20)]
+        self.hs.push_actions += [(2, USER, "!visible"), (1, USER, "!unset"), (0, USER, "!visible")]
+        store = NotificationsServlet(self.hs).store
+        actions = self.successResultOf(defer.ensureDeferred(
+            store.get_push_actions_for_user(USER, None, 2)
+        ))
+        self.assertEqual([a.stream_ordering for a in actions], [2, 1])
+        actions = self.successResultOf(defer.ensureDeferred(
+            store.get_push_actions_for_user(USER, actions[-1].stream_ordering, 2)
+        ))
+        self.assertEqual([a.stream_ordering for a in actions], [0])
+
+    def test_badge_count_skips_hidden_rooms(self):
+        self.hs.unread_counts = {"!hidden": 5, "!visible": 2, "!unset": 0}
+        badge = self.successResultOf(defer.ensureDeferred(
+            push_tools.get_badge_count(self.hs.main_store, USER, group_by_room=False)
+        ))
+        self.assertEqual(badge, 2)
+
+    def test_hidden_room_has_no_summary(self):
+        handler = self.hs.room_summary_handler
+        failure = self.failureResultOf(
+            defer.ensureDeferred(handler.get_room_summary(USER, "!hidden")), SynapseError
+        )
+        self.assertEqual(failure.value.code, 404)
+        self.assertEqual(handler.summarised, [])
+        self.successResultOf(defer.ensureDeferred(handler.get_room_summary(None, "!visible")))
+        self.successResultOf(
+            defer.ensureDeferred(handler.get_room_summary(standins.BOT_MXID, "!hidden"))
+        )
+        self.assertEqual(handler.summarised, ["!visible", "!hidden"])
+
+    def test_hierarchy_leaves_out_hidden_rooms(self):
+        handler = self.hs.room_summary_handler
+        handler.children = {"!space": ["!visible", "!hidden", "!unset"], "!hidden": ["!unset"]}
+        body = self.successResultOf(self.hierarchy(USER, "!space"))
+        self.assertEqual([room["room_id"] for room in body["rooms"]], ["!space", "!visible", "!unset"])
+        self.assertEqual(
+            [ev["state_key"] for ev in body["rooms"][0]["children_state"]], ["!visible", "!unset"]
+        )
+        # Hidden rooms are not summarised at all.
+        self.assertEqual(handler.summarised, ["!space", "!visible", "!unset"])
+
+    def test_hidden_space_has_no_hierarchy(self):
+        handler = self.hs.room_summary_handler
+        handler.children = {"!hidden": ["!visible"]}
+        failure = self.failureResultOf(self.hierarchy(USER, "!hidden"), SynapseError)
+        self.assertEqual(failure.value.code, 404)
+        self.assertEqual(handler.summarised, [])
+
+        body = self.successResultOf(self.hierarchy(standins.BOT_MXID, "!hidden"))
+        self.assertEqual([room["room_id"] for room in body["rooms"]], ["!hidden", "!visible"])
+
+
+class PrewarmTestCase(SyncFilterTestCase):
+
+    # Keep the pending room loader out of the interaction counts.
+    config = {"pending_room_index": False}
+
+    def prewarm(self):
+        self.api.run_delayed_calls()
+
+    def test_sync_before_prewarm_reads_storage(self):
+        self.assertEqual(len(self.api.delayed_calls), 1)
+        self.sync()
+        self.assertEqual(self.storage.db_interactions, 1)
+
+    def test_prewarmed_cache_needs_no_reads(self):
+        self.prewarm()
+        self.assertTrue(self.module._visibility_index_complete)
+        interactions = self.storage.db_interactions
+        result = self.sync()
+        self.assertEqual(self.storage.db_interactions, interactions)
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+
+    def test_prewarm_pages_through_all_rooms(self):
+        self.module, self.api = standins.make_module(
+            {"visibility_prewarm_batch_size": 2, "pending_room_index": False}
+        )
+        storage = self.api._hs.state_storage
+        for i in range(5):
+            storage.set_visibility(f"!room{i}", i != 3)
+        self.prewarm()
+        self.assertEqual(storage.db_interactions, 3)
+        self.assertEqual(len(self.module._visibility_cache), 5)
+        self.assertIs(self.module._visibility_cache.get("!room3"), False)
+
+    def test_invalidated_room_is_reloaded(self):
+        self.prewarm()
+        self.storage.set_visibility("!unset", False)
+        self.api.receive_invalidation("alkemio_room_control.room_visibility", ["!unset"])
+        self.assertNotIn("!unset", self.sync().joined_room_ids)
+
+    def test_evicted_rooms_are_answered_from_hidden_set(self):
+        self.module, self.api = standins.make_module({"visibility_cache_size": 1})
+        self.hs = self.api._hs
+        self.storage = self.hs.state_storage
+        self.hs.sync_handler.rooms_for_user[USER] = ["!a", "!b", "!c"]
+        self.storage.set_visibility("!a", False)
+        self.storage.set_visibility("!b", False)
+        self.prewarm()
+        interactions = self.storage.db_interactions
+        result = self.sync()
+        self.assertEqual(self.storage.db_interactions, interactions)
+        self.assertEqual(result.joined_room_ids, frozenset({"!c"}))
+
+    def test_disabled_prewarm_schedules_nothing(self):
+        _, api = standins.make_module({"visibility_prewarm": False, "pending_room_index": False})
+        self.assertEqual(api.delayed_calls, [])
+
+
+class StaleWhileRevalidateTestCase(SyncFilterTestCase):
+
+    config = {
+        "visibility_serve_stale": True,
+        "visibility_lookup_timeout_ms": 100,
+        "visibility_prewarm": False,
+    }
+
+    def invalidate(self, room_id=None):
+        keys = None if room_id is None else [room_id]
+        self.api.receive_invalidation("alkemio_room_control.room_visibility", keys)
+
+    def test_last_known_value_is_served_while_storage_fails(self):
+        self.sync()
+        self.storage.set_visibility("!visible", False)
+        self.invalidate("!visible")
+        self.invalidate("!hidden")
+        self.storage.bulk_available = False
+        self.storage.failing_rooms.update({"!visible", "!hidden"})
+        served = _sample("synapse_alkemio_visibility_stale_served_total")
+
+        first = self.sync()
+        self.assertEqual(first.joined_room_ids, frozenset({"!visible", "!unset"}))
+        self.assertEqual(_sample("synapse_alkemio_visibility_stale_served_total"), served + 2)
+
+        # The background refresh picks up the change once storage recovers.
+        self.storage.bulk_available = True
+        self.storage.failing_rooms.clear()
+        self.api.run_delayed_calls()
+        self.assertEqual(self.module._refreshing_room_ids, set())
+        result = self.sync(since_token=first.now_token)
+        self.assertEqual(result.joined_room_ids, frozenset({"!unset"}))
+
+    def test_slow_storage_does_not_stall_sync(self):
+        self.sync()
+        self.invalidate("!visible")
+        self.storage.stalled = True
+        lookups = self.storage.lookups
+        d = defer.ensureDeferred(self.hs.sync_handler.get_sync_result_builder(
+            standins.sync_config_for(USER), None, False
+        ))
+        self.assertNoResult(d)
+        self.hs.reactor.advance(0.1)
+        self.assertIn("!visible", self.successResultOf(d).joined_room_ids)
+        # A timeout does not fall back to per-room reads.
+        self.assertEqual(self.storage.lookups, lookups)
+
+    def test_reset_serves_the_previous_index(self):
+        self.module, self.api = standins.make_module({"visibility_serve_stale": True})
+        self.hs = self.api._hs
+        self.storage = self.hs.state_storage
+        self.hs.sync_handler.rooms_for_user[USER] = ["!visible", "!hidden", "!unset"]
+        self.storage.set_visibility("!hidden", False)
+        self.api.run_delayed_calls()
+        self.invalidate()
+        self.storage.bulk_available = False
+        self.storage.failing_rooms.update({"!visible", "!hidden", "!unset"})
+        self.assertEqual(self.sync().joined_room_ids, frozenset({"!visible", "!unset"}))
+
+    def test_unknown_rooms_fail_closed(self):
+        self.storage.bulk_available = False
+        self.storage.failing_rooms.add("!visible")
+        self.assertNotIn("!visible", self.sync().joined_room_ids)
+
+
+class UpFrontExclusionTestCase(SynchronousTestCase):
+
+    sync = SyncFilterTestCase.sync
+    new_event = SyncFilterTestCase.new_event
+
+    def setUp(self):
+        self.module, self.api = standins.make_module({"sync_exclude_hidden_up_front": True})
+        self.hs = self.api._hs
+        self.storage = self.hs.state_storage
+        self.hs.sync_handler.rooms_for_user[USER] = ["!visible", "!hidden", "!unset"]
+        self.storage.set_visibility("!visible", True)
+        self.storage.set_visibility("!hidden", False)
+        self.api.run_delayed_calls()
+
+    def test_hidden_rooms_are_excluded_by_synapse(self):
+        result = self.sync()
+        self.assertEqual(result.joined_room_ids, frozenset({"!visible", "!unset"}))
+        self.assertIn("!hidden", result.excluded_room_ids)
+        self.assertEqual(self.hs.sync_handler.rooms_to_exclude_globally, [])
+
+    def test_configured_exclusions_are_kept(self):
+        self.hs.sync_handler.rooms_to_exclude_globally = ["!visible"]
+        result = self.sync()
+        self.assertEqual(result.joined_room_ids, frozenset({"!unset"}))
+        self.assertEqual(self.hs.sync_handler.rooms_to_exclude_globally, ["!visible"])
+
+    def test_hidden_room_joins_are_not_reported(self):
+        first = self.sync()
+        self.storage.set_visibility("!new-hidden", False)
+        self.new_event("!new-hidden", False)
+        self.hs.sync_handler.join(USER, "!new-hidden")
+        result = self.sync(since_token=first.now_token)
+        self.assertNotIn("!new-hidden", result.joined_room_ids)
+        self.assertEqual(result.membership_change_events, [])
+
+    def test_unhidden_room_is_forced_in(self):
+        first = self.sync()
+        self.new_event("!hidden", True)
+        result = self.sync(since_token=first.now_token)
+        self.assertIn("!hidden", result.joined_room_ids)
+        self.assertEqual(result.forced_newly_joined_room_ids, frozenset({"!hidden"}))
+
+    def test_stale_room_is_read_before_excluding(self):
+        self.storage.set_visibility("!unset", False)
+        self.api.receive_invalidation("alkemio_room_control.room_visibility", ["!unset"])
+        self.assertEqual(self.sync().joined_room_ids, frozenset({"!visible"}))
+
+
+class SlidingSyncFilterTestCase(SynchronousTestCase):
+
+    def setUp(self):
+        self.module, self.api = standins.make_module()
+        self.hs = self.api._hs
+        self.room_lists = self.hs.sliding_sync_handler.room_lists
+        # Most recent last: the hidden rooms would fill the top of the list.
+        self.hs.sync_handler.rooms_for_user[USER] = ["!old", "!visible", "!hidden1", "!hidden2"]
+        self.hs.state_storage.set_visibility("!hidden1", False)
+        self.hs.state_storage.set_visibility("!hidden2", False)
+
+    def compute(self, user_id=USER, window=2, subscriptions=(), newly_left=()):
+        self.room_lists.newly_left[user_id] = list(newly_left)
+        return self.successResultOf(defer.ensureDeferred(
+            self.room_lists.compute_interested_rooms(
+                user_id, window, subscriptions, from_token="s1" if newly_left else None
+            )
+        ))
+
+    def test_hidden_rooms_take_no_list_slots(self):
+        listed, _ = self.compute()
+        self.assertEqual(listed, ["!visible", "!old"])
+        self.assertEqual(self.room_lists.fetched_rooms, ["!visible", "!old"])
+
+    def test_hidden_rooms_cannot_be_subscribed(self):
+        _, subscribed = self.compute(subscriptions=["!hidden1", "!old"])
+        self.assertEqual(subscribed, ["!old"])
+        self.assertNotIn("!hidden1", self.room_lists.fetched_rooms)
+
+    def test_hidden_rooms_are_not_added_back_as_newly_left(self):
+        self.hs.state_storage.set_visibility("!left", False)
+        listed, _ = self.compute(window=10, newly_left=["!hidden2", "!left"])
+        self.assertEqual(listed, ["!visible", "!old"])
+
+    def test_hidden_rooms_are_not_added_back_by_the_fallback_path(self):
+        self.room_lists.use_fallback = True
+        self.hs.state_storage.set_visibility("!left", False)
+        listed, _ = self.compute(window=10, newly_left=["!hidden2", "!left"])
+        self.assertEqual(listed, ["!visible", "!old"])
+
+    def test_visible_newly_left_rooms_are_added_back(self):
+        listed, _ = self.compute(window=10, newly_left=["!left"])
+        self.assertEqual(listed, ["!left", "!visible", "!old"])
+
+    def test_prewarmed_index_needs_no_reads(self):
+        self.api.run_delayed_calls()
+        interactions = self.hs.state_storage.db_interactions
+        listed, _ = self.compute()
+        self.assertEqual(listed, ["!visible", "!old"])
+        self.assertEqual(self.hs.state_storage.db_interactions, interactions)
+
+    def test_bot_sees_every_room(self):
+        self.hs.sync_handler.rooms_for_user[standins.BOT_MXID] = ["!visible", "!hidden1"]
+        listed, _ = self.compute(user_id=standins.BOT_MXID)
+        self.assertEqual(listed, ["!hidden1", "!visible"])
+
+
+class VisibilityUpdateTestCase(SynchronousTestCase):
+
+    config = {"visibility_update_max_rooms": 3}
+    appservice = create_requester(
+        standins.BOT_MXID, app_service=SimpleNamespace(id=AlkemioRoomControl.APPSERVICE_ID)
+    )
+
+    setUp = SyncFilterTestCase.setUp
+    sync = SyncFilterTestCase.sync
+
+    def post(self, rooms, requester=appservice):
+        resource = self.api.web_resources[VISIBILITY_UPDATE_PATH]
+        return defer.ensureDeferred(
+            resource._async_render_POST(standins.StandInRequest({"rooms": rooms}, requester))
+        )
+
+    def test_only_differing_rooms_are_updated(self):
+        code, body = self.successResultOf(self.post([
+            {"room_id": "!visible", "visible": False},
+            {"room_id": "!hidden", "visible": False},
+            {"room_id": "!unset", "visible": True},
+        ]))
+        self.assertEqual(code, 200)
+        self.assertEqual(
+            [(r["room_id"], r["result"]) for r in body["results"]],
+            [("!visible", "updated"), ("!hidden", "unchanged"), ("!unset", "unchanged")],
+        )
+        self.assertEqual((body["updated"], body["unchanged"], body["failed"]), (1, 2, 0))
+        self.assertEqual([e["room_id"] for e in self.api.sent_events], ["!visible"])
+        self.assertEqual(self.api.sent_events[0]["sender"], standins.BOT_MXID)
+
+    def test_index_is_updated_in_the_same_step(self):
+        self.successResultOf(self.post([
+            {"room_id": "!visible", "visible": False},
+            {"room_id": "!hidden", "visible": False},
+            {"room_id": "!unset", "visible": True},
+        ]))
+        interactions = self.storage.db_interactions
+        self.assertEqual(self.sync().joined_room_ids, frozenset({"!unset"}))
+        self.assertEqual(self.storage.db_interactions, interactions)
+        self.assertIn("!visible", self.module._hidden_room_ids)
+
+    def test_failed_rooms_are_reported(self):
+        self.api.unsendable_rooms.add("!hidden")
+        _, body = self.successResultOf(self.post([
+            {"room_id": "!hidden", "visible": True},
+            {"room_id": "!visible", "visible": False},
+        ]))
+        self.assertEqual(body["results"][0]["result"], "error")
+        self.assertEqual(body["results"][0]["errcode"], "M_FORBIDDEN")
+        self.assertEqual(body["results"][1]["result"], "updated")
+        self.assertEqual(body["failed"], 1)
+        self.assertNotIn("!hidden", self.sync().joined_room_ids)
+
+    def test_only_appservice_and_admins_may_update(self):
+        rooms = [{"room_id": "!visible", "visible": False}]
+        self.assertEqual(self.failureResultOf(self.post(rooms, None), SynapseError).value.code, 401)
+        user = create_requester(USER)
+        self.assertEqual(self.failureResultOf(self.post(rooms, user), SynapseError).value.code, 403)
+        self.api.admins.add(USER)
+        self.assertEqual(self.successResultOf(self.post(rooms, user))[0], 200)
+
+    def test_malformed_batches_are_rejected(self):
+        for rooms, code in [
+            ("!visible", 400),
+            ([{"room_id": "!visible"}], 400),
+            ([{"room_id": "visible", "visible": True}], 400),
+            ([{"room_id": "!visible", "visible": True}] * 2, 400),
+            ([{"room_id": f"!room{i}", "visible": True} for i in range(4)], 413),
+        ]:
+            failure = self.failureResultOf(self.post(rooms), SynapseError)
+            self.assertEqual(failure.value.code, code, rooms)
+        self.assertEqual(self.storage.db_interactions, 0)
+
+
+class PendingRoomIndexTestCase(SynchronousTestCase):
+
+    appservice = VisibilityUpdateTestCase.appservice
+    marker = {"alkemio_room_id": ALKEMIO_ROOM_ID}
+
+    def setUp(self):
+        self.module, self.api = standins.make_module()
+        self.storage = self.api._hs.state_storage
+        self.storage.set_pending("!new", self.marker, 200)
+        self.storage.set_pending("!old", self.marker, 100)
+        self.storage.set_pending("!done", {}, 50)
+
+    def load(self):
+        self.api.run_delayed_calls()
+
+    def pending_event(self, room_id, content, ts=0):
+        self.storage.set_pending(room_id, content, ts)
+        event = standins.StandInEvent(room_id, ALKEMIO_PENDING_EVENT, content, origin_server_ts=ts)
+        self.successResultOf(defer.ensureDeferred(
+            self.api._hs.notifier.on_new_room_events(event)
+        ))
+
+    def list(self, **args):
+        resource = self.api.web_resources[PENDING_ROOMS_PATH]
+        return defer.ensureDeferred(resource._async_render_GET(
+            standins.StandInRequest(requester=self.appservice, args=args)
+        ))
+
+    def listed(self, **args):
+        code, body = self.successResultOf(self.list(**args))
+        self.assertEqual(code, 200)
+        return [room["room_id"] for room in body["rooms"]], body.get("next_batch")
+
+    def test_loaded_from_current_state_oldest_first(self):
+        self.load()
+        _, body = self.successResultOf(self.list())
+        self.assertEqual(body["rooms"], [
+            {"room_id": "!old", "alkemio_room_id": ALKEMIO_ROOM_ID, "created_ts": 100},
+            {"room_id": "!new", "alkemio_room_id": ALKEMIO_ROOM_ID, "created_ts": 200},
+        ])
+        self.assertEqual(body["total"], 2)
+        self.assertNotIn("next_batch", body)
+
+    def test_pages_follow_next_batch(self):
+        self.load()
+        self.assertEqual(self.listed(limit="1"), (["!old"], "100_!old"))
+        self.assertEqual(self.listed(limit="1", **{"from": "100_!old"}), (["!new"], "200_!new"))
+        self.assertEqual(self.listed(limit="1", **{"from": "200_!new"}), ([], None))
+
+    def test_marker_events_add_and_clear_rooms(self):
+        self.load()
+        self.pending_event("!created", self.marker, 300)
+        self.pending_event("!old", {})
+        self.assertEqual(self.listed()[0], ["!new", "!created"])
+
+    def test_replicated_invalidation_is_reread_before_listing(self):
+        self.load()
+        self.storage.set_pending("!new", {})
+        self.api.receive_invalidation("alkemio_room_control.pending_rooms", ["!new"])
+        interactions = self.storage.db_interactions
+        self.assertEqual(self.listed()[0], ["!old"])
+        self.assertEqual(self.storage.db_interactions, interactions + 1)
+        self.listed()
+        self.assertEqual(self.storage.db_interactions, interactions + 1)
+
+    def test_changes_during_load_are_kept(self):
+        self.pending_event("!old", {})
+        self.load()
+        self.assertEqual(self.listed()[0], ["!new"])
+
+    def test_listing_is_refused_while_loading(self):
+        self.assertEqual(self.failureResultOf(self.list(), SynapseError).value.code, 503)
+
+    def test_failed_load_is_retried_with_backoff(self):
+        self.storage.bulk_available = False
+        self.load()
+        self.assertEqual([msec for msec, _, _ in self.api.delayed_calls], [1000])
+        self.load()
+        self.assertEqual([msec for msec, _, _ in self.api.delayed_calls], [2000])
+        self.assertEqual(self.failureResultOf(self.list(), SynapseError).value.code, 503)
+
+        self.storage.bulk_available = True
+        self.load()
+        self.assertEqual(self.listed()[0], ["!old", "!new"])
+        self.assertEqual(self.api.delayed_calls, [])
+
+    def test_retry_is_dropped_after_a_reset(self):
+        self.storage.bulk_available = False
+        self.load()
+        self.storage.bulk_available = True
+        self.api.receive_invalidation("alkemio_room_control.pending_rooms", None)
+        self.assertEqual([msec for msec, _, _ in self.api.delayed_calls], [1000, 0])
+        interactions = self.storage.db_interactions
+        self.load()
+        self.assertEqual(self.storage.db_interactions, interactions + 1)
+        self.assertEqual(self.listed()[0], ["!old", "!new"])
+
+    def test_load_pages_by_its_own_batch_size(self):
+        self.module, self.api = standins.make_module({"pending_rooms_load_batch_size": 1})
+        self.storage = self.api._hs.state_storage
+        self.storage.set_pending("!old", self.marker, 100)
+        self.storage.set_pending("!new", self.marker, 200)
+        interactions = self.storage.db_interactions
+        self.load()
+        # Two full pages and an empty one, plus a single pre-warm page.
+        self.assertEqual(self.storage.db_interactions, interactions + 4)
+        self.assertEqual(self.listed()[0], ["!old", "!new"])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.load()
+        for args in ({"limit": "0"}, {"limit": "5000"}, {"from": "soon_!old"}):
+            self.assertEqual(self.failureResultOf(self.list(**args), SynapseError).value.code, 400)
+
+
+class RoomCheckTestCase(SynchronousTestCase):
+
+    def setUp(self):
+        self.module, self.api = standins.make_module({"room_check_denial_ttl_ms": 1000})
+        self.adapter = standins.StandInAdapterClient()
+        self.module._http_client = self.adapter
+        self.reactor = self.api._hs.reactor
+
+    def create_room(self, invite=("@bob:alkemio.matrix.host",)):
+        return defer.ensureDeferred(self.api.third_party_rules_callbacks["on_create_room"](
+            create_requester(USER), {"invite": list(invite), "is_direct": True}, False,
+        ))
+
+    def test_concurrent_identical_checks_share_one_call(self):
+        first, second = self.create_room(), self.create_room()
+        self.assertEqual(len(self.adapter.calls), 1)
+        self.adapter.respond({"allow": False, "reason": "No consent"})
+        for d in (first, second):
+            self.assertEqual(self.failureResultOf(d, SynapseError).value.code, 403)
+        self.assertEqual(self.module.room_check_stats()["coalesced"], 1)
+
+    def test_denial_is_cached_until_ttl_expires(self):
+        d = self.create_room()
+        self.adapter.respond({"allow": False})
+        self.failureResultOf(d, SynapseError)
+
+        self.failureResultOf(self.create_room(), SynapseError)
+        self.assertEqual(len(self.adapter.calls), 1)
+        self.assertEqual(self.module.room_check_stats()["cached_denials"], 1)
+
+        self.reactor.advance(1)
+        self.create_room()
+        self.assertEqual(len(self.adapter.calls), 2)
+
+    def test_different_members_are_not_coalesced(self):
+        self.create_room()
+        self.create_room(invite=("@carol:alkemio.matrix.host",))
+        self.assertEqual(len(self.adapter.calls), 2)
+
+    def test_approval_is_not_shared(self):
+        first, second = self.create_room(), self.create_room()
+        self.adapter.respond({"allow": True, "alkemio_room_id": ALKEMIO_ROOM_ID})
+        self.assertIsNone(self.successResultOf(first))
+        self.assertNoResult(second)
+        self.assertEqual(len(self.adapter.calls), 2)
+        self.adapter.respond({"allow": False, "reason": "Duplicate"})
+        self.failureResultOf(second, SynapseError)
+
+    def test_malformed_invite_is_rejected(self):
+        for invite in ([{"x": 1}], [["@bob:alkemio.matrix.host"]], "@bob:alkemio.matrix.host"):
+            d = defer.ensureDeferred(self.api.third_party_rules_callbacks["on_create_room"](
+                create_requester(USER), {"invite": invite}, False,
+            ))
+            error = self.failureResultOf(d, SynapseError).value
+            self.assertEqual((error.code, error.errcode), (400, "M_BAD_JSON"))
+        self.assertEqual(self.adapter.calls, [])
+
+    def test_adapter_error_is_shared_and_not_cached(self):
+        first, second = self.create_room(), self.create_room()
+        self.adapter.fail(RuntimeError("adapter down"))
+        for d in (first, second):
+            self.assertEqual(self.failureResultOf(d, SynapseError).value.code, 503)
+        self.create_room()
+        self.assertEqual(len(self.adapter.calls), 2)
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTestCase(SynchronousTestCase):
+
+    config = SyncFilterTestCase.config
+    setUp = SyncFilterTestCase.setUp
+    sync = SyncFilterTestCase.sync
+
+    def test_sync_filter_metrics(self):
+        hidden = _sample("synapse_alkemio_sync_filter_hidden_rooms_total", mode="post_filter")
+        syncs = _sample("synapse_alkemio_sync_filter_duration_seconds_count", mode="post_filter")
+        checked = _sample("synapse_alkemio_sync_filter_rooms_checked_sum", mode="post_filter")
+        self.sync()
+        self.assertEqual(
+            _sample("synapse_alkemio_sync_filter_hidden_rooms_total", mode="post_filter"), hidden + 1
+        )
+        self.assertEqual(
+            _sample("synapse_alkemio_sync_filter_duration_seconds_count", mode="post_filter"), syncs + 1
+        )
+        self.assertEqual(
+            _sample("synapse_alkemio_sync_filter_rooms_checked_sum", mode="post_filter"), checked + 3
+        )
+
+    def test_fail_closed_lookups_are_counted(self):
+        errors = _sample("synapse_alkemio_visibility_lookup_errors_total")
+        self.storage.bulk_available = False
+        self.storage.failing_rooms.add("!unset")
+        self.sync()
+        self.assertEqual(_sample("synapse_alkemio_visibility_lookup_errors_total"), errors + 1)
+
+    def test_room_check_outcomes(self):
+        adapter = standins.StandInAdapterClient()
+        self.module._http_client = adapter
+        outcomes = ("allow", "deny", "invalid_id", "error")
+        before = {o: _sample("synapse_alkemio_room_check_outcomes_total", outcome=o) for o in outcomes}
+        for invitee, respond in [
+            ("@a:x", lambda: adapter.respond({"allow": True, "alkemio_room_id": ALKEMIO_ROOM_ID})),
+            ("@b:x", lambda: adapter.respond({"allow": False})),
+            ("@c:x", lambda: adapter.respond({"allow": True, "alkemio_room_id": "nope"})),
+            ("@d:x", lambda: adapter.fail(RuntimeError("down"))),
+        ]:
+            d = defer.ensureDeferred(self.api.third_party_rules_callbacks["on_create_room"](
+                create_requester(USER), {"invite": [invitee]}, False,
+            ))
+            respond()
+            self.assertTrue(d.called)
+            d.addErrback(lambda f: None)
+        for outcome in outcomes:
+            self.assertEqual(
+                _sample("synapse_alkemio_room_check_outcomes_total", outcome=outcome),
+                before[outcome] + 1,
+            )
+
+
+class AdmissionControlTestCase(SynchronousTestCase):
+
+    def setUp(self):
+        self.module, self.api = standins.make_module({
+            "room_check_max_concurrent": 1,
+            "room_check_max_queue": 1,
+            "room_check_queue_timeout_ms": 1000,
+        })
+        self.adapter = standins.StandInAdapterClient()
+        self.module._http_client = self.adapter
+        self.reactor = self.api._hs.reactor
+
+    def create_room(self, invitee):
+        return defer.ensureDeferred(self.api.third_party_rules_callbacks["on_create_room"](
+            create_requester(USER), {"invite": [invitee]}, False,
+        ))
+
+    def queue_depth(self):
+        return REGISTRY.get_sample_value("synapse_alkemio_room_check_queue_depth")
+
+    def test_full_queue_is_refused_with_429(self):
+        depth = self.queue_depth()
+        running = self.create_room("@a:alkemio.matrix.host")
+        queued = self.create_room("@b:alkemio.matrix.host")
+        self.assertEqual(self.queue_depth(), depth + 1)
+        error = self.failureResultOf(self.create_room("@c:alkemio.matrix.host"), SynapseError).value
+        self.assertEqual(error.code, 429)
+        self.assertEqual(error.retry_after_ms, 1000)
+        self.assertEqual(len(self.adapter.calls), 1)
+
+        # Finishing the running check hands its slot to the queued one.
+        self.adapter.respond({"allow": False})
+        self.failureResultOf(running, SynapseError)
+        self.assertEqual(len(self.adapter.calls), 2)
+        self.assertEqual(self.queue_depth(), depth)
+        self.adapter.respond({"allow": False})
+        self.assertEqual(self.failureResultOf(queued, SynapseError).value.code, 403)
+
+    def test_queued_check_times_out_with_503(self):
+        self.create_room("@a:alkemio.matrix.host")
+        queued = self.create_room("@b:alkemio.matrix.host")
+        self.reactor.advance(1)
+        error = self.failureResultOf(queued, SynapseError).value
+        self.assertEqual(error.code, 503)
+        self.assertEqual(error.retry_after_ms, 1000)
+        self.assertEqual(len(self.adapter.calls), 1)
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        gate = self.module._room_check_gate
+        self.successResultOf(defer.ensureDeferred(gate.acquire()))
+        waiting = defer.ensureDeferred(gate.acquire())
+        waiting.cancel()
+        self.failureResultOf(waiting, defer.CancelledError)
+        self.assertEqual(gate.queue_depth, 0)
+        gate.release()
+        self.assertEqual(gate.in_flight, 0)
+
+
+class AdapterClientTestCase(TestCase):
+    """check-room over real HTTP against a local stand-in adapter."""
+
+    def setUp(self):
+        self.module, self.api = standins.make_module(
+            {
+                "room_check_denial_ttl_ms": 0,
+                "adapter_timeout_ms": 200,
+                "adapter_breaker_failure_threshold": 2,
+                "adapter_breaker_reset_ms": 300,
+            },
+            api=standins.StandInModuleApi(standins.StandInHomeServer(reactor=reactor)),
+        )
+        self.adapter = standins.StandInAdapter(reactor)
+        self.module.adapter_url = self.adapter.listen()
+        self.addCleanup(self.adapter.stop)
+        self.addCleanup(lambda: self.module.http_client.pool.closeCachedConnections())
+
+    async def create_room(self):
+        try:
+            await self.api.third_party_rules_callbacks["on_create_room"](
+                create_requester(USER), {"invite": ["@bob:alkemio.matrix.host"]}, False,
+            )
+        except SynapseError as e:
+            return e.code
+        return 200
+
+    async def test_connections_are_kept_alive(self):
+        for _ in range(3):
+            self.assertEqual(await self.create_room(), 403)
+        self.assertEqual(len(self.adapter.requests), 3)
+        self.assertEqual(self.adapter.connections, 1)
+
+    async def test_slow_adapter_times_out(self):
+        self.adapter.delay = 5
+        started = reactor.seconds()
+        self.assertEqual(await self.create_room(), 503)
+        self.assertLess(reactor.seconds() - started, 2)
+
+    async def test_breaker_fails_fast_while_adapter_is_down(self):
+        await self.adapter.stop()
+        self.assertEqual(await self.create_room(), 503)
+        self.assertEqual(await self.create_room(), 503)
+        self.assertEqual(self.module._adapter_breaker.state, "open")
+
+        self.adapter.listen()
+        self.assertEqual(await self.create_room(), 503)
+        self.assertEqual(self.adapter.requests, [])
+        self.assertEqual(self.module.room_check_stats()["breaker_rejected"], 1)
+
+        # After the reset period a trial call goes through and closes the breaker.
+        await self.api._hs.clock.sleep(0.3)
+        self.assertEqual(await self.create_room(), 403)
+        self.assertEqual(self.module._adapter_breaker.state, "closed")
+
+
+class BatchedRoomCheckTestCase(TestCase):
+    """Micro-batched check-room against a local stand-in adapter."""
+
+    def make_module(self, **config):
+        module, api = standins.make_module(
+            {"room_check_denial_ttl_ms": 0, **config},
+            api=standins.StandInModuleApi(standins.StandInHomeServer(reactor=reactor)),
+        )
+        module.adapter_url = self.adapter_url
+        self.addCleanup(lambda: module.http_client.pool.closeCachedConnections())
+        return module, api
+
+    def setUp(self):
+        self.adapter = standins.StandInAdapter(reactor)
+        self.adapter_url = self.adapter.listen()
+        self.addCleanup(self.adapter.stop)
+
+    async def burst(self, api, creators):
+        async def create_room(creator):
+            try:
+                await api.third_party_rules_callbacks["on_create_room"](
+                    create_requester(creator), {"invite": ["@bob:alkemio.matrix.host"]}, False,
+                )
+            except SynapseError as e:
+                return e.code
+            return 200
+
+        return await defer.gatherResults(
+            [defer.ensureDeferred(create_room(creator)) for creator in creators]
+        )
+
+    async def test_burst_needs_one_round_trip(self):
+        creators = [f"@user{i}:alkemio.matrix.host" for i in range(10)]
+        _, api = self.make_module()
+        self.assertEqual(await self.burst(api, creators), [403] * 10)
+        self.assertEqual(self.adapter.posts, 10)
+
+        self.adapter.posts = 0
+        module, api = self.make_module(room_check_batch_window_ms=50)
+        self.assertEqual(await self.burst(api, creators), [403] * 10)
+        self.assertEqual(self.adapter.posts, 1)
+        self.assertEqual(module.room_check_stats()["adapter_batches"], 1)
+
+    async def test_full_batch_is_sent_without_waiting(self):
+        _, api = self.make_module(room_check_batch_window_ms=10_000, room_check_batch_max_size=3)
+        creators = [f"@user{i}:alkemio.matrix.host" for i in range(3)]
+        started = reactor.seconds()
+        self.assertEqual(await self.burst(api, creators), [403] * 3)
+        self.assertLess(reactor.seconds() - started, 2)
+        self.assertEqual(self.adapter.posts, 1)
+
+    async def test_item_errors_fail_only_their_caller(self):
+        _, api = self.make_module(room_check_batch_window_ms=50)
+        self.adapter.response = {"allow": True, "alkemio_room_id": ALKEMIO_ROOM_ID}
+        self.adapter.failing_creators.add("@user1:alkemio.matrix.host")
+        creators = [f"@user{i}:alkemio.matrix.host" for i in range(3)]
+        self.assertEqual(await self.burst(api, creators), [200, 503, 200])
+
+    async def test_adapter_outage_fails_the_whole_batch(self):
+        _, api = self.make_module(room_check_batch_window_ms=50)
+        await self.adapter.stop()
+        creators = [f"@user{i}:alkemio.matrix.host" for i in range(3)]
+        self.assertEqual(await self.burst(api, creators), [503] * 3)
+
+
+def _run(coroutine):
+    """Drive a coroutine whose stand-in dependencies all resolve immediately."""
+    results = []
+    defer.ensureDeferred(coroutine).addBoth(results.append)
+    assert results, "coroutine did not complete synchronously"
+    if isinstance(results[0], Failure):
+        results[0].raiseException()
+    return results[0]
+
+
+def _run_worker(instance_name, inbox, outbox):
+    """One Synapse worker process: a module instance driven by inbox commands."""
+    api = standins.StandInModuleApi(
+        standins.StandInHomeServer(instance_name),
+        replication=lambda name, keys: outbox.put(("replicate", instance_name, name, keys)),
+    )
+    module, api = standins.make_module(api=api)
+    api._hs.sync_handler.rooms_for_user[USER] = ["!room"]
+    while True:
+        command, *args = inbox.get()
+        if command == "stop":
+            return
+        if command == "write_state":
+            # Stands in for the shared database every worker reads.
+            api._hs.state_storage.set_visibility(*args)
+        elif command == "persist":
+            room_id, visible = args
+            event = standins.StandInEvent(
+                room_id, ALKEMIO_VISIBILITY_EVENT, {"visible": visible},
+                instance_name=instance_name,
+            )
+            _run(api._hs.notifier.on_new_room_events(event))
+        elif command == "replicate":
+            api.receive_invalidation(*args)
+        elif command == "sync":
+            builder = _run(api._hs.sync_handler.get_sync_result_builder(
+                standins.sync_config_for(USER)
+            ))
+            outbox.put(("synced", instance_name, sorted(builder.joined_room_ids)))
+
+
+class CrossWorkerInvalidationTestCase(SynchronousTestCase):
+    """A visibility flip persisted on one worker reaches every worker's cache."""
+
+    WORKERS = ["event_persister", "sync1", "sync2"]
+
+    def setUp(self):
+        try:
+            self.ctx = multiprocessing.get_context("fork")
+        except ValueError:
+            raise SkipTest("needs fork-based multiprocessing")
+        self.outbox = self.ctx.Queue()
+        self.inboxes = {name: self.ctx.Queue() for name in self.WORKERS}
+        self.processes = [
+            self.ctx.Process(target=_run_worker, args=(name, inbox, self.outbox), daemon=True)
+            for name, inbox in self.inboxes.items()
+        ]
+        for process in self.processes:
+            process.start()
+
+    def tearDown(self):
+        for inbox in self.inboxes.values():
+            inbox.put(("stop",))
+        for process in self.processes:
+            process.join(timeout=10)
+
+    def sync(self, *workers):
+        for name in workers:
+            self.inboxes[name].put(("sync",))
+        results = {}
+        for _ in workers:
+            kind, name, joined = self.outbox.get(timeout=10)
+            self.assertEqual(kind, "synced")
+            results[name] = joined
+        return results
+
+    def test_visibility_flip_reaches_every_worker(self):
+        self.assertEqual(self.sync(*self.WORKERS), {name: ["!room"] for name in self.WORKERS})
+
+        for inbox in self.inboxes.values():
+            inbox.put(("write_state", "!room", False))
+        self.inboxes["event_persister"].put(("persist", "!room", False))
+        kind, origin, cache_name, keys = self.outbox.get(timeout=10)
+        self.assertEqual((kind, origin), ("replicate", "event_persister"))
+
+        # Before the invalidation arrives the sync workers still serve their cache.
+        self.assertEqual(self.sync("sync1"), {"sync1": ["!room"]})
+
+        # The stand-in replication channel fans the row out to the other workers.
+        for name in ("sync1", "sync2"):
+            self.inboxes[name].put(("replicate", cache_name, keys))
+        self.assertEqual(self.sync(*self.WORKERS), {name: [] for name in self.WORKERS})
+
+
+class ParseConfigTestCase(SynchronousTestCase):
+
+    def test_defaults(self):
+        config = standins.alkemio_room_control.AlkemioRoomControl.parse_config({})
+        self.assertEqual(config.visibility_cache_size, 100_000)
+
+    def test_rejects_unknown_keys(self):
+        with self.assertRaises(ConfigError):
+            standins.alkemio_room_control.AlkemioRoomControl.parse_config({"nope": 1})
+
+    def test_rejects_non_bool_prewarm(self):
+        with self.assertRaises(ConfigError):
+            standins.alkemio_room_control.AlkemioRoomControl.parse_config({"visibility_prewarm": 1})
+
+    def test_rejects_negative_lookup_timeout(self):
+        with self.assertRaises(ConfigError):
+            standins.alkemio_room_control.AlkemioRoomControl.parse_config(
+                {"visibility_lookup_timeout_ms": -1}
+            )
+
+    def test_rejects_zero_update_batch(self):
+        with self.assertRaises(ConfigError):
+            standins.alkemio_room_control.AlkemioRoomControl.parse_config(
+                {"visibility_update_max_rooms": 0}
+            )
+
+    def test_rejects_zero_batch_size(self):
+        with self.assertRaises(ConfigError):
+            standins.alkemio_room_control.AlkemioRoomControl.parse_config(
+                {"room_check_batch_max_size": 0}
+            )
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark and scale check for review_metrics.
+
+Scores synthetic PRs for every combination of changed path count,
+description size and critical pattern count, in two modes:
+
+- compute: compute_metrics in process, with the matchers already built
+- cli: review_metrics.py --batch in a fresh interpreter, scoring one PR,
+  so interpreter start, matcher compilation and JSON I/O are included
+
+Latency is wall-clock time per PR (p50/max, milliseconds) and throughput is
+changed paths and input bytes per second at p50. Peak memory is the
+tracemalloc peak of one scoring for compute, and the child's max RSS for
+cli.
+
+With --baseline (an earlier report), each case's p50 and peak memory are
+compared to the baseline's. The run fails (exit status 1) when one grows
+by more than --budget, a fraction (0.5 allows 50% slower).
+
+Usage:
+    python bench_review_metrics.py [--paths 10,1000,100000]
+        [--description-kb 1,1024] [--patterns 10,1000] [--modes compute,cli]
+        [--iterations 5] [--seed 1] [--baseline previous.json]
+        [--budget 0.5] [--output results.json]
+
+Results are written as one JSON document (stdout by default).
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+SCRIPT = Path(__file__).resolve().parent / "review_metrics.py"
+if str(SCRIPT.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT.parent))
+
+import review_metrics  # noqa: E402
+
+MODES = ("compute", "cli")
+WORDS = (
+    "update", "handler", "the", "request", "fixes", "cache", "when", "token",
+    "expires", "and", "adds", "tests", "for", "error", "at", "line", "trace",
+    "author", "logs", "deployment", "typo", "docs",
+)
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def make_patterns(count: int, rng: random.Random) -> List[str]:
+    """The configured critical paths, padded with synthetic ones of the same shapes."""
+    patterns = list(dict.fromkeys(review_metrics.CONFIG["CRITICAL_PATHS"]))[:count]
+    shapes = (
+        "src/area_{}/*",
+        "src/services/adapter_{}/*",
+        "**/*.policy{}.ts",
+        "config/env_{}.yml",
+        "scripts/tool_{}/*",
+    )
+    while len(patterns) < count:
+        shape = shapes[len(patterns) % len(shapes)]
+        patterns.append(shape.format(rng.randrange(count * 10)))
+    return patterns
+
+
+def make_paths(count: int, rng: random.Random) -> List[str]:
+    """Changed paths spread over a realistic tree, a few of them critical."""
+    paths = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.01:
+            paths.append("src/core/module_{}.ts".format(i))
+        elif roll < 0.1:
+            paths.append("docs/section_{}/page_{}.md".format(i % 17, i))
+        else:
+            paths.append("src/domain/area_{}/feature_{}/file_{}.ts".format(i % 53, i % 211, i))
+    return paths
+
+
+def make_description(size: int, rng: random.Random) -> str:
+    """About size bytes of prose and pasted log lines."""
+    parts: List[str] = []
+    length = 0
+    while length < size:
+        line = " ".join(rng.choice(WORDS) for _ in range(12))
+        parts.append(line)
+        length += len(line) + 1
+    return "\n".join(parts)[:size]
+
+
+def make_case(paths: int, description_kb: int, patterns: int, seed: int) -> Dict[str, object]:
+    rng = random.Random("{}-{}-{}-{}".format(seed, paths, description_kb, patterns))
+    file_paths = make_paths(paths, rng)
+    return {
+        "record": {
+            "title": "feat: synthetic change touching {} files".format(paths),
+            "description": make_description(description_kb * 1024, rng),
+            "loc_changed": paths * 7,
+            "files_changed": paths,
+            "file_paths": file_paths,
+        },
+        "config": {"CRITICAL_PATHS": make_patterns(patterns, rng)},
+    }
+
+
+def _measure_compute(case: Dict[str, object], iterations: int) -> Tuple[List[float], int]:
+    record = case["record"]
+    saved = dict(review_metrics.CONFIG)
+    review_metrics.apply_config_overrides(case["config"])
+    try:
+        def score():
+            review_metrics.compute_metrics(
+                record["title"], record["description"], record["loc_changed"],
+                record["files_changed"], record["file_paths"],
+            )
+
+        score()  # build and cache the matchers
+
+        latencies = []
+        gc.disable()
+        try:
+            for _ in range(iterations):
+                started = time.perf_counter()
+                score()
+                latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            gc.enable()
+
+        tracemalloc.start()
+        try:
+            score()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        review_metrics.CONFIG.clear()
+        review_metrics.CONFIG.update(saved)
+    return latencies, peak
+
+
+def _measure_cli(case: Dict[str, object], iterations: int) -> Tuple[List[float], int]:
+    command = [
+        sys.executable, str(SCRIPT), "--batch",
+        "--config", json.dumps(case["config"]),
+        "--summary", os.devnull,
+    ]
+    latencies = []
+    peak = 0
+    with tempfile.TemporaryFile() as stdin:
+        stdin.write(json.dumps(case["record"]).encode() + b"\n")
+        for _ in range(iterations):
+            stdin.seek(0)
+            started = time.perf_counter()
+            process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.DEVNULL)
+            # wait4 rather than wait, for the child's own resource usage
+            _, status, usage = os.wait4(process.pid, 0)
+            latencies.append((time.perf_counter() - started) * 1000)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            if process.returncode:
+                raise RuntimeError("review_metrics.py exited with status {}".format(process.returncode))
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            peak = max(peak, usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024))
+    return latencies, peak
+
+
+MEASURES: Dict[str, Callable[[Dict[str, object], int], Tuple[List[float], int]]] = {
+    "compute": _measure_compute,
+    "cli": _measure_cli,
+}
+
+
+def case_name(mode: str, paths: int, description_kb: int, patterns: int) -> str:
+    return "{}/paths={}/description_kb={}/patterns={}".format(mode, paths, description_kb, patterns)
+
+
+def run(
+    paths: List[int],
+    description_kbs: List[int],
+    patterns: List[int],
+    modes: List[str],
+    iterations: int,
+    seed: int,
+) -> dict:
+    results = []
+    for path_count in paths:
+        for description_kb in description_kbs:
+            for pattern_count in patterns:
+                case = make_case(path_count, description_kb, pattern_count, seed)
+                input_bytes = len(json.dumps(case["record"]))
+                for mode in modes:
+                    latencies, peak = MEASURES[mode](case, iterations)
+                    p50 = _percentile(latencies, 50)
+                    result = {
+                        "case": case_name(mode, path_count, description_kb, pattern_count),
+                        "mode": mode,
+                        "paths": path_count,
+                        "description_kb": description_kb,
+                        "patterns": pattern_count,
+                        "p50_ms": round(p50, 3),
+                        "max_ms": round(max(latencies), 3),
+                        "mean_ms": round(statistics.fmean(latencies), 3),
+                        "paths_per_s": round(path_count / p50 * 1000, 1),
+                        "input_mb_per_s": round(input_bytes / 2 ** 20 / p50 * 1000, 3),
+                        "peak_memory_bytes": peak,
+                    }
+                    results.append(result)
+                    print(
+                        "{:>8} paths={:<6} description={:<5}KB patterns={:<5} "
+                        "p50={:.2f}ms peak={:.1f}MB".format(
+                            mode, path_count, description_kb, pattern_count,
+                            result["p50_ms"], peak / 2 ** 20,
+                        ),
+                        file=sys.stderr,
+                    )
+    return {
+        "benchmark": "review_metrics",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def find_regressions(report: dict, baseline: dict, budget: float) -> List[Dict[str, object]]:
+    """Cases whose p50 or peak memory grew by more than budget over the baseline.
+
+    Cases missing from either report are not compared.
+    """
+    previous = {result["case"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get(result["case"])
+        if before is None:
+            continue
+        for metric in ("p50_ms", "peak_memory_bytes"):
+            limit = before[metric] * (1 + budget)
+            if before[metric] and result[metric] > limit:
+                regressions.append({
+                    "case": result["case"],
+                    "metric": metric,
+                    "baseline": before[metric],
+                    "current": result[metric],
+                    "limit": round(limit, 3),
+                })
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--paths", type=_csv(int), default=[10, 1000, 100000])
+    parser.add_argument("--description-kb", type=_csv(int), default=[1, 1024])
+    parser.add_argument("--patterns", type=_csv(int), default=[10, 1000])
+    parser.add_argument("--modes", type=_csv(str), default=list(MODES))
+    parser.add_argument("--iterations", type=int, default=5, help="scorings per case")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="allowed growth over the baseline, as a fraction")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error("unknown modes: {}".format(", ".join(sorted(unknown))))
+    if args.iterations <= 0:
+        parser.error("--iterations must be positive")
+    if args.budget < 0:
+        parser.error("--budget must not be negative")
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+
+    report = run(args.paths, args.description_kb, args.patterns, args.modes, args.iterations, args.seed)
+    status = 0
+    if baseline is not None:
+        regressions = find_regressions(report, baseline, args.budget)
+        report["budget"] = args.budget
+        report["regressions"] = regressions
+        for regression in regressions:
+            print(
+                "REGRESSION {case} {metric}: {current} > {limit} (baseline {baseline})".format(**regression),
+                file=sys.stderr,
+            )
+        status = 1 if regressions else 0
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(document + "\n")
+    else:
+        print(document)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 import sys
 import json
+import argparse
 import fnmatch
+import functools
+import multiprocessing
 import os
-from typing import List, Dict
+import re
+import subprocess
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
 # --- Configuration (thresholds retained for context) ---
 CONFIG = {
@@ -54,9 +59,175 @@ CONFIG = {
     # Low Risk Keywords (Prefixes/words that suggest a simple change)
     "LOW_RISK_KEYWORDS": [
         "typo", "docs", "refactor(style)", "whitespace", "comment", "lint"
-    ]
+    ],
+    # Only match keywords as whole words ("auth" then no longer matches "author")
+    "KEYWORD_WORD_BOUNDARY": False,
 }
 
+# Positions reported per matched keyword; pasted logs can repeat one thousands of times
+MAX_KEYWORD_POSITIONS = 10
+
+def _trie_regex(entries: Iterable[Tuple[str, str]]) -> str:
+    """Regex alternation of literal+tail entries, factored by common prefix.
+
+    An entry with an empty tail matches as soon as its literal does, so a
+    prefix shared with longer entries short-circuits them.
+    """
+    trie: Dict[str, dict] = {}
+    for literal, tail in entries:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node.setdefault("", set()).add(tail)
+
+    def node_regex(node: Dict[str, dict]) -> str:
+        tails = node.get("", set())
+        if "" in tails:
+            return ""
+        branches = [re.escape(char) + node_regex(child) for char, child in node.items() if char]
+        branches.extend(sorted(tails))
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return node_regex(trie)
+
+
+class CriticalPathMatcher:
+    """Critical path patterns compiled once into two regexes.
+
+    A path is critical when it matches a pattern as a glob (fnmatch) or
+    contains it as a substring, exactly as the per-pattern check did. All
+    patterns go into one substring regex built from a prefix trie; globs
+    go into one anchored regex, where plain names and `prefix*` patterns
+    share a trie and other globs are alternatives. Matching costs two regex
+    scans per path whatever the number of patterns; only critical paths are
+    then checked pattern by pattern to report what matched.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = list(dict.fromkeys(patterns))
+        self._substring_re: Optional[re.Pattern] = None
+        if self.patterns:
+            self._substring_re = re.compile(_trie_regex((p, "") for p in self.patterns))
+
+        trie_entries: List[Tuple[str, str]] = []
+        other_globs: List[str] = []
+        for pattern in self.patterns:
+            # fnmatch normalises the case of both sides (a no-op on POSIX).
+            normalized = os.path.normcase(pattern)
+            stem = normalized[:-1] if normalized.endswith("*") else normalized
+            if any(meta in stem for meta in "*?["):
+                other_globs.append(fnmatch.translate(normalized))
+            else:
+                trie_entries.append((stem, "" if stem != normalized else r"\Z"))
+        alternatives = other_globs
+        if trie_entries:
+            alternatives = [_trie_regex(trie_entries), *other_globs]
+        self._glob_re: Optional[re.Pattern] = None
+        if alternatives:
+            self._glob_re = re.compile(r"\A(?:" + "|".join(alternatives) + ")")
+
+        self._pattern_globs = {
+            pattern: re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+            for pattern in self.patterns
+        }
+
+    def matches(self, path: str) -> bool:
+        if self._substring_re is None:
+            return False
+        if self._substring_re.search(path):
+            return True
+        return self._glob_re is not None and self._glob_re.match(os.path.normcase(path)) is not None
+
+    def matching_patterns(self, path: str) -> List[str]:
+        """Every pattern the path matches, in configuration order."""
+        if not self.matches(path):
+            return []
+        name = os.path.normcase(path)
+        return [p for p in self.patterns if p in path or self._pattern_globs[p](name)]
+
+    def match_paths(self, paths: Iterable[str]) -> Dict[str, List[str]]:
+        """Map each matched pattern to the paths it matched, both in input order."""
+        matched: Dict[str, List[str]] = {}
+        for path in paths:
+            for pattern in self.matching_patterns(path):
+                matched.setdefault(pattern, []).append(path)
+        return {p: matched[p] for p in self.patterns if p in matched}
+
+
+@functools.lru_cache(maxsize=8)
+def get_critical_path_matcher(patterns: Tuple[str, ...]) -> CriticalPathMatcher:
+    """The compiled matcher for a pattern list, built once per process."""
+    return CriticalPathMatcher(patterns)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class KeywordMatcher:
+    """Every occurrence of a set of keywords, found in one scan of the text.
+
+    The keywords are factored into a prefix trie and compiled once into a
+    single regex, so the regex engine skips ahead to every position where
+    some keyword starts, however many keywords there are. Searching again
+    from the next character keeps overlapping keywords ("oauth", "auth").
+    Only those positions are then checked keyword by keyword. With
+    word_boundary, a keyword must not be preceded or followed by a word
+    character at an end where it has one itself. Matching is
+    case-sensitive; callers pass lowercased text.
+    """
+
+    def __init__(self, keywords: Iterable[str], word_boundary: bool = False):
+        self.keywords: List[str] = [k for k in dict.fromkeys(k.lower() for k in keywords) if k]
+        self.word_boundary = word_boundary
+        self._by_first_char: Dict[str, List[str]] = {}
+        for keyword in self.keywords:
+            self._by_first_char.setdefault(keyword[0], []).append(keyword)
+        self._start_re: Optional[re.Pattern] = None
+        if self.keywords:
+            self._start_re = re.compile(_trie_regex((k, "") for k in self.keywords))
+
+    def _at_boundary(self, text: str, keyword: str, start: int) -> bool:
+        end = start + len(keyword)
+        if start > 0 and _is_word_char(keyword[0]) and _is_word_char(text[start - 1]):
+            return False
+        if end < len(text) and _is_word_char(keyword[-1]) and _is_word_char(text[end]):
+            return False
+        return True
+
+    def find(self, text: str, limit: Optional[int] = None) -> Dict[str, List[int]]:
+        """Map each keyword found to its start offsets, in configuration order.
+
+        limit caps the offsets kept per keyword; the scan still covers the
+        whole text so that every keyword is found.
+        """
+        found: Dict[str, List[int]] = {}
+        if self._start_re is None:
+            return found
+        search = self._start_re.search
+        match = search(text)
+        while match is not None:
+            start = match.start()
+            match = search(text, start + 1)
+            for keyword in self._by_first_char[text[start]]:
+                if not text.startswith(keyword, start):
+                    continue
+                if self.word_boundary and not self._at_boundary(text, keyword, start):
+                    continue
+                positions = found.setdefault(keyword, [])
+                if limit is None or len(positions) < limit:
+                    positions.append(start)
+        return {k: found[k] for k in self.keywords if k in found}
+
+
+@functools.lru_cache(maxsize=8)
+def get_keyword_matcher(keywords: Tuple[str, ...], word_boundary: bool = False) -> KeywordMatcher:
+    """The compiled matcher for a keyword list, built once per process."""
+    return KeywordMatcher(keywords, word_boundary)
+
+
 def compute_metrics(title: str, description: str, loc_changed: int, files_changed: int, file_paths: List[str]) -> Dict[str, object]:
     """Compute metrics and risk-related flags for a PR and derive a review type.
 
@@ -70,15 +241,23 @@ def compute_metrics(title: str, description: str, loc_changed: int, files_change
         combined_text_parts.append(description)
     combined_text = " ".join(combined_text_parts).lower()
 
-    high_risk_keyword = any(k in combined_text for k in CONFIG["HIGH_RISK_KEYWORDS"])
+    # Keyword positions are offsets into combined_text
+    word_boundary = bool(CONFIG["KEYWORD_WORD_BOUNDARY"])
+    high_risk_matches = get_keyword_matcher(
+        tuple(CONFIG["HIGH_RISK_KEYWORDS"]), word_boundary
+    ).find(combined_text, MAX_KEYWORD_POSITIONS)
+    high_risk_keyword = bool(high_risk_matches)
 
-    # Use fnmatch for glob pattern matching on critical paths
-    critical_path_change = any(
-        any(fnmatch.fnmatch(f, pattern) or pattern in f for pattern in CONFIG["CRITICAL_PATHS"])
-        for f in file_paths
-    )
+    # Glob (fnmatch) or substring match against the critical paths
+    critical_path_matches = get_critical_path_matcher(
+        tuple(CONFIG["CRITICAL_PATHS"])
+    ).match_paths(file_paths)
+    critical_path_change = bool(critical_path_matches)
 
-    low_risk_keyword = any(k in combined_text for k in CONFIG["LOW_RISK_KEYWORDS"])
+    low_risk_matches = get_keyword_matcher(
+        tuple(CONFIG["LOW_RISK_KEYWORDS"]), word_boundary
+    ).find(combined_text, MAX_KEYWORD_POSITIONS)
+    low_risk_keyword = bool(low_risk_matches)
 
     has_small_footprint = (
         loc_changed <= CONFIG["SIMPLE_LOC_THRESHOLD"] and
@@ -145,7 +324,12 @@ def compute_metrics(title: str, description: str, loc_changed: int, files_change
         "file_paths": file_paths,
         "high_risk_keyword": high_risk_keyword,
         "critical_path_change": critical_path_change,
+        "critical_path_matches": critical_path_matches,
         "low_risk_keyword": low_risk_keyword,
+        "keyword_matches": {
+            "high_risk": high_risk_matches,
+            "low_risk": low_risk_matches
+        },
         "high_risk_trigger": high_risk_trigger,
         "review_type": review_type,
         "review_rationale": rationale,
@@ -157,31 +341,318 @@ def compute_metrics(title: str, description: str, loc_changed: int, files_change
     }
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 5:
-        # Output JSON error shape for consistency
-        print(json.dumps({
-            "error": "Missing required arguments (title, loc, files, paths_string)",
-            "expected_args": ["title", "loc (int)", "files (int)", "paths_string (newline-separated)"],
-        }))
-        sys.exit(1)
-
-    pr_title = sys.argv[1]
+def _nul_fields(stream: BinaryIO, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    """Yield the NUL-terminated fields of a byte stream as they arrive."""
+    pending = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        fields = (pending + chunk).split(b"\0")
+        pending = fields.pop()
+        yield from fields
+    if pending:
+        yield pending
+
+
+def iter_numstat_z(stream: BinaryIO) -> Iterator[Tuple[Optional[int], Optional[int], str, Optional[str]]]:
+    """Parse `git diff --numstat -z` output incrementally.
+
+    Yields (added, deleted, path, old_path) per file. added and deleted are
+    None for binary files; old_path is set for renames and copies, which
+    -z reports as an empty path followed by the old and new paths.
+    """
+    fields = _nul_fields(stream)
+    for field in fields:
+        if not field:
+            continue
+        added, deleted, path = field.split(b"\t", 2)
+        old_path = None
+        if not path:
+            old_path = next(fields, b"").decode("utf-8", "replace")
+            path = next(fields, b"")
+        yield (
+            None if added == b"-" else int(added),
+            None if deleted == b"-" else int(deleted),
+            path.decode("utf-8", "replace"),
+            old_path,
+        )
+
+
+def collect_diff_stats(stream: BinaryIO) -> Tuple[int, int, List[str]]:
+    """LOC changed, files changed and changed paths from `git diff --numstat -z` output.
+
+    Binary files count as changed files with no LOC. A renamed file counts
+    once, and both its old and new paths are listed, so moving a file out
+    of a critical path is still a critical path change.
+    """
+    loc = 0
+    files = 0
+    paths: List[str] = []
+    for added, deleted, path, old_path in iter_numstat_z(stream):
+        files += 1
+        loc += (added or 0) + (deleted or 0)
+        if old_path is not None and old_path != path:
+            paths.append(old_path)
+        paths.append(path)
+    return loc, files, paths
+
+
+# Rules tallied by the batch summary, evaluated on compute_metrics output
+ROUTING_RULES = {
+    "high_risk_keyword": lambda m: m["high_risk_keyword"],
+    "critical_path_change": lambda m: m["critical_path_change"],
+    "loc_over_critical": lambda m: m["loc_changed"] > m["thresholds"]["critical_loc"],
+    "loc_over_simple": lambda m: m["loc_changed"] > m["thresholds"]["simple_loc"],
+    "files_over_threshold": lambda m: m["files_changed"] > m["thresholds"]["file_count"],
+    "low_risk_keyword": lambda m: m["low_risk_keyword"],
+}
+
+
+def apply_config_overrides(overrides: Dict[str, object]) -> None:
+    """Replace CONFIG entries, e.g. to backtest other thresholds."""
+    unknown = sorted(set(overrides) - set(CONFIG))
+    if unknown:
+        raise ValueError("Unknown CONFIG keys: {}".format(", ".join(unknown)))
+    CONFIG.update(overrides)
+
+
+def score_record(record: Dict[str, object]) -> Dict[str, object]:
+    """compute_metrics for one PR record of a batch.
+
+    A record has title, loc_changed and file_paths (a list, or a
+    newline-separated string as on the command line), and optionally
+    description, files_changed (defaults to the number of paths) and an
+    id that is copied to the output.
+    """
+    file_paths = record.get("file_paths") or []
+    if isinstance(file_paths, str):
+        file_paths = [p.strip() for p in file_paths.split('\n') if p.strip()]
+    if not isinstance(file_paths, list):
+        raise ValueError("file_paths must be a list or a string")
     try:
-        pr_loc = int(sys.argv[2])
-        pr_files = int(sys.argv[3])
-    except ValueError:
-        print(json.dumps({
-            "error": "LOC and Files must be integers"
-        }))
-        sys.exit(1)
+        loc_changed = int(record["loc_changed"])
+        files_changed = int(record.get("files_changed", len(file_paths)))
+    except KeyError as e:
+        raise ValueError("Missing required field {}".format(e)) from None
 
-    file_paths_string = sys.argv[4]
-    changed_paths = [p.strip() for p in file_paths_string.split('\n') if p.strip()]
+    metrics = compute_metrics(
+        str(record.get("title") or ""),
+        str(record.get("description") or ""),
+        loc_changed,
+        files_changed,
+        file_paths,
+    )
+    if "id" in record:
+        metrics = {"id": record["id"], **metrics}
+    return metrics
+
+
+def _score_line(numbered_line: Tuple[int, str]) -> Optional[Dict[str, object]]:
+    line_number, line = numbered_line
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("record must be a JSON object")
+        return score_record(record)
+    except (TypeError, ValueError) as e:
+        return {"line": line_number, "error": str(e)}
+
+
+class RoutingSummary:
+    """Aggregate routing statistics over a batch of compute_metrics results.
+
+    For each rule in ROUTING_RULES, counts the PRs it fired on per review
+    type, and how many HUMAN_AUGMENTED_LLM PRs it was the only reason for.
+    A rule that is the only reason is the one a threshold change would
+    reroute.
+    """
+
+    REVIEW_TYPES = ("LLM_ONLY", "HUMAN_AUGMENTED_LLM")
+    # Rules that send a PR to HUMAN_AUGMENTED_LLM on their own
+    BLOCKING_RULES = ("high_risk_keyword", "critical_path_change", "loc_over_simple", "files_over_threshold")
+
+    def __init__(self):
+        self.total = 0
+        self.errors = 0
+        self.review_types = dict.fromkeys(self.REVIEW_TYPES, 0)
+        self.rules = {
+            rule: {**dict.fromkeys(self.REVIEW_TYPES, 0), "sole_reason": 0}
+            for rule in ROUTING_RULES
+        }
+
+    def add(self, result: Dict[str, object]) -> None:
+        if "error" in result:
+            self.errors += 1
+            return
+        self.total += 1
+        review_type = result["review_type"]
+        self.review_types[review_type] += 1
+        fired = [rule for rule, check in ROUTING_RULES.items() if check(result)]
+        for rule in fired:
+            self.rules[rule][review_type] += 1
+        blocking = [rule for rule in fired if rule in self.BLOCKING_RULES]
+        if review_type == "HUMAN_AUGMENTED_LLM" and len(blocking) == 1:
+            self.rules[blocking[0]]["sole_reason"] += 1
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "prs": self.total,
+            "errors": self.errors,
+            "review_types": self.review_types,
+            "rules": self.rules,
+            "thresholds": {
+                "critical_loc": CONFIG["CRITICAL_LOC_THRESHOLD"],
+                "simple_loc": CONFIG["SIMPLE_LOC_THRESHOLD"],
+                "file_count": CONFIG["FILE_COUNT_THRESHOLD"]
+            }
+        }
+
+
+def score_batch(
+    lines: Iterable[str],
+    output: TextIO,
+    workers: int = 1,
+    chunk_size: int = 64,
+) -> RoutingSummary:
+    """Score a JSONL stream of PR records, writing one JSON result per line.
+
+    Results keep the input order; a malformed record yields an error line
+    instead of stopping the batch. With more than one worker, records are
+    scored in a process pool that inherits the current CONFIG.
+    """
+    summary = RoutingSummary()
+    numbered = enumerate(lines, 1)
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=apply_config_overrides, initargs=(dict(CONFIG),))
+        results = pool.imap(_score_line, numbered, chunksize=chunk_size)
+    else:
+        results = map(_score_line, numbered)
+    try:
+        for result in results:
+            if result is None:
+                continue
+            summary.add(result)
+            output.write(json.dumps(result, separators=(",", ":")))
+            output.write("\n")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return summary
+
+
+def batch_main(argv: List[str]) -> int:
+    """review_metrics.py --batch: JSONL PR records on stdin, JSONL metrics on stdout."""
+    parser = argparse.ArgumentParser(
+        prog="review_metrics.py --batch",
+        description="Score a JSONL stream of PR records read from stdin.",
+    )
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes scoring records (0 for one per CPU)")
+    parser.add_argument("--config", type=json.loads, default={},
+                        help="JSON object of CONFIG overrides, e.g. other thresholds")
+    parser.add_argument("--summary", help="write the routing summary JSON here instead of stderr")
+    args = parser.parse_args(argv)
+
+    try:
+        if not isinstance(args.config, dict):
+            raise ValueError("--config must be a JSON object")
+        apply_config_overrides(args.config)
+    except ValueError as e:
+        return _print_error(str(e))
+
+    workers = args.workers or os.cpu_count() or 1
+    summary = score_batch(sys.stdin, sys.stdout, workers=workers).as_dict()
+    document = json.dumps(summary, separators=(",", ":"))
+    if args.summary:
+        with open(args.summary, "w") as f:
+            f.write(document + "\n")
+    else:
+        print(document, file=sys.stderr)
+    return 0
+
+
+def _print_error(message: str, **extra: object) -> int:
+    # Output JSON error shape for consistency
+    print(json.dumps({"error": message, **extra}))
+    return 1
+
+
+def _diff_stats_from_git(base: str, head: str) -> Tuple[int, int, List[str]]:
+    process = subprocess.Popen(
+        ["git", "diff", "--numstat", "-z", base, head],
+        stdout=subprocess.PIPE,
+    )
+    with process:
+        stats = collect_diff_stats(process.stdout)
+    if process.returncode:
+        raise RuntimeError("git diff exited with status {}".format(process.returncode))
+    return stats
+
+
+# Modes that collect LOC, file count and paths themselves, with their arguments
+DIFF_MODES = {
+    "--numstat": ["--numstat", "title"],
+    "--git-diff": ["--git-diff", "base", "head", "title"],
+}
+
+
+def main(argv: List[str]) -> int:
+    """Score one PR and print the metrics as JSON. Accepted forms:
+
+    review_metrics.py <title> <loc> <files> <paths_string>
+    review_metrics.py --numstat <title>   (reads `git diff --numstat -z` on stdin)
+    review_metrics.py --git-diff <base> <head> <title>
+    review_metrics.py --batch [--workers N] [--config JSON] [--summary PATH]
+    """
+    if len(argv) > 1 and argv[1] == "--batch":
+        return batch_main(argv[2:])
 
     pr_description = os.environ.get("PR_DESCRIPTION", "")
 
+    if len(argv) > 1 and argv[1] in DIFF_MODES:
+        mode = argv[1]
+        if len(argv) != len(DIFF_MODES[mode]) + 1:
+            return _print_error(
+                "Wrong arguments for {}".format(mode), expected_args=DIFF_MODES[mode]
+            )
+        try:
+            if mode == "--numstat":
+                pr_loc, pr_files, changed_paths = collect_diff_stats(sys.stdin.buffer)
+            else:
+                pr_loc, pr_files, changed_paths = _diff_stats_from_git(argv[2], argv[3])
+        except (OSError, RuntimeError, ValueError) as e:
+            return _print_error("Failed to collect diff stats: {}".format(e))
+        metrics = compute_metrics(argv[-1], pr_description, pr_loc, pr_files, changed_paths)
+        print(json.dumps(metrics, separators=(",", ":")))
+        return 0
+
+    if len(argv) < 5:
+        return _print_error(
+            "Missing required arguments (title, loc, files, paths_string)",
+            expected_args=["title", "loc (int)", "files (int)", "paths_string (newline-separated)"],
+        )
+
+    pr_title = argv[1]
+    try:
+        pr_loc = int(argv[2])
+        pr_files = int(argv[3])
+    except ValueError:
+        return _print_error("LOC and Files must be integers")
+
+    file_paths_string = argv[4]
+    changed_paths = [p.strip() for p in file_paths_string.split('\n') if p.strip()]
+
     metrics = compute_metrics(pr_title, pr_description, pr_loc, pr_files, changed_paths)
 
     # Emit as compact JSON (single line) so shell parsing is simpler
     print(json.dumps(metrics, separators=(",", ":")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
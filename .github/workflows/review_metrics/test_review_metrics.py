@@ -1,3 +1,6 @@
+import fnmatch
+import io
+import json
 import sys
 from pathlib import Path
 
@@ -76,5 +79,195 @@ class ComputeMetricsTestCase(unittest.TestCase):
     self.assertFalse(result["high_risk_keyword"])
 
 
+class CriticalPathMatcherTestCase(unittest.TestCase):
+
+  PATHS = [
+    "src/main.ts",
+    "src/main.tsx",
+    "lib/src/core/x.ts",
+    "src/core/",
+    "a/b/user.authorization.ts",
+    "user.authorization.ts",
+    ".github/workflows/ci.yml",
+    "docs/Dockerfile.md",
+    "quickstart-dev.yml",
+    "quickstart-*.yml",
+    "docs/readme.md",
+    "",
+  ]
+
+  def test_same_results_as_per_pattern_fnmatch(self):
+    patterns = review_metrics.CONFIG["CRITICAL_PATHS"] + ["a[bc]?/*", "*.lock", "x?y"]
+    matcher = review_metrics.CriticalPathMatcher(patterns)
+    for path in self.PATHS + ["ab1/z", "yarn.lock", "xzy", "x?y/"]:
+      expected = [p for p in dict.fromkeys(patterns) if fnmatch.fnmatch(path, p) or p in path]
+      self.assertEqual(matcher.matching_patterns(path), expected, path)
+      self.assertEqual(matcher.matches(path), bool(expected), path)
+
+  def test_no_patterns_match_nothing(self):
+    matcher = review_metrics.CriticalPathMatcher([])
+    for path in self.PATHS:
+      self.assertFalse(matcher.matches(path), path)
+      self.assertEqual(matcher.matching_patterns(path), [], path)
+    self.assertEqual(matcher.match_paths(self.PATHS), {})
+
+  def test_metrics_report_which_patterns_matched(self):
+    result = compute(file_paths=["src/core/app.ts", "src/core/util.ts", "Dockerfile", "docs/readme.md"])
+    self.assertTrue(result["critical_path_change"])
+    self.assertEqual(result["critical_path_matches"], {
+      "Dockerfile": ["Dockerfile"],
+      "src/core/*": ["src/core/app.ts", "src/core/util.ts"],
+    })
+
+  def test_no_matches_reported_for_safe_paths(self):
+    self.assertEqual(compute()["critical_path_matches"], {})
+
+
+class KeywordMatcherTestCase(unittest.TestCase):
+
+  def test_finds_every_keyword_with_positions(self):
+    matcher = review_metrics.KeywordMatcher(["auth", "authorization", "oauth", "docs"])
+    self.assertEqual(matcher.find("oauth authorization docs"), {
+      "auth": [1, 6], "authorization": [6], "oauth": [0], "docs": [20],
+    })
+
+  def test_same_keywords_as_substring_checks(self):
+    keywords = review_metrics.CONFIG["HIGH_RISK_KEYWORDS"] + review_metrics.CONFIG["LOW_RISK_KEYWORDS"]
+    matcher = review_metrics.KeywordMatcher(keywords)
+    texts = [
+      "fix the authoring docs typo",
+      "refactor(style): whitespace in deployment notes",
+      "core logic rewrite of the securityless linter",
+      "nothing to see here",
+    ]
+    for text in texts:
+      self.assertEqual(list(matcher.find(text)), [k for k in keywords if k in text])
+
+  def test_word_boundary_mode(self):
+    matcher = review_metrics.KeywordMatcher(["auth", "refactor(style)", "lint"], word_boundary=True)
+    self.assertEqual(matcher.find("author auth_token auth, refactor(style)d linting lint"), {
+      "auth": [18], "refactor(style)": [24], "lint": [49],
+    })
+
+  def test_limit_caps_positions_per_keyword(self):
+    matcher = review_metrics.KeywordMatcher(["log", "auth"])
+    self.assertEqual(matcher.find("log " * 50 + "auth", limit=3), {"log": [0, 4, 8], "auth": [200]})
+
+  def test_metrics_report_keyword_matches(self):
+    result = compute(title="Fix auth", description="Security fix, typo in docs")
+    self.assertEqual(result["keyword_matches"], {
+      "high_risk": {"security": [9], "auth": [4]},
+      "low_risk": {"typo": [23], "docs": [31]},
+    })
+
+  def test_word_boundary_config_drops_partial_words(self):
+    saved = dict(review_metrics.CONFIG)
+    self.addCleanup(review_metrics.CONFIG.update, saved)
+    self.assertTrue(compute(description="Credit the author")["high_risk_keyword"])
+    review_metrics.CONFIG["KEYWORD_WORD_BOUNDARY"] = True
+    result = compute(description="Credit the author")
+    self.assertFalse(result["high_risk_keyword"])
+    self.assertEqual(result["review_type"], "LLM_ONLY")
+
+
+class NumstatCollectorTestCase(unittest.TestCase):
+
+  NUMSTAT = (
+    b"3\t1\tsrc/app.ts\0"
+    b"-\t-\tassets/logo.png\0"
+    b"2\t0\t\0src/core/old name.ts\0lib/new name.ts\0"
+    b"0\t0\tdocs/caf\xc3\xa9.md\0"
+  )
+
+  def test_parses_binary_and_renamed_files(self):
+    records = list(review_metrics.iter_numstat_z(io.BytesIO(self.NUMSTAT)))
+    self.assertEqual(records, [
+      (3, 1, "src/app.ts", None),
+      (None, None, "assets/logo.png", None),
+      (2, 0, "lib/new name.ts", "src/core/old name.ts"),
+      (0, 0, "docs/caf\u00e9.md", None),
+    ])
+
+  def test_fields_split_across_reads(self):
+    class Trickle(io.BytesIO):
+      def read(self, size=-1):
+        return super().read(3)
+
+    stats = review_metrics.collect_diff_stats(Trickle(self.NUMSTAT))
+    self.assertEqual(stats, review_metrics.collect_diff_stats(io.BytesIO(self.NUMSTAT)))
+
+  def test_collects_loc_files_and_paths(self):
+    loc, files, paths = review_metrics.collect_diff_stats(io.BytesIO(self.NUMSTAT))
+    self.assertEqual(loc, 6)
+    self.assertEqual(files, 4)
+    self.assertEqual(paths, [
+      "src/app.ts", "assets/logo.png", "src/core/old name.ts", "lib/new name.ts", "docs/caf\u00e9.md",
+    ])
+
+  def test_moving_a_file_out_of_a_critical_path_is_critical(self):
+    loc, files, paths = review_metrics.collect_diff_stats(io.BytesIO(self.NUMSTAT))
+    result = compute(loc_changed=loc, files_changed=files, file_paths=paths)
+    self.assertEqual(result["critical_path_matches"], {"src/core/*": ["src/core/old name.ts"]})
+
+
+class BatchScoringTestCase(unittest.TestCase):
+
+  RECORDS = [
+    {"id": 1, "title": "docs: fix typo", "loc_changed": 3, "file_paths": ["docs/readme.md"]},
+    {"id": 2, "title": "feat: new endpoint", "loc_changed": 150, "file_paths": "src/api/a.ts\nsrc/api/b.ts"},
+    {"id": 3, "title": "fix: auth token refresh", "loc_changed": 20, "file_paths": ["src/api/token.ts"]},
+    {"id": 4, "title": "chore: bump", "loc_changed": 1, "files_changed": 1, "file_paths": ["package.json"]},
+  ]
+
+  def setUp(self):
+    saved = dict(review_metrics.CONFIG)
+    self.addCleanup(review_metrics.CONFIG.update, saved)
+
+  def score(self, lines, **kwargs):
+    output = io.StringIO()
+    summary = review_metrics.score_batch(lines, output, **kwargs)
+    return [json.loads(line) for line in output.getvalue().splitlines()], summary.as_dict()
+
+  def lines(self):
+    return [json.dumps(record) + "\n" for record in self.RECORDS]
+
+  def test_results_match_single_pr_scoring_in_order(self):
+    results, _ = self.score(self.lines())
+    self.assertEqual([r["id"] for r in results], [1, 2, 3, 4])
+    self.assertEqual(results[0]["review_type"], "LLM_ONLY")
+    self.assertEqual(results[1]["file_paths"], ["src/api/a.ts", "src/api/b.ts"])
+    self.assertEqual(results[1]["files_changed"], 2)
+    expected = compute(title="fix: auth token refresh", description="", loc_changed=20, file_paths=["src/api/token.ts"])
+    self.assertEqual({k: v for k, v in results[2].items() if k != "id"}, expected)
+
+  def test_summary_counts_rules_per_review_type(self):
+    _, summary = self.score(self.lines())
+    self.assertEqual(summary["prs"], 4)
+    self.assertEqual(summary["review_types"], {"LLM_ONLY": 1, "HUMAN_AUGMENTED_LLM": 3})
+    self.assertEqual(summary["rules"]["loc_over_simple"], {"LLM_ONLY": 0, "HUMAN_AUGMENTED_LLM": 1, "sole_reason": 1})
+    self.assertEqual(summary["rules"]["high_risk_keyword"]["sole_reason"], 1)
+    self.assertEqual(summary["rules"]["critical_path_change"]["sole_reason"], 1)
+    self.assertEqual(summary["rules"]["low_risk_keyword"], {"LLM_ONLY": 1, "HUMAN_AUGMENTED_LLM": 0, "sole_reason": 0})
+
+  def test_bad_records_are_reported_and_skipped(self):
+    results, summary = self.score(["not json\n", "\n", "[1]\n", '{"title": "x"}\n', *self.lines()])
+    self.assertEqual(results[0], {"line": 1, "error": "Expecting value: line 1 column 1 (char 0)"})
+    self.assertEqual(results[1]["line"], 3)
+    self.assertEqual(results[2], {"line": 4, "error": "Missing required field 'loc_changed'"})
+    self.assertEqual((summary["prs"], summary["errors"]), (4, 3))
+
+  def test_config_overrides_reach_pool_workers(self):
+    review_metrics.apply_config_overrides({"SIMPLE_LOC_THRESHOLD": 200})
+    serial, serial_summary = self.score(self.lines())
+    pooled, pooled_summary = self.score(self.lines(), workers=2, chunk_size=1)
+    self.assertEqual(pooled, serial)
+    self.assertEqual(pooled_summary, serial_summary)
+    self.assertEqual(pooled[1]["review_type"], "LLM_ONLY")
+
+  def test_unknown_config_keys_are_rejected(self):
+    with self.assertRaises(ValueError):
+      review_metrics.apply_config_overrides({"CRITICAL_LOC": 300})
+
+
 if __name__ == "__main__":
     unittest.main()